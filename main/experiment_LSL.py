@@ -1,8 +1,18 @@
-from pylsl import StreamInfo, StreamOutlet, local_clock, resolve_byprop, StreamInlet
-from time import perf_counter
+from pylsl import StreamInfo, StreamOutlet, local_clock, StreamInlet
+from time import perf_counter, thread_time
 import threading
+import queue
 import json
+from collections import deque
 import logging
+import numpy as np
+
+from experiment_buffer import EXORingBuffer
+from experiment_shared_state import SharedState
+from experiment_wire import event_stream_info, encode_event, PredictionDecoder, TORQUE_PROFILES
+from experiment_fusion import PredictionFusion, Prediction
+from experiment_discovery import StreamDiscovery, OutageTracker
+from experiment_clock import ClockSync
 
 class LSLHandler:
     """
@@ -11,7 +21,21 @@ class LSLHandler:
     and for receiving data and predictions from the exoskeleton and classifier.
     """
 
-    def __init__(self, state_dict: dict, receive: bool=True, send: bool=True, predict: bool=False):
+    # States in which predictions from the classifier are received
+    prediction_states = {"IMAGINATION", "INTENTION", "TRIAL_UP", "TRIAL_DOWN", "MOVING_UP", "MOVING_DOWN"}
+    tracer = None       # LatencyTracer, stamps every instruction pushed to EXO if set
+    clock = staticmethod(local_clock)   # time base of prediction arrival / use times
+    prediction_fusion = None            # PredictionFusion of all prediction streams, created by get_predictions()
+    discovery = None                    # StreamDiscovery bringing up the EXO and prediction inlets
+    exo_outages = None                  # OutageTracker of the EXO stream
+    exo_inlet_replaced = False          # set when discovery swapped in a new EXO inlet, until its first sample
+    exo_stream_timeout = 0.5            # s without EXO samples before the stream is considered offline
+    clock_sync = None                   # ClockSync estimating the clock offset of every inlet
+    exo_clock = None                    # ClockOffsetTracker of the EXO inlet
+    # Events shown as a visual cue (imagine, intend, execute UP / DOWN), stamped at their first flip with flip-synced events
+    visual_events = frozenset({10, 11, 12, 20, 21, 22})
+
+    def __init__(self, state_dict: dict, receive: bool=True, send: bool=True, predict: bool=False, chunked_ingest: bool=False):
         """
         Initialize the LSLHandler class and set up all required LSL streams.
 
@@ -19,6 +43,14 @@ class LSLHandler:
         :param receive: Flag to enable receiving data from LSL stream.
         :param send: Flag to enable sending data to LSL stream.
         :param predict: Flag to enable receiving predictions from LSL stream.
+        :param chunked_ingest: Flag to drain the EXO inlet in chunks into a ring buffer instead of keeping only the newest sample.
+
+        The encoding of ExperimentEvents is set by state_dict["wire_format"] ("json" or "numeric", see experiment_wire.py),
+        the encoding of PredictionStream is detected from the stream.
+        The EXO and PredictionStream inlets are brought up by a background StreamDiscovery as soon as the streams
+        appear (and swapped when a stream restarts), so initialization never waits for them.
+        The clock offset of every inlet is tracked by a ClockSync; prediction timestamps are corrected to the
+        local clock on arrival, EXO timestamps are kept raw and corrected for logging (correct_exo_timestamps()).
         """
         logging.basicConfig(level=logging.INFO)
         logger = logging.getLogger("LSL")
@@ -27,6 +59,29 @@ class LSLHandler:
         self.timestamp_g = local_clock()
         self.missed_samples = 0
         self.previous_time = perf_counter()
+        self.chunked_ingest = chunked_ingest
+        self.event_queue = queue.Queue()
+        self.last_notified_event = 99
+        self.pushed_events = deque()     # events pushed to ExperimentEvents, for the continuous stream log
+        self.wire_format = state_dict.get("wire_format", "json")
+        self.flip_synced_events = state_dict.get("flip_synced_events", False)
+        self.pending_visual_event = None    # visual event waiting for the flip that shows it
+        self.pending_lock = threading.Lock()
+        self.flip_sync_delays = []          # s from notify_event() to the flip, per flip-synced event
+        self.unshown_visual_events = 0      # visual events replaced before a flip showed them (pushed unsynced)
+        self.prediction_window = threading.Event()
+        self.prediction_epoch = 0           # incremented every time the prediction window opens
+        self.prediction_max_age = state_dict.get("prediction_max_age", 0)     # s, 0 = no limit
+        self.prediction_metrics = []        # per used prediction: trial, transit, queueing and PC to EXO times
+        self.stale_predictions = {"previous_window": 0, "too_old": 0}
+        self.streamer_stats = {"ticks": 0, "events": 0, "missed_ticks": 0, "jitter_mean": 0.0, "jitter_max": 0.0, "cpu_load": 0.0, "forwarded_samples": 0, "forward_lost": 0}
+        # ExoEvents carries every EXO sample from the ingest buffer (pushed in chunks) instead of the newest one per interval
+        self.forward_EXO_samples = state_dict.get("forward_EXO_samples", False) and chunked_ingest and receive and send
+        self.EXO_sample_rate = state_dict.get("EXO_sample_rate", 300)      # used if the EXO stream does not report a nominal rate
+        self.outlet_events_continuous = None
+        self.last_sample_time = perf_counter()
+        self.shared = SharedState()         # hot fields read/written across threads
+        self.consumed_prediction = 0        # version of the last prediction taken by the state machine
 
         if send:
             # Create LSL stream for sending SET UP instructions to EXO
@@ -53,87 +108,211 @@ class LSLHandler:
             self.outlet_EXO = StreamOutlet(info_EXO)
             logger.info("Stream to EXO is online...")
 
-            # Create LSL stream for sending discrete events to classifier
-            info_events = StreamInfo(
-                'ExperimentEvents',     # name
-                'Events',               # type
-                1,                      # channel_count
-                0,                      # nominal rate=0 for irregular streams
-                'string',               # channel format
-                'Eduexo_PC1'            # source_id
-            )
-
-            # Add channel metadata
-            desc_events = info_events.desc()
-            channels_events = desc_events.append_child("channels")
-            channel = channels_events.append_child("channel")
-            channel.append_child_value("label", "event_marker")
-            channel.append_child_value("type", "trigger")
-            channel.append_child_value("unit", "n/a")
-
+            # Create LSL stream for sending discrete events to classifier (JSON strings or numeric samples)
+            info_events = event_stream_info(self.wire_format)
             self.outlet_events = StreamOutlet(info_events)
-            logger.info("Stream for events to classifier is online...")
-
-            # Create LSL stream for sending continuous motor data to classifier
-            info_events_continuous = StreamInfo(
-                'ExoEvents',            # name
-                'EventsContinuous',     # type
-                3,                      # channel_count
-                100,                    # nominal rate=0 for irregular streams
-                'float32',              # channel format
-                'Eduexo_PC2'            # source_id
-            )
-
-            # Add channel metadata
-            desc_continuous = info_events_continuous.desc()
-            channels_cont = desc_continuous.append_child("channels")
-
-            # Channel 1: Position
-            ch1 = channels_cont.append_child("channel")
-            ch1.append_child_value("label", "position")
-            ch1.append_child_value("type", "angle")
-            ch1.append_child_value("unit", "deg")
-
-            # Channel 2: Velocity
-            ch2 = channels_cont.append_child("channel")
-            ch2.append_child_value("label", "velocity")
-            ch2.append_child_value("type", "angular_velocity")
-            ch2.append_child_value("unit", "deg/s")
-
-            # Channel 3: Torque
-            ch3 = channels_cont.append_child("channel")
-            ch3.append_child_value("label", "torque")
-            ch3.append_child_value("type", "force")
-            ch3.append_child_value("unit", "Nm")
-
-            self.outlet_events_continuous = StreamOutlet(info_events_continuous)
-            logger.info("Stream for motor data to classifier is online...")
+            logger.info(f"Stream for events to classifier is online ({self.wire_format})...")
+
+            # Create LSL stream for sending continuous motor data to classifier. When forwarding every EXO sample,
+            # it is created by connect_exo() with the nominal rate of the EXO stream
+            self.continuous_chunk_size = state_dict.get("continuous_chunk_size", 0)
+            self.continuous_max_buffered = state_dict.get("continuous_max_buffered", 360)
+            if not self.forward_EXO_samples:
+                self.open_continuous_stream(100)
         
+        self.exo_parameters = state_dict["exo_parameters"]
+        self.exo_stream_timeout = state_dict.get("exo_stream_timeout", 0.5)
+        if receive or predict:
+            self.discovery = StreamDiscovery()
+            self.clock_sync = ClockSync()
+
         if receive:
-            # Resolve LSL stream for receiving EXO data and create an inlet
+            # EXO inlet is connected by discovery, until then EXO_stream_in reports the stream as offline
+            self.inlet = None
+            self.exo_outages = OutageTracker("EXO")
+            self.exo_clock = self.clock_sync.track("EXO")
+            if self.chunked_ingest:
+                self.exo_buffer = EXORingBuffer()
             logger.info("Looking for LSL stream of type: 'EXO'...")
-            while True:
-                streams = resolve_byprop('type', 'EXO', timeout=5)
-                if streams:
-                    break
-                logger.warning("No LSL stream found of type: 'EXO'. Retrying...")
-            self.inlet = StreamInlet(streams[0])
-            logger.info("Receiving data from EXO...")
+            self.discovery.watch('type', 'EXO', self.connect_exo)
 
         if predict:
-            # Resolve "PredictionStream" for receiving decoded events
-            logger.info("Looking for LSL stream of name: 'PredictionStream'...")
-            while True:
-                streams_p = resolve_byprop('name', 'PredictionStream', timeout=5)
-                if streams_p:
-                    break
-                logger.warning("No LSL stream found of name: 'PredictionStream'. Retrying...")
-            self.predictions_inlet = StreamInlet(streams_p[0])
-            logger.info("Receiving data from EXO...")
+            # Inlets of the "PredictionStream"s (one per classifier), connected by discovery
+            self.expected_prediction_streams = state_dict.get("prediction_streams", 1)
+            self.prediction_inlets = {}     # classifier name -> (inlet, decoder, ClockOffsetTracker)
+            self.prediction_reconnects = 0
+            self.prediction_fusion_policy = state_dict.get("prediction_fusion", "first")
+            self.prediction_fusion_window = state_dict.get("prediction_fusion_window", 0.0)
+            logger.info(f"Looking for {self.expected_prediction_streams} LSL stream(s) of name: 'PredictionStream'...")
+            self.discovery.watch('name', 'PredictionStream', self.connect_prediction_stream)
+
+        if self.discovery is not None:
+            self.discovery.start()
+            self.clock_sync.start()
 
         # Send initial setup data to EXO
         self.send_setup_data(state_dict["exo_parameters"])
         
+    def open_continuous_stream(self, nominal_rate: float):
+        """
+        Create the continuous "ExoEvents" stream of motor data for the classifier (replacing the previous one
+        if it exists, e.g. when a restarted EXO stream reports a different rate).
+
+        :param nominal_rate: Nominal rate of the stream in Hz.
+        """
+        info_events_continuous = StreamInfo(
+            'ExoEvents',            # name
+            'EventsContinuous',     # type
+            3,                      # channel_count
+            nominal_rate,           # nominal rate=0 for irregular streams
+            'float32',              # channel format
+            'Eduexo_PC2'            # source_id
+        )
+
+        # Add channel metadata
+        desc_continuous = info_events_continuous.desc()
+        channels_cont = desc_continuous.append_child("channels")
+
+        # Channel 1: Position
+        ch1 = channels_cont.append_child("channel")
+        ch1.append_child_value("label", "position")
+        ch1.append_child_value("type", "angle")
+        ch1.append_child_value("unit", "deg")
+
+        # Channel 2: Velocity
+        ch2 = channels_cont.append_child("channel")
+        ch2.append_child_value("label", "velocity")
+        ch2.append_child_value("type", "angular_velocity")
+        ch2.append_child_value("unit", "deg/s")
+
+        # Channel 3: Torque
+        ch3 = channels_cont.append_child("channel")
+        ch3.append_child_value("label", "torque")
+        ch3.append_child_value("type", "force")
+        ch3.append_child_value("unit", "Nm")
+
+        self.outlet_events_continuous = StreamOutlet(
+            info_events_continuous,
+            chunk_size      =   self.continuous_chunk_size,         # samples per transmitted chunk, 0 = one per push
+            max_buffered    =   self.continuous_max_buffered        # s buffered for slow inlets
+        )
+        self.logger.info(f"Stream for motor data to classifier is online at {nominal_rate:g} Hz ({'every EXO sample' if self.forward_EXO_samples else 'newest sample per interval'})...")
+
+    def connect_exo(self, info: StreamInfo):
+        """
+        Open an inlet to a newly discovered EXO stream and swap it in (called by discovery).
+        The EXO gets its setup data again, as a new stream instance means the EXO restarted.
+
+        :param info: StreamInfo of the EXO stream.
+        """
+        if self.chunked_ingest and info.channel_count() != self.exo_buffer.channel_count:
+            self.logger.error(f"EXO stream has {info.channel_count()} channels, expected {self.exo_buffer.channel_count}. Ignoring it.")
+            return
+        inlet = StreamInlet(info)
+        inlet.open_stream(timeout=1.0)
+        # Nominal rate reported by the EXO stream, the configured rate if it reports none (irregular stream)
+        sample_rate = info.nominal_srate() or self.EXO_sample_rate
+        self.exo_outages.nominal_rate = sample_rate
+        if self.forward_EXO_samples and (self.outlet_events_continuous is None or self.outlet_events_continuous.get_info().nominal_srate() != sample_rate):
+            self.open_continuous_stream(sample_rate)
+        replaced = self.inlet is not None
+        self.exo_clock.set_inlet(inlet)
+        self.inlet = inlet      # single assignment, the ingest picks up the new inlet on its next pull
+        self.exo_inlet_replaced = replaced
+        self.logger.info(f"{'Switched to restarted' if replaced else 'Receiving data from'} EXO stream (source '{info.source_id()}').")
+        self.send_setup_data(self.exo_parameters)
+
+    def connect_prediction_stream(self, info: StreamInfo):
+        """
+        Open an inlet to a newly discovered prediction stream (called by discovery). A stream of a classifier
+        that is already connected replaces its inlet (the classifier restarted), otherwise the classifier is added.
+
+        :param info: StreamInfo of the prediction stream.
+        """
+        inlet = StreamInlet(info)
+        inlet.open_stream(timeout=2)        # buffer predictions from now on, while the clock offset is estimated
+        full_info = inlet.info(timeout=2)
+        classifier = full_info.desc().child_value("classifier_name") or full_info.source_id() or f"PredictionStream_{len(self.prediction_inlets)}"
+        decoder = PredictionDecoder(full_info)
+        # Timestamps of predictions are converted to the local clock, so transit times can be measured.
+        # The first estimate blocks, get it before the inlet is used
+        clock = self.clock_sync.track(classifier)
+        clock.set_inlet(inlet)
+        clock.update(timeout=2)
+        replaced = classifier in self.prediction_inlets
+        self.prediction_inlets[classifier] = (inlet, decoder, clock)
+        if replaced:
+            self.prediction_reconnects += 1
+            self.logger.warning(f"Switched to restarted prediction stream of '{classifier}'.")
+        else:
+            self.logger.info(f"Receiving {'numeric' if decoder.numeric else 'JSON'} predictions from '{classifier}' ({len(self.prediction_inlets)}/{self.expected_prediction_streams}).")
+
+    def stream_summary(self):
+        """
+        :return: dict with the outages of the EXO stream and the number of restarted prediction streams.
+        """
+        summary = {}
+        if self.exo_outages is not None:
+            summary["EXO"] = self.exo_outages.summary()
+        if hasattr(self, "prediction_inlets"):
+            summary["PredictionStream"] = {"classifiers": list(self.prediction_inlets), "reconnects": self.prediction_reconnects}
+        return summary
+
+    def correct_exo_timestamps(self, timestamps):
+        """
+        Map EXO timestamps (EXO clock) to the local clock with the current offset and drift estimate.
+
+        :param timestamps: Timestamp or array of timestamps.
+        """
+        if self.exo_clock is None:
+            return timestamps
+        return self.exo_clock.correct(timestamps)
+
+    def clock_summary(self):
+        """
+        :return: dict with the offset, drift and jitter of the clock of every inlet.
+        """
+        return {} if self.clock_sync is None else self.clock_sync.summary()
+
+    def close(self):
+        """
+        Stop the background stream discovery and clock offset tracking.
+        """
+        if self.discovery is not None:
+            self.discovery.stop()
+            self.clock_sync.stop()
+
+    def exo_samples_received(self, first_timestamp: float, last_timestamp: float):
+        """
+        Report received EXO samples to the outage tracker (closes an outage or a swap of the inlet).
+        """
+        if self.exo_outages is not None:
+            self.exo_outages.samples_received(first_timestamp, last_timestamp, self.exo_inlet_replaced)
+            self.exo_inlet_replaced = False
+
+    def exo_stream_lost(self, state_dict: dict, current_time: float):
+        """
+        Mark the EXO stream offline after exo_stream_timeout s without samples and resend the setup data every 3 s
+        while it stays offline (a restarted stream is connected by discovery, which sends the setup data right away).
+
+        :param state_dict: Dictionary containing the current state information.
+        :param current_time: perf_counter() time of the check.
+        """
+        if current_time - self.last_sample_time < self.exo_stream_timeout:
+            return
+        if state_dict["stream_online"] is not False:
+            if self.inlet is None:
+                self.logger.warning("No EXO stream yet, waiting for it...")
+            else:
+                self.logger.error("Stream lost! Trying to reconnect...")
+            state_dict["current_position"] = None
+            state_dict["stream_online"] = False
+            self.shared.set_stream_online(False)
+            self.previous_time = current_time
+        elif current_time - self.previous_time >= 3 and self.inlet is not None:
+            self.previous_time = current_time
+            self.send_setup_data(state_dict["exo_parameters"])
+
     def send_setup_data(self, exo_config: dict):
         """
         Send setup data to EXO using LSL.
@@ -144,62 +323,170 @@ class LSLHandler:
         self.outlet_SETUP_EXO.push_sample([setup_EXO_data])
         self.logger.info("Setup data sent to EXO.")
 
+    def notify_event(self, state_dict: dict):
+        """
+        Queue a new event for the streamer thread if event_id changed since the last queued event.
+        Called by the state machine after every update, so events are stamped when they happen
+        and pushed immediately instead of being discovered by polling.
+
+        With flip-synced events, visual events are held back until event_shown() reports the flip that shows them.
+
+        :param state_dict: Dictionary containing the current state information.
+        """
+        event_id = state_dict["event_id"]
+        if event_id == self.last_notified_event or event_id == 99:
+            return
+        self.last_notified_event = event_id
+        event_timestamp = local_clock()
+        state_dict["event_timestamp"] = event_timestamp
+        self.shared.write_event(event_id, state_dict["event_type"], state_dict["torque_profile"], state_dict["torque_magnitude"], event_timestamp)
+        event_data = {
+            'Sample_Type': 'event',
+            'Event_ID': event_id,
+            'Event_Type': state_dict["event_type"],
+            'TorqueProfile': state_dict["torque_profile"],
+            'TorqueMagnitude': state_dict["torque_magnitude"],
+            'Event_Timestamp': event_timestamp
+        }
+        if not self.flip_synced_events:
+            self.event_queue.put(event_data)
+            return
+
+        with self.pending_lock:
+            # A visual event still waiting was never shown (replaced within a frame), push it with its own timestamp
+            if self.pending_visual_event is not None:
+                self.event_queue.put(self.pending_visual_event)
+                self.unshown_visual_events += 1
+            self.pending_visual_event = event_data if event_id in self.visual_events else None
+        if event_id not in self.visual_events:
+            self.event_queue.put(event_data)
+
+    def event_shown(self, event_id: int, flip_time: float):
+        """
+        Push the visual event held back by notify_event(), stamped with the time of the flip that first showed it.
+        Called by the FrameMonitor of the Interface on every cue onset (render thread).
+
+        :param event_id: Event ID of the cue that was shown.
+        :param flip_time: local_clock() time right after pygame.display.update() returned.
+        """
+        with self.pending_lock:
+            event_data = self.pending_visual_event
+            if event_data is None or event_data['Event_ID'] != event_id:
+                return
+            self.pending_visual_event = None
+        self.flip_sync_delays.append(flip_time - event_data['Event_Timestamp'])
+        event_data['Event_Timestamp'] = flip_time
+        self.event_queue.put(event_data)
+
+    def flip_sync_summary(self):
+        """
+        :return: dict with the number of flip-synced visual events, the shift of their markers
+                 (event to flip, ms) and the number of visual events pushed without a flip.
+        """
+        delays = list(self.flip_sync_delays)
+        summary = {"synced_events": len(delays), "unshown_events": self.unshown_visual_events}
+        if delays:
+            summary["shift_mean_ms"] = round(1000 * sum(delays) / len(delays), 3)
+            summary["shift_max_ms"] = round(1000 * max(delays), 3)
+        return summary
+
+    def drain_pushed_events(self):
+        """
+        Return (and forget) all events pushed to the ExperimentEvents stream since the last call.
+
+        :return: List of event dictionaries with their push timestamps.
+        """
+        events = []
+        while self.pushed_events:
+            events.append(self.pushed_events.popleft())
+        return events
+
     def stream_events_data(self, stop_event: threading.Event, state_dict: dict, the_lock: threading.Lock):
         """
-        Continuously stream position/torque data (at a fixed interval)
-        and send an 'event' every time a new event occurs using LSL.
+        Stream position/velocity/torque data on a fixed schedule (sleeping until the next tick,
+        with deadlines kept on an absolute grid to avoid drift) and push every event queued
+        by notify_event() as soon as it arrives.
+        With forward_EXO_samples, every tick pushes all EXO samples received since the previous one
+        as a single chunk, each with its own timestamp (corrected to the local clock like the events);
+        otherwise the newest sample is pushed, stamped with the tick time.
 
         :param stop_event: Event to signal stopping the streaming.
-        :param state_dict: Dictionary containing the current state information.
+        :param state_dict: Dictionary containing the current state information (configuration only,
+                           EXO data is read from the shared state).
         :param the_lock: Lock to synchronize access to shared resources.
         """
         # Configuration
         data_interval = state_dict["data_stream_interval"]  # how often we send 'data' samples
-        last_data_time = perf_counter()
-        old_event = 99
+        shared = self.shared
+        stats = self.streamer_stats
+        start_time = perf_counter()
+        start_cpu = thread_time()
+        next_tick = start_time + data_interval
         self.timestamp_g = local_clock()
+        if self.forward_EXO_samples:
+            forward_cursor = self.exo_buffer.write_count
 
         while not stop_event.is_set():
-            if state_dict["stream_online"]:
-                try:
-                    # 1) Stream position/torque (data) at regular intervals
-                    current_time = perf_counter()
-                    self.timestamp = local_clock()
-                    with the_lock:
-                        self.timestamp_g = self.timestamp
-                    if current_time - last_data_time >= data_interval:
-                        position = state_dict["current_position"]   # current position
-                        velocity = state_dict["current_velocity"]   # current velocity
-                        torque = state_dict["current_torque"]       # current torque
+            # Sleep until the next data tick, waking up early if an event is queued
+            try:
+                event_data = self.event_queue.get(timeout=max(0, next_tick - perf_counter()))
+            except queue.Empty:
+                event_data = None
+
+            try:
+                # 1) Send an event as soon as it is queued
+                if event_data is not None:
+                    if shared.stream_online:
+                        event_sample = encode_event(event_data, self.wire_format)
+                        self.outlet_events.push_sample(event_sample, timestamp=event_data['Event_Timestamp'])
+                        self.pushed_events.append(event_data)
+                        self.logger.info(event_sample[0] if self.wire_format == "json" else event_data)
+                        stats["events"] += 1
+                    continue
+
+                # 2) Stream position/torque (data) at regular intervals
+                current_time = perf_counter()
+                jitter = current_time - next_tick
+                self.timestamp = local_clock()
+                with the_lock:
+                    self.timestamp_g = self.timestamp
+                if self.forward_EXO_samples:
+                    samples, timestamps, forward_cursor, lost = self.exo_buffer.read_since(forward_cursor)
+                    stats["forward_lost"] += lost
+                    if len(timestamps):
+                        chunk = np.ascontiguousarray(samples[:, :3], dtype=np.float32)     # position, velocity, torque
+                        self.outlet_events_continuous.push_chunk(chunk, timestamp=self.correct_exo_timestamps(timestamps).tolist())
+                        stats["forwarded_samples"] += len(timestamps)
+                else:
+                    position, velocity, torque, _, _, _, _, _, stream_online = shared.read_kinematics()
+                    if stream_online:
                         sample = [position, velocity, torque]
                         self.outlet_events_continuous.push_sample(sample, timestamp=self.timestamp)
                         # self.logger.info(sample)
 
-                        last_data_time = current_time
-
-                    # 2) Send an event once every time a new event happens
-                    if old_event != state_dict["event_id"] and not state_dict["event_id"] == 99:
-                        event_id = state_dict["event_id"]
-                        event_type = state_dict["event_type"]
-                        torque_profile = state_dict["torque_profile"]
-                        torque_magnitude = state_dict["torque_magnitude"]
-                        event_data = {
-                            'Sample_Type': 'event',
-                            'Event_ID': event_id,
-                            'Event_Type': event_type,
-                            'TorqueProfile': torque_profile,
-                            'TorqueMagnitude': torque_magnitude,
-                            'Event_Timestamp': self.timestamp
-                        }
-                        event_json_str = json.dumps(event_data)
-                        self.outlet_events.push_sample([event_json_str], timestamp=self.timestamp)
-                        self.logger.info(event_json_str)
-                        old_event = state_dict["event_id"]
-
-                except Exception as e:
-                    self.logger.error(f"Error in streaming Events data: {e}")
-
-        self.logger.info("Stopped streaming Events data.")
+                # Keep deadlines on the original grid; skip ticks if we fell behind
+                next_tick += data_interval
+                if current_time > next_tick:
+                    missed = int((current_time - next_tick) / data_interval) + 1
+                    stats["missed_ticks"] += missed
+                    next_tick += missed * data_interval
+
+                stats["ticks"] += 1
+                stats["jitter_mean"] += (jitter - stats["jitter_mean"]) / stats["ticks"]
+                stats["jitter_max"] = max(stats["jitter_max"], jitter)
+
+            except Exception as e:
+                self.logger.error(f"Error in streaming Events data: {e}")
+
+            wall_time = perf_counter() - start_time
+            stats["cpu_load"] = (thread_time() - start_cpu) / wall_time if wall_time > 0 else 0
+
+        self.logger.info(
+            f"Stopped streaming Events data. {stats['ticks']} data ticks ({stats['forwarded_samples']} EXO samples forwarded, "
+            f"{stats['forward_lost']} lost), {stats['events']} events, "
+            f"{stats['missed_ticks']} missed ticks, jitter mean {1000 * stats['jitter_mean']:.3f} ms / "
+            f"max {1000 * stats['jitter_max']:.3f} ms, CPU load {100 * stats['cpu_load']:.1f} %."
+        )
 
     def EXO_stream_in(self, state_dict: dict):
         """
@@ -207,23 +494,29 @@ class LSLHandler:
 
         :param state_dict: Dictionary containing the current state information.
         """
+        if self.chunked_ingest:
+            self.EXO_stream_in_chunked(state_dict)
+            return
+
         # Receive data from EXO
         current_time = perf_counter()
-        self.inlet.flush()    
-        sample, timestamp = self.inlet.pull_sample(timeout=0.1)
+        inlet = self.inlet
+        if inlet is None:
+            sample = None
+        else:
+            inlet.flush()
+            sample, timestamp = inlet.pull_sample(timeout=0.1)
 
         if sample is None:
             self.missed_samples += 1
-            # Consider stream offline if we miss N consecutive samples
-            if self.missed_samples >= 50:
-                if current_time - self.previous_time >= 3:
-                    self.logger.error("Stream lost! Trying to reconnect...")
-                    state_dict["current_position"] = None
-                    state_dict["stream_online"] = False
-                    self.previous_time = current_time
-                    self.send_setup_data(state_dict["exo_parameters"])
+            self.exo_stream_lost(state_dict, current_time)
         else:
             self.missed_samples = 0  # Reset counter if we got a sample
+            self.last_sample_time = current_time
+            self.exo_samples_received(timestamp, timestamp)
+            self.shared.write_kinematics(sample, timestamp)
+            if self.tracer is not None:
+                self.tracer.sample_received(self.correct_exo_timestamps(timestamp))
             state_dict["stream_online"] = True
             state_dict["current_position"] = round(sample[0], 5)
             state_dict["current_velocity"] = round(sample[1], 5)
@@ -233,6 +526,49 @@ class LSLHandler:
             state_dict["demanded_torque"] = round(sample[5], 5)
             state_dict["measured_torque"] = round(sample[6], 5)
 
+    def EXO_stream_in_chunked(self, state_dict: dict, max_chunk: int = 1024):
+        """
+        Drain all samples waiting in the EXO inlet into the ring buffer without blocking
+        and update the state dictionary with the newest one.
+
+        :param state_dict: Dictionary containing the current state information.
+        :param max_chunk: Maximum number of samples pulled with a single pull_chunk call.
+        :return: Number of new samples received.
+        """
+        current_time = perf_counter()
+        inlet = self.inlet
+        received = 0
+        first_timestamp = None
+        while inlet is not None:
+            samples, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=max_chunk)
+            received += self.exo_buffer.append_chunk(samples, timestamps)
+            if first_timestamp is None and timestamps:
+                first_timestamp = timestamps[0]
+            if len(timestamps) < max_chunk:
+                break
+
+        if received == 0:
+            self.exo_stream_lost(state_dict, current_time)
+            return 0
+
+        self.last_sample_time = current_time
+        sample, timestamp = self.exo_buffer.latest()
+        self.exo_samples_received(first_timestamp, timestamp)
+        sample = sample.tolist()
+        self.shared.write_kinematics(sample, timestamp)
+        if self.tracer is not None:
+            self.tracer.sample_received(self.correct_exo_timestamps(timestamp))
+        state_dict["stream_online"] = True
+        state_dict["current_position"] = round(sample[0], 5)
+        state_dict["current_velocity"] = round(sample[1], 5)
+        state_dict["current_torque"] = round(sample[2], 5)
+        state_dict["exo_execution"] = sample[3]
+        state_dict["desired_torque"] = round(sample[4], 5)
+        state_dict["demanded_torque"] = round(sample[5], 5)
+        state_dict["measured_torque"] = round(sample[6], 5)
+        state_dict["EXO_timestamp"] = timestamp
+        return received
+
     def EXO_stream_out(self, state_dict: dict = None, torque_profile: int = 1, torque_magnitude: float = 1, correctness: int = 1, trial_over = False, experiment_over = False):
         """
         Send a TorqueProfile, direction, and Correctness once every time a new event happens.
@@ -275,18 +611,106 @@ class LSLHandler:
         # Send instructions data to EXO
         instructions_data = [int(torque_profile), int(correctness), int(direction), float(torque_magnitude)]
         self.outlet_EXO.push_sample(instructions_data)
+        if self.tracer is not None:
+            self.tracer.instruction_sent()
 
         # Update state_dict with human-readable info if not ending trial/experiment
         if not experiment_over and not trial_over:
             # Map torque profile index to its corresponding name for display/logging
-            t_profile_dict = {0: "trapezoid", 1: "triangular", 2: "sinusoide", 3: "rectangular", 4: "smoothed_trapezoid"}
-            state_dict["torque_profile"] = t_profile_dict[torque_profile]
+            state_dict["torque_profile"] = TORQUE_PROFILES[int(torque_profile)]
             state_dict["torque_magnitude"] = float(torque_magnitude)
             state_dict["correctness"] = correctness
 
+    def update_prediction_window(self, current_state: str):
+        """
+        Open or close the window in which predictions are received, based on the current state.
+        Wakes up the prediction thread as soon as a relevant state is entered.
+
+        :param current_state: Name of the current state of the state machine.
+        """
+        if current_state in self.prediction_states:
+            if not self.prediction_window.is_set():
+                self.prediction_epoch += 1
+                self.prediction_window.set()
+        elif self.prediction_window.is_set():
+            self.prediction_window.clear()
+
+    def take_prediction(self, state_dict: dict):
+        """
+        Copy a prediction published by the prediction thread into the state dictionary, if there
+        is one the state machine has not taken yet. Only the control thread writes the state dictionary.
+        Predictions received in an earlier prediction window (previous trial phase) or older than
+        prediction_max_age are dropped and counted in stale_predictions.
+
+        :param state_dict: Dictionary containing the current state information.
+        :return: True if a new prediction was taken.
+        """
+        prediction, arrival_time, timestamp, epoch, version = self.shared.read_prediction()
+        if version == self.consumed_prediction:
+            return False
+        self.consumed_prediction = version
+
+        now = self.clock()
+        if epoch != self.prediction_epoch:
+            self.stale_predictions["previous_window"] += 1
+            self.logger_predictions.warning(f"Prediction '{prediction}' from a previous prediction window dropped.")
+            return False
+        age = now - (arrival_time if timestamp is None else timestamp)
+        if self.prediction_max_age > 0 and age > self.prediction_max_age:
+            self.stale_predictions["too_old"] += 1
+            self.logger_predictions.warning(f"Prediction '{prediction}' dropped, {1000 * age:.1f} ms old (max {1000 * self.prediction_max_age:.0f} ms).")
+            return False
+
+        state_dict["prediction"] = prediction
+        state_dict["prediction_arrival_time"] = arrival_time
+        state_dict["prediction_timestamp"] = timestamp
+        state_dict["prediction_taken_time"] = now
+        return True
+
+    def record_prediction_consumed(self, state_dict: dict):
+        """
+        Record the latencies of a prediction that was acted upon (call right after EXO_stream_out):
+        decoder to PC transit (decoder timestamp to arrival), PC queueing (arrival to use by the
+        state machine) and PC to EXO (use to the instruction being pushed).
+
+        :param state_dict: Dictionary containing the current state information.
+        """
+        now = self.clock()
+        arrival_time = state_dict["prediction_arrival_time"]
+        timestamp = state_dict.get("prediction_timestamp")
+        metrics = {
+            "trial": state_dict["current_trial_No"],
+            "prediction": state_dict["prediction"],
+            "transit_ms": None if timestamp is None else round(1000 * (arrival_time - timestamp), 3),
+            "queueing_ms": round(1000 * (state_dict["prediction_taken_time"] - arrival_time), 3),
+            "pc_to_exo_ms": round(1000 * (now - state_dict["prediction_taken_time"]), 3),
+        }
+        self.prediction_metrics.append(metrics)
+        self.logger_predictions.info(
+            f"Trial {metrics['trial']}: prediction '{metrics['prediction']}' used, transit {metrics['transit_ms']} ms, "
+            f"queueing {metrics['queueing_ms']} ms, PC to EXO {metrics['pc_to_exo_ms']} ms."
+        )
+
+    def prediction_summary(self):
+        """
+        :return: dict with the number of used and dropped predictions and the mean / max of every latency in ms.
+        """
+        summary = {"used": len(self.prediction_metrics), "dropped": dict(self.stale_predictions)}
+        if self.prediction_fusion is not None:
+            summary["fusion"] = {"policy": self.prediction_fusion.policy.name, "classifiers": list(self.prediction_fusion.buffers), "decisions": len(self.prediction_fusion.decisions)}
+            summary["reconnects"] = self.prediction_reconnects
+        for name in ("transit_ms", "queueing_ms", "pc_to_exo_ms"):
+            values = [metrics[name] for metrics in self.prediction_metrics if metrics[name] is not None]
+            if values:
+                summary[name] = {"mean": round(sum(values) / len(values), 3), "max": max(values)}
+        return summary
+
     def get_predictions(self, stop_event: threading.Event, state_dict: dict = None, verbose: bool=False):
         """
-        Continuously receive predictions from the EXO and update the state dictionary.
+        Receive predictions from all classifiers during trial states, fuse them into one decision per
+        prediction window and publish it in the shared state (taken by the state machine with take_prediction()).
+        Every prediction stream is read by its own thread, blocking on the inlet (and on the prediction
+        window between trials) instead of polling, so the threads are idle unless a prediction is expected.
 
         :param stop_event: Event to signal stopping the prediction receiving.
         :param state_dict: Dictionary containing the current state information.
@@ -294,23 +718,64 @@ class LSLHandler:
         """
         if state_dict is None:
             state_dict = {}
-        previous_time = perf_counter()
+
+        def publish(decision, arrival_time, timestamp, epoch):
+            if state_dict["activate_EXO"]:
+                # Publish the predicted event name (e.g., "UP" or "DOWN")
+                self.shared.write_prediction(decision, arrival_time, timestamp, epoch)
+
+        self.prediction_fusion = PredictionFusion(
+            list(self.prediction_inlets),
+            policy  =   self.prediction_fusion_policy,
+            window  =   self.prediction_fusion_window,
+            publish =   publish
+        )
+        # One receiver per classifier, started as soon as discovery connects its stream
+        receivers = {}
         while not stop_event.is_set():
-            self.predictions_inlet.flush()
-            recieved = False
-            # Only receive predictions during relevant experiment states
-            while state_dict["current_state"] in {"IMAGINATION", "INTENTION", "TRIAL_UP", "TRIAL_DOWN", "MOVING_UP", "MOVING_DOWN"} and not stop_event.is_set():
-                current_time = perf_counter()
-                # Limit prediction polling rate to 200 Hz
-                if current_time - previous_time >= 1/200:
-                    sample, timestamp = self.predictions_inlet.pull_sample(timeout=0.1)
-                    if sample is not None and len(sample) > 0:
-                        prediction_data = json.loads(sample[0])  # Parse JSON string from LSL
-                        if not recieved:
-                            if state_dict["activate_EXO"]:
-                                # Update state_dict with the predicted event name (e.g., "UP" or "DOWN")
-                                state_dict["prediction"] = prediction_data["predicted_event_name"]
-                            recieved = True
-                            if verbose:
-                                self.logger_predictions.info(prediction_data)
-                    previous_time = current_time
+            for classifier in list(self.prediction_inlets):
+                if classifier not in receivers:
+                    self.prediction_fusion.add_classifier(classifier)
+                    receivers[classifier] = threading.Thread(target=self.receive_predictions, args=(classifier, stop_event, verbose), daemon=True)
+                    receivers[classifier].start()
+            stop_event.wait(0.1)
+        for receiver in receivers.values():
+            receiver.join()
+
+        self.logger_predictions.info(f"Stopped receiving predictions. {self.prediction_summary()}")
+
+    def receive_predictions(self, classifier: str, stop_event: threading.Event, verbose: bool=False):
+        """
+        Receive the predictions of one classifier and add them to the prediction fusion (runs on its own thread).
+        The classifier's inlet is looked up again for every prediction window, so a restarted stream swapped in
+        by discovery is picked up.
+
+        :param classifier: Name of the classifier.
+        :param stop_event: Event to signal stopping the prediction receiving.
+        :param verbose: Flag to enable verbose logging of predictions.
+        """
+        fusion = self.prediction_fusion
+        epoch = None
+        while not stop_event.is_set():
+            # Sleep until a trial state opens the prediction window
+            if not self.prediction_window.wait(timeout=0.5):
+                continue
+            inlet, decoder, clock = self.prediction_inlets[classifier]
+            if epoch != self.prediction_epoch:
+                inlet.flush()   # drop predictions made outside the window
+                epoch = self.prediction_epoch
+            while self.prediction_window.is_set() and epoch == self.prediction_epoch and inlet is self.prediction_inlets[classifier][0] and not stop_event.is_set():
+                # Block until the first prediction arrives, then drain whatever else is waiting
+                sample, timestamp = inlet.pull_sample(timeout=0.1)
+                if sample is None:
+                    fusion.poll(epoch, self.clock())    # the fusion window may have passed without new predictions
+                    continue
+                arrival_time = self.clock()
+                samples, timestamps = inlet.pull_chunk(timeout=0.0)
+                for sample, raw_timestamp in zip([sample] + samples, [timestamp] + timestamps):
+                    if len(sample) == 0:
+                        continue
+                    predicted_event_name, confidence, decoder_timestamp = decoder.decode(sample)
+                    fusion.add(Prediction(classifier, predicted_event_name, confidence, clock.correct(raw_timestamp), arrival_time, epoch, raw_timestamp))
+                    if verbose:
+                        self.logger_predictions.info(f"{classifier}: {predicted_event_name} (confidence {confidence}, decoder timestamp {decoder_timestamp})" if decoder.numeric else f"{classifier}: {sample[0]}")
@@ -0,0 +1,94 @@
+import threading
+import numpy as np
+
+class EXORingBuffer:
+    """
+    Preallocated ring buffer holding every sample received from the EXO stream.
+    The control loop reads the latest sample without blocking, while the logger
+    reads all samples received since its last read (lossless as long as it keeps
+    up with the buffer capacity).
+    """
+
+    # Channel layout of the EXO stream
+    channels = (
+        "current_position",
+        "current_velocity",
+        "current_torque",
+        "exo_execution",
+        "desired_torque",
+        "demanded_torque",
+        "measured_torque",
+    )
+
+    def __init__(self, capacity: int = 65536, channel_count: int = 7):
+        """
+        Initialize the EXORingBuffer class.
+
+        :param capacity: Number of samples kept in the buffer (~3.5 min at 300 Hz by default).
+        :param channel_count: Number of channels in a single EXO sample.
+        """
+        self.capacity = capacity
+        self.channel_count = channel_count
+        self.data = np.zeros((capacity, channel_count), dtype=np.float64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.write_count = 0    # total number of samples ever written
+        self.lock = threading.Lock()
+
+    def append_chunk(self, samples, timestamps):
+        """
+        Copy a chunk of samples (as returned by StreamInlet.pull_chunk) into the buffer.
+
+        :param samples: List (or 2D array) of samples, each with channel_count values.
+        :param timestamps: List of LSL timestamps, one per sample.
+        :return: Number of samples written.
+        """
+        n = len(timestamps)
+        if n == 0:
+            return 0
+        chunk = np.asarray(samples, dtype=np.float64)[-self.capacity:, :self.channel_count]
+        chunk_timestamps = np.asarray(timestamps, dtype=np.float64)[-self.capacity:]
+        n_kept = len(chunk_timestamps)
+
+        with self.lock:
+            start = (self.write_count + n - n_kept) % self.capacity
+            end = start + n_kept
+            if end <= self.capacity:
+                self.data[start:end] = chunk
+                self.timestamps[start:end] = chunk_timestamps
+            else:
+                split = self.capacity - start
+                self.data[start:] = chunk[:split]
+                self.data[:end - self.capacity] = chunk[split:]
+                self.timestamps[start:] = chunk_timestamps[:split]
+                self.timestamps[:end - self.capacity] = chunk_timestamps[split:]
+            self.write_count += n
+        return n
+
+    def latest(self):
+        """
+        Return the most recent sample without blocking.
+
+        :return: tuple (sample, timestamp), or (None, None) if the buffer is empty.
+        """
+        with self.lock:
+            if self.write_count == 0:
+                return None, None
+            idx = (self.write_count - 1) % self.capacity
+            return self.data[idx].copy(), float(self.timestamps[idx])
+
+    def read_since(self, cursor: int):
+        """
+        Return all samples written after the given cursor.
+
+        :param cursor: Value of write_count at the previous read (0 for the first read).
+        :return: tuple (samples, timestamps, new_cursor, lost), where lost is the number of
+                 samples overwritten before they could be read.
+        """
+        with self.lock:
+            write_count = self.write_count
+            lost = max(0, write_count - cursor - self.capacity)
+            first = cursor + lost
+            idx = np.arange(first, write_count) % self.capacity
+            samples = self.data[idx]
+            timestamps = self.timestamps[idx]
+        return samples, timestamps, write_count, lost
@@ -0,0 +1,165 @@
+import threading
+import logging
+from collections import deque
+import numpy as np
+from pylsl import local_clock
+
+class ClockOffsetTracker:
+    """
+    Clock offset of one LSL inlet: collects the inlet's time_correction() estimates, fits offset and
+    drift over the most recent ones and maps timestamps of the source's clock to the local clock.
+    Estimates of a previous stream instance are dropped when the inlet is replaced (the source restarted,
+    its clock may have been reset), the session summary still covers all of them.
+    """
+
+    def __init__(self, name: str, window: int = 30, clock=local_clock):
+        """
+        Initialize the ClockOffsetTracker class.
+
+        :param name: Name of the inlet (for the log and summary).
+        :param window: Number of most recent estimates the offset and drift are fitted to.
+        :param clock: Function returning the local time in s (default pylsl.local_clock).
+        """
+        self.name = name
+        self.clock = clock
+        self.inlet = None
+        self.window = deque(maxlen=window)      # (local time, offset) of the current stream instance
+        self.estimates = []                     # (local time, offset, residual to the fit) of the session
+        self.fit = None                         # (t0, offset at t0, drift in s/s), None until the first estimate
+        self.resets = 0
+        self.failed = 0
+        self.logger = logging.getLogger("ClockSync")
+
+    def set_inlet(self, inlet):
+        """
+        Track a new inlet (or the replacement of the current one), dropping the estimates of the previous one.
+        """
+        if self.inlet is not None:
+            self.resets += 1
+        self.window.clear()
+        self.inlet = inlet
+
+    def update(self, timeout: float = 2.0):
+        """
+        Get the current time_correction() estimate of the inlet and refit. liblsl refreshes the estimate
+        in the background every few seconds, repeated values are not added again.
+
+        :param timeout: Timeout (s) for the first estimate of an inlet.
+        :return: True if a new estimate was added.
+        """
+        inlet = self.inlet
+        if inlet is None:
+            return False
+        try:
+            offset = inlet.time_correction(timeout=timeout)
+        except Exception:     # TimeoutError, or pylsl's LostError while the source is gone
+            self.failed += 1
+            return False
+        if inlet is not self.inlet or (self.window and self.window[-1][1] == offset):
+            return False
+        now = self.clock()
+        self.window.append((now, offset))
+        self.refit()
+        t0, offset0, drift = self.fit
+        self.estimates.append((now, offset, offset - (offset0 + drift * (now - t0))))     # residual to the fit
+        return True
+
+    def refit(self):
+        """
+        Fit offset(t) = offset0 + drift * (t - t0) to the estimates in the window (least squares).
+        """
+        times, offsets = np.array(self.window).T
+        t0 = times[-1]
+        if len(times) < 3:
+            self.fit = (float(t0), float(offsets.mean()), 0.0)
+            return
+        drift, offset0 = np.polyfit(times - t0, offsets, 1)
+        self.fit = (float(t0), float(offset0), float(drift))
+
+    def correct(self, timestamps):
+        """
+        Map timestamps of the source's clock to the local clock. Timestamps are returned unchanged
+        until the first estimate arrived.
+
+        :param timestamps: Timestamp or array of timestamps (source clock).
+        :return: Corrected timestamp(s) (local clock).
+        """
+        fit = self.fit
+        if fit is None:
+            return timestamps
+        t0, offset0, drift = fit
+        # Drift is evaluated at the (approximate) local time of the timestamp
+        return timestamps + offset0 + drift * (timestamps + offset0 - t0)
+
+    def summary(self):
+        """
+        :return: dict with the number of estimates, mean / min / max offset, drift (ppm) and jitter
+                 (std / max of the estimates around the fit) in ms.
+        """
+        summary = {"estimates": len(self.estimates), "resets": self.resets, "failed": self.failed}
+        if self.estimates:
+            _, offsets, residuals = np.array(self.estimates).T
+            summary["offset_ms"] = {"mean": round(1000 * float(offsets.mean()), 3), "min": round(1000 * float(offsets.min()), 3), "max": round(1000 * float(offsets.max()), 3)}
+            summary["drift_ppm"] = round(1e6 * float(self.fit[2]), 3)
+            summary["jitter_ms"] = {"std": round(1000 * float(residuals.std()), 3), "max": round(1000 * float(np.abs(residuals).max()), 3)}
+        return summary
+
+class ClockSync:
+    """
+    Background thread updating the ClockOffsetTracker of every inlet periodically.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        """
+        Initialize the ClockSync class.
+
+        :param interval: Time (s) between updates of the trackers.
+        """
+        self.interval = interval
+        self.trackers = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def track(self, name: str):
+        """
+        Return the tracker of an inlet, creating it if it does not exist yet.
+        """
+        if name not in self.trackers:
+            self.trackers[name] = ClockOffsetTracker(name)
+        return self.trackers[name]
+
+    def start(self):
+        """
+        Start the update thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the update thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        """
+        Update all trackers every interval until stopped.
+        """
+        while not self.stop_event.is_set():
+            for tracker in list(self.trackers.values()):
+                tracker.update()
+            self.stop_event.wait(self.interval)
+
+    def summary(self):
+        """
+        :return: dict of the summaries of all trackers.
+        """
+        return {name: tracker.summary() for name, tracker in self.trackers.items()}
+
+    def estimates(self):
+        """
+        :return: dict of the (local time, offset, residual) estimates of all trackers.
+        """
+        return {name: tracker.estimates for name, tracker in self.trackers.items()}
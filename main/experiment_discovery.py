@@ -0,0 +1,149 @@
+import threading
+import logging
+from pylsl import resolve_streams, local_clock
+
+class StreamDiscovery:
+    """
+    Background discovery of LSL streams: the available streams are resolved continuously in short waves,
+    and every watched stream instance that was not seen before (new uid, e.g. after the sender restarted)
+    is handed to the watch's connect callback, which opens an inlet and swaps it in. Nothing blocks the
+    caller, streams are brought up whenever they appear.
+    The waves are run here instead of using pylsl's ContinuousResolver, whose results are only refreshed
+    every 0.5-1 s, which would be most of the time to reconnect.
+    """
+
+    def __init__(self, wave_time: float = 0.1, idle_time: float = 0.1):
+        """
+        Initialize the StreamDiscovery class.
+
+        :param wave_time: Duration (s) of a single resolve wave (streams on the network answer within it).
+        :param idle_time: Pause (s) between waves, so the network is not queried continuously.
+        """
+        self.wave_time = wave_time
+        self.idle_time = idle_time
+        self.watches = []           # (prop, value, connect callback, uids seen)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger("Discovery")
+
+    def watch(self, prop: str, value: str, connect):
+        """
+        Start looking for streams with the given property.
+
+        :param prop: Stream property to match ("name", "type" or "source_id").
+        :param value: Value of the property.
+        :param connect: Function called with the StreamInfo of every new stream instance (on a thread of its own,
+                        so a slow connect, e.g. the first clock offset estimate, does not delay other streams).
+        """
+        with self.lock:
+            self.watches.append((prop, value, connect, set()))
+
+    def start(self):
+        """
+        Start the discovery thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the discovery thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        """
+        Resolve the available streams and connect new instances of the watched ones until stopped.
+        """
+        while not self.stop_event.is_set():
+            # Newest streams first, so a restarted sender replaces the one it restarted from
+            infos = sorted(resolve_streams(wait_time=self.wave_time), key=lambda info: info.created_at(), reverse=True)
+            with self.lock:
+                watches = list(self.watches)
+            for prop, value, connect, seen in watches:
+                for info in infos:
+                    if getattr(info, prop)() != value:
+                        continue
+                    with self.lock:
+                        if info.uid() in seen:
+                            continue
+                        # Marked while connecting, so the next waves do not connect again; released if it fails
+                        seen.add(info.uid())
+                    self.logger.info(f"Found LSL stream {prop}='{value}' (source '{info.source_id()}', uid {info.uid()}).")
+                    threading.Thread(target=self.connect, args=(connect, info, f"{prop}='{value}'", seen), daemon=True).start()
+            self.stop_event.wait(self.idle_time)
+
+    def connect(self, connect, info, description: str, seen: set):
+        """
+        Run a watch's connect callback, logging instead of raising errors. A stream instance that could not
+        be connected (e.g. it was still coming up) is retried by a later wave.
+        """
+        try:
+            connect(info)
+        except Exception as e:
+            with self.lock:
+                seen.discard(info.uid())
+            self.logger.error(f"Could not connect to LSL stream {description}, retrying: {e}")
+
+class OutageTracker:
+    """
+    Records the outages of a stream, detected as gaps between the timestamps of consecutive received samples:
+    how long it took from the last sample before the gap until the first sample after it arrived (from the
+    recovered inlet or a replacement stream), and how many samples were lost in between (from the nominal rate).
+    """
+
+    def __init__(self, name: str, max_gap: float = 0.1, clock=local_clock):
+        """
+        Initialize the OutageTracker class.
+
+        :param name: Name of the stream (for the log).
+        :param max_gap: Gap (s) between consecutive sample timestamps above which it counts as an outage.
+        :param clock: Function returning the current time in s (default pylsl.local_clock).
+        """
+        self.name = name
+        self.max_gap = max_gap
+        self.clock = clock
+        self.nominal_rate = 0.0
+        self.last_sample_time = None
+        self.last_timestamp = None
+        self.outages = []
+        self.logger = logging.getLogger("Discovery")
+
+    def samples_received(self, first_timestamp: float, last_timestamp: float, replaced: bool = False):
+        """
+        Report received samples; records an outage if they follow a gap.
+
+        :param first_timestamp: LSL timestamp of the first received sample.
+        :param last_timestamp: LSL timestamp of the last received sample.
+        :param replaced: True if the samples came from a newly connected stream instance.
+        """
+        now = self.clock()
+        if self.last_timestamp is not None and first_timestamp - self.last_timestamp > self.max_gap:
+            gap = first_timestamp - self.last_timestamp
+            outage = {
+                "stream": self.name,
+                "start": self.last_sample_time,
+                "time_to_reconnect_ms": round(1000 * (now - self.last_sample_time), 1),
+                "samples_lost": max(0, int(round(gap * self.nominal_rate)) - 1) if self.nominal_rate > 0 else None,
+                "replaced": replaced,
+            }
+            self.outages.append(outage)
+            self.logger.warning(f"{self.name} stream back after {outage['time_to_reconnect_ms']} ms, {outage['samples_lost']} samples lost.")
+        self.last_sample_time = now
+        self.last_timestamp = last_timestamp
+
+    def summary(self):
+        """
+        :return: dict with the number of outages and their mean / max time to reconnect and samples lost.
+        """
+        summary = {"outages": len(self.outages)}
+        if self.outages:
+            times = [outage["time_to_reconnect_ms"] for outage in self.outages]
+            summary["time_to_reconnect_ms"] = {"mean": round(sum(times) / len(times), 1), "max": max(times)}
+            lost = [outage["samples_lost"] for outage in self.outages if outage["samples_lost"] is not None]
+            if lost:
+                summary["samples_lost"] = sum(lost)
+        return summary
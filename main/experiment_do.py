@@ -1,13 +1,19 @@
+import os
 import json
 import pygame
 import threading
 import logging
 import argparse
+from pylsl import local_clock
 
 from experiment_interface import Interface
 from experiment_state_machine import StateMachine
 from experiment_logging import Logger
 from experiment_LSL import LSLHandler
+from experiment_scheduler import ControlScheduler
+from experiment_session import SessionJournal, config_hash
+from experiment_tracing import LatencyTracer
+from experiment_frames import FrameMonitor
 
 def initialize_state_dict(state_dict, experiment_config):
     """
@@ -25,13 +31,39 @@ def initialize_state_dict(state_dict, experiment_config):
     state_dict["imagination_time_range"] = experiment_config["experiment"]["imagination_time_range"]
     state_dict["intention_time_range"] = experiment_config["experiment"]["intention_time_range"]
     state_dict["timeout"] = state_dict["TO"] = experiment_config["experiment"]["trial_timeout"]
+    state_dict["prediction_max_age"] = experiment_config["experiment"].get("prediction_max_age_s", 0)
+    state_dict["prediction_streams"] = experiment_config["experiment"].get("prediction_streams", 1)
+    state_dict["prediction_fusion"] = experiment_config["experiment"].get("prediction_fusion", "first")
+    state_dict["prediction_fusion_window"] = experiment_config["experiment"].get("prediction_fusion_window_s", 0.5)
     state_dict["familiarization_trials_No"] = experiment_config["experiment"]["number_of_familiarization_trials"]
     state_dict["end_control_trials"] = experiment_config["experiment"]["number_of_end_control_trials"]
     state_dict["trial_conditions"] = experiment_config["experiment"]["trial_conditions"]
     state_dict["randomize_trials"] = experiment_config["experiment"]["randomize_trials"]
+    state_dict["schedule_seed"] = experiment_config["experiment"].get("schedule_seed", None)
+    state_dict["max_same_direction_run"] = experiment_config["experiment"].get("max_same_direction_run", 0)
+    state_dict["schedule_block_size"] = experiment_config["experiment"].get("schedule_block_size", 0)
+    state_dict["schedule_candidates"] = experiment_config["experiment"].get("schedule_candidates", 1000)
+    state_dict["counterbalance_conditions"] = experiment_config["experiment"].get("counterbalance_conditions", 0) == 1
+    state_dict["participant_id"] = experiment_config.get("participant", {}).get("id", 0)
 
     state_dict["fullscreen"] = experiment_config["interface_data"]["full_screen_mode"]
+    state_dict["dirty_rect_rendering"] = experiment_config["interface_data"].get("dirty_rect_rendering", 0) == 1
     state_dict["data_stream_interval"] = experiment_config["interface_data"]["data_stream_interval"]
+    state_dict["chunked_EXO_ingest"] = experiment_config["interface_data"].get("chunked_EXO_ingest", 0) == 1
+    state_dict["exo_stream_timeout"] = experiment_config["interface_data"].get("exo_stream_timeout_s", 0.5)
+    state_dict["forward_EXO_samples"] = experiment_config["interface_data"].get("forward_EXO_samples", 0) == 1
+    state_dict["EXO_sample_rate"] = experiment_config["interface_data"].get("EXO_sample_rate_hz", 300)
+    state_dict["continuous_chunk_size"] = experiment_config["interface_data"].get("continuous_chunk_size", 0)
+    state_dict["continuous_max_buffered"] = experiment_config["interface_data"].get("continuous_max_buffered_s", 360)
+    state_dict["control_rate"] = experiment_config["interface_data"].get("control_rate_hz", 0)
+    if state_dict["control_rate"] > 0:
+        state_dict["chunked_EXO_ingest"] = True     # control thread always reads EXO data from the ring buffer
+    state_dict["save_stream_log"] = experiment_config["interface_data"].get("save_stream_log", 0) == 1 and state_dict["chunked_EXO_ingest"]
+    state_dict["latency_tracing"] = experiment_config["interface_data"].get("latency_tracing", 0) == 1
+    state_dict["latency_overlay"] = experiment_config["interface_data"].get("latency_overlay", 0) == 1
+    state_dict["wire_format"] = experiment_config["interface_data"].get("wire_format", "json")
+    state_dict["frame_timing_log"] = experiment_config["interface_data"].get("frame_timing_log", 0) == 1
+    state_dict["flip_synced_events"] = experiment_config["interface_data"].get("flip_synced_events", 0) == 1
 
     state_dict["exo_parameters"] = experiment_config["exo_parameters"]
 
@@ -77,6 +109,7 @@ if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--no_log", action="store_true", help="Disable logging")
+    parser.add_argument("--resume", action="store_true", help="Resume the last (interrupted) session of the participant")
     args = parser.parse_args()
 
     # Load experiment configuration from JSON file
@@ -93,22 +126,58 @@ if __name__ == "__main__":
         experiment_config["participant"]["name"],               # participant name
         experiment_config["participant"]["id"],                 # participant ID
         args.no_log,                                            # disable logging
-        save_data                                               # save data
+        save_data,                                              # save data
+        experiment_config["interface_data"].get("log_format", "tsv"),   # data file format
+        experiment_config["interface_data"].get("async_logging", 0) == 1,   # write data on a background thread
+        experiment_config["interface_data"].get("log_queue_size", 10000)    # max. queued writes
     )
-    data_log.save_experiment_config(experiment_config)
+
+    # Setup session journal (trial checkpoints for resuming an interrupted session)
+    journal = None
+    session = None
+    if not args.no_log and save_data:
+        participant_path = os.path.join(data_log.results_path, data_log.participant_folder)
+        if args.resume:
+            journal_path = SessionJournal.find_latest(participant_path)
+            if journal_path is None:
+                raise SystemExit("No session journal found to resume from.")
+            session = SessionJournal.load(journal_path)
+            if session["header"] is None or session["header"]["config_hash"] != config_hash(experiment_config):
+                raise SystemExit(f"Experiment configuration does not match the session in {journal_path}, refusing to resume.")
+            logger.info(f"Resuming session from {journal_path} ({len(session['trials'])} trials completed).")
+            data_log.create_file(resume_idx=session["header"]["file_idx"])
+            journal = SessionJournal(journal_path)
+        else:
+            data_log.save_experiment_config(experiment_config)
+            data_log.create_file()
+            journal = SessionJournal(os.path.join(participant_path, f"session_journal_{data_log.file_idx:02d}.jsonl"))
+            journal.write_header(experiment_config, data_log.file_idx)
 
     # Initialize experiment state
     state_dict = None
     state_dict, predict = initialize_state_dict(state_dict, experiment_config)
 
     # Create an Inlet for incoming LSL Stream
-    LSL = LSLHandler(state_dict, predict=predict)
+    LSL = LSLHandler(state_dict, predict=predict, chunked_ingest=state_dict["chunked_EXO_ingest"])
     interface = Interface(
         state_dict  =   state_dict,
         maxP        =   state_dict["exo_parameters"]["maximum_arm_position_deg"],
         minP        =   state_dict["exo_parameters"]["minimum_arm_position_deg"]
     )
-    state_machine = StateMachine(LSL)
+    state_machine = StateMachine(LSL, journal=journal)
+    state_machine.resume_session = session
+
+    # Setup latency tracing of the control path (EXO sample -> EXO instruction)
+    tracer = None
+    if state_dict["latency_tracing"]:
+        tracer = LatencyTracer(overlay=state_dict["latency_overlay"])
+        LSL.tracer = tracer
+        interface.tracer = tracer
+
+    # Setup frame timing monitor of the stimulus display (flip times, dropped frames, cue onsets),
+    # which also stamps visual events with the flip that shows them when events are flip-synced
+    if state_dict["frame_timing_log"] or state_dict["flip_synced_events"]:
+        interface.frame_monitor = FrameMonitor(on_cue_onset=LSL.event_shown if state_dict["flip_synced_events"] else None)
 
     # Create a background thread for sending Data through LSL Stream
     stop_event = threading.Event()
@@ -128,25 +197,66 @@ if __name__ == "__main__":
         prediction_thread.start()
     continue_experiment = True
     experiment_over = False
+    log_cursor = 0
+    frames_cursor = 0
+
+    # Create a background thread running EXO ingest + state machine at a fixed rate
+    if state_dict["control_rate"] > 0:
+        scheduler = ControlScheduler(state_dict, LSL, state_machine, interface, data_log, rate=state_dict["control_rate"], tracer=tracer)
+        control_thread = threading.Thread(
+            target=scheduler.run,
+            args=(stop_event,),
+            daemon=True
+        )
+        control_thread.start()
 
     try:
-        while continue_experiment and experiment_over is False:
-            pygame.event.clear()
-            with the_lock:
-                state_dict["timestamp"] = LSL.timestamp_g
-
-            # Stream data and update state
-            LSL.EXO_stream_in(state_dict)
-            experiment_over, state_dict = state_machine.maybe_update_state(state_dict)
-            continue_experiment = Interface.run(interface, state_dict)
+        if state_dict["control_rate"] > 0:
+            # Render at display rate from snapshots produced by the control thread
+            while continue_experiment and not scheduler.experiment_over and not stop_event.is_set():
+                continue_experiment = Interface.run(interface, scheduler.get_snapshot())
+        else:
+            while continue_experiment and experiment_over is False:
+                pygame.event.clear()
+                if tracer is not None:
+                    tracer.begin_frame()
+                state_dict["timestamp"] = local_clock()
+
+                # Stream data and update state
+                LSL.EXO_stream_in(state_dict)
+                if tracer is not None:
+                    tracer.mark("ingest")
+                experiment_over, state_dict = state_machine.maybe_update_state(state_dict)
+                if tracer is not None:
+                    tracer.mark("state_update")
+                continue_experiment = Interface.run(interface, state_dict)     # band detection + drawing
+                if tracer is not None:
+                    tracer.mark("render")
             
-            if "previous_state" not in state_dict:
-                state_dict["previous_state"] = None
-            if "event_type" not in state_dict:
-                state_dict["event_type"] = None                     
+                if "previous_state" not in state_dict:
+                    state_dict["previous_state"] = None
+                if "event_type" not in state_dict:
+                    state_dict["event_type"] = None                     
 
-            # Save data
-            data_log.save_data_dict(state_dict)
+                # Save data (every EXO sample when ingesting in chunks, once per frame otherwise)
+                if LSL.chunked_ingest:
+                    samples, timestamps, log_cursor, lost = LSL.exo_buffer.read_since(log_cursor)
+                    if lost:
+                        logger.warning(f"{lost} EXO samples were overwritten before they could be logged.")
+                    corrected_timestamps = LSL.correct_exo_timestamps(timestamps)
+                    data_log.save_EXO_samples(state_dict, samples, timestamps, corrected_timestamps)
+                    if state_dict["save_stream_log"]:
+                        data_log.save_stream(samples, timestamps, LSL.drain_pushed_events(), corrected_timestamps)
+                else:
+                    data_log.save_data_dict(state_dict)
+                if state_dict["frame_timing_log"]:
+                    frames, frames_cursor, lost = interface.frame_monitor.read_since(frames_cursor)
+                    if lost:
+                        logger.warning(f"{lost} frames were overwritten before they could be logged.")
+                    data_log.save_frames(frames)
+                if tracer is not None:
+                    tracer.mark("logging")
+                    tracer.end_frame()
 
     except Exception as e:
         logger.error(f"An error occurred during the experiment loop: {e}", exc_info=True)
@@ -156,4 +266,28 @@ if __name__ == "__main__":
         continue_experiment = False
 
     finally:
+        stop_event.set()
+        if state_dict["control_rate"] > 0:
+            control_thread.join()
+        if state_dict["frame_timing_log"]:
+            if state_dict["control_rate"] == 0:
+                data_log.save_frames(interface.frame_monitor.read_since(frames_cursor)[0])
+            else:
+                data_log.save_frames(interface.frame_monitor.read_since(scheduler.frames_cursor)[0])
+        LSL.close()
         data_log.close()
+        state_machine.log_transition_stats()
+        logger.info(f"LSL streams: {LSL.stream_summary()}")
+        logger.info(f"LSL clock offsets: {LSL.clock_summary()}")
+        data_log.save_clock_offsets(LSL.clock_summary(), LSL.clock_sync.estimates() if LSL.clock_sync is not None else {})
+        logger.info(f"Frame times: {interface.frame_time_summary()}")
+        if interface.frame_monitor is not None:
+            logger.info(f"Frame timing: {interface.frame_monitor.summary()}")
+        if state_dict["flip_synced_events"]:
+            logger.info(f"Flip-synced events: {LSL.flip_sync_summary()}")
+        if tracer is not None:
+            data_log.save_latency_trace(tracer)
+        if state_dict["real_time_prediction"]:
+            data_log.save_prediction_metrics(LSL.prediction_metrics, LSL.prediction_summary(), None if LSL.prediction_fusion is None else LSL.prediction_fusion.decisions)
+        if journal is not None:
+            journal.close()
@@ -0,0 +1,173 @@
+import threading
+import numpy as np
+from pylsl import local_clock
+
+from experiment_tracing import LatencyHistogram
+from experiment_LSL import LSLHandler
+
+class FrameMonitor:
+    """
+    Records the timing of every frame of the stimulus display in a preallocated ring buffer:
+    when drawing started, how long it took, when pygame.display.update() returned (flip),
+    the interval to the previous flip and the number of refresh periods missed in between.
+    Frames that first show a new visual cue (imagine / intend / execute event) are marked as
+    cue onsets, with the LSL timestamp of the event and the delay until the flip that showed it.
+    Written by the render loop only; the logger reads all frames since its last read.
+    """
+
+    # Record layout (also the columns of the frame timing log)
+    columns = (
+        ("frame", np.int64),
+        ("frame_start", np.float64),
+        ("draw_ms", np.float64),
+        ("flip_time", np.float64),
+        ("interval_ms", np.float64),
+        ("dropped", np.int32),
+        ("event_id", np.int32),
+        ("color", "U16"),
+        ("cue_onset", np.int8),
+        ("event_timestamp", np.float64),
+        ("onset_delay_ms", np.float64),
+    )
+    # Events shown as a visual cue (imagine, intend, execute UP / DOWN)
+    cue_events = LSLHandler.visual_events
+
+    def __init__(self, capacity: int = 4096, refresh_rate: float = 60, clock=local_clock, on_cue_onset=None):
+        """
+        Initialize the FrameMonitor class.
+
+        :param capacity: Number of frames kept in the buffer (~68 s at 60 Hz by default).
+        :param refresh_rate: Target frame rate in Hz, used to count dropped frames.
+        :param clock: Function returning the current time in s (default pylsl.local_clock).
+        :param on_cue_onset: Function called with (event_id, flip_time) on every cue onset, e.g. LSLHandler.event_shown.
+        """
+        self.capacity = capacity
+        self.period = 1 / refresh_rate
+        self.clock = clock
+        self.on_cue_onset = on_cue_onset
+        self.frames = np.zeros(capacity, dtype=list(self.columns))
+        self.write_count = 0    # total number of frames ever written
+        self.lock = threading.Lock()
+
+        self.frame_start = None
+        self.draw_end = None
+        self.last_flip = None
+        self.shown_event_id = None
+
+        # Session statistics
+        self.dropped_frames = 0
+        self.unchanged_frames = 0   # frames that updated nothing on screen (no flip, not recorded)
+        self.intervals = LatencyHistogram()
+        self.draw_times = LatencyHistogram()
+        self.cue_onsets = []    # (frame, event_id, color, event_timestamp, flip_time)
+
+    def begin_frame(self):
+        """
+        Mark the start of a frame (before update and draw).
+        """
+        self.frame_start = self.clock()
+
+    def drawn(self):
+        """
+        Mark the end of drawing (right before pygame.display.update()).
+        """
+        self.draw_end = self.clock()
+
+    def unchanged(self):
+        """
+        Mark a frame in which nothing changed on screen, so nothing was flipped: it is counted, but not
+        recorded as a displayed frame, and the next flip has no interval (the refresh periods in between
+        were not missed, there was nothing to show).
+        """
+        self.unchanged_frames += 1
+        self.frame_start = self.draw_end = None
+        self.last_flip = None
+
+    def flipped(self, state_dict: dict):
+        """
+        Mark the flip (right after pygame.display.update() returned) and record the frame.
+
+        :param state_dict: State dictionary the frame was drawn from.
+        """
+        flip_time = self.clock()
+        frame_start = flip_time if self.frame_start is None else self.frame_start
+        draw_end = flip_time if self.draw_end is None else self.draw_end
+
+        if self.last_flip is None:
+            interval = np.nan
+            dropped = 0
+        else:
+            interval = flip_time - self.last_flip
+            dropped = max(0, int(round(interval / self.period)) - 1)
+            self.intervals.record(interval)
+        self.last_flip = flip_time
+        self.dropped_frames += dropped
+        self.draw_times.record(draw_end - frame_start)
+
+        # A cue is on screen from the first flip after its event changed
+        event_id = state_dict.get("event_id", 99)
+        cue_onset = event_id != self.shown_event_id and event_id in self.cue_events
+        self.shown_event_id = event_id
+        event_timestamp = state_dict.get("event_timestamp", np.nan) if cue_onset else np.nan
+        if event_timestamp is None:
+            event_timestamp = np.nan
+        if cue_onset:
+            self.cue_onsets.append((self.write_count, event_id, state_dict.get("color", ""), event_timestamp, flip_time))
+            if self.on_cue_onset is not None:
+                self.on_cue_onset(event_id, flip_time)
+
+        with self.lock:
+            self.frames[self.write_count % self.capacity] = (
+                self.write_count,
+                frame_start,
+                1000 * (draw_end - frame_start),
+                flip_time,
+                1000 * interval,
+                dropped,
+                event_id,
+                state_dict.get("color", ""),
+                cue_onset,
+                event_timestamp,
+                1000 * (flip_time - event_timestamp),
+            )
+            self.write_count += 1
+
+    def read_since(self, cursor: int):
+        """
+        Return all frames recorded since the given cursor.
+
+        :param cursor: Value of write_count at the previous read (0 for the first read).
+        :return: Tuple (frames, new_cursor, lost) where frames is a structured array
+                 and lost is the number of frames overwritten before they could be read.
+        """
+        with self.lock:
+            write_count = self.write_count
+            lost = max(0, write_count - cursor - self.capacity)
+            start = cursor + lost
+            idx = np.arange(start, write_count) % self.capacity
+            frames = self.frames[idx]
+        return frames, write_count, lost
+
+    def summary(self):
+        """
+        :return: dict with the number of frames, dropped and unchanged frames, frame interval and draw time
+                 percentiles (ms) and the cue onset delays (event timestamp to flip, ms).
+        """
+        delays = np.array([1000 * (flip_time - event_timestamp) for _, _, _, event_timestamp, flip_time in self.cue_onsets if not np.isnan(event_timestamp)])
+        interval = self.intervals.summary()
+        draw = self.draw_times.summary()
+        summary = {
+            "frames": self.write_count,
+            "dropped_frames": self.dropped_frames,
+            "unchanged_frames": self.unchanged_frames,
+            "interval_ms": {name: interval[name] for name in ("p50_ms", "p99_ms", "max_ms") if name in interval},
+            "draw_ms": {name: draw[name] for name in ("p50_ms", "p99_ms", "max_ms") if name in draw},
+            "cue_onsets": len(self.cue_onsets),
+        }
+        if len(delays):
+            summary["cue_onset_delay_ms"] = {
+                "mean": round(float(delays.mean()), 3),
+                "std": round(float(delays.std()), 3),
+                "max": round(float(delays.max()), 3),
+            }
+        return summary
@@ -0,0 +1,170 @@
+import threading
+import logging
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+# A single prediction received from one classifier (timestamp corrected to the local clock, raw_timestamp in the decoder's clock)
+Prediction = namedtuple("Prediction", ["classifier", "name", "confidence", "timestamp", "arrival_time", "epoch", "raw_timestamp"], defaults=[None])
+
+class PredictionBuffer:
+    """
+    Bounded, time-indexed buffer of the predictions of one classifier (ordered by arrival time).
+    """
+
+    def __init__(self, classifier: str, maxlen: int = 256):
+        """
+        Initialize the PredictionBuffer class.
+
+        :param classifier: Name of the classifier.
+        :param maxlen: Number of predictions kept.
+        """
+        self.classifier = classifier
+        self.predictions = deque(maxlen=maxlen)
+        self.arrival_times = deque(maxlen=maxlen)
+
+    def append(self, prediction: Prediction):
+        self.predictions.append(prediction)
+        self.arrival_times.append(prediction.arrival_time)
+
+    def between(self, start: float, end: float, epoch: int = None):
+        """
+        Return the predictions that arrived in [start, end], optionally only those of one prediction window.
+        """
+        predictions = list(self.predictions)
+        first = bisect_left(list(self.arrival_times), start)
+        return [prediction for prediction in predictions[first:] if prediction.arrival_time <= end and (epoch is None or prediction.epoch == epoch)]
+
+class FirstArrival:
+    """
+    The first prediction of a prediction window, from any classifier, is the decision
+    (the behaviour with a single classifier).
+    """
+
+    name = "first"
+
+    def __init__(self, window: float = 0.0):
+        self.window = window
+
+    def ready(self, inputs: list, classifiers: int, elapsed: float):
+        return len(inputs) > 0
+
+    def decide(self, inputs: list):
+        return min(inputs, key=lambda prediction: prediction.arrival_time).name
+
+class MajorityVote(FirstArrival):
+    """
+    Every classifier votes with its latest prediction within the window (s) after the first prediction,
+    decided as soon as all classifiers reported or the window passed. Ties go to the class whose first vote arrived first.
+    """
+
+    name = "majority"
+
+    def ready(self, inputs: list, classifiers: int, elapsed: float):
+        return len(inputs) > 0 and (len(inputs) >= classifiers or elapsed >= self.window)
+
+    def weight(self, prediction: Prediction):
+        return 1.0
+
+    def decide(self, inputs: list):
+        scores = {}
+        for prediction in sorted(inputs, key=lambda prediction: prediction.arrival_time):
+            scores[prediction.name] = scores.get(prediction.name, 0.0) + self.weight(prediction)
+        return max(scores, key=scores.get)     # first maximum in arrival order
+
+class ConfidenceWeighted(MajorityVote):
+    """
+    Like MajorityVote, but every vote is weighted with the classifier's confidence
+    (1 for classifiers that do not report one).
+    """
+
+    name = "confidence"
+
+    def weight(self, prediction: Prediction):
+        return 1.0 if prediction.confidence is None else prediction.confidence
+
+# Fusion policies by configuration name
+FUSION_POLICIES = {policy.name: policy for policy in (FirstArrival, MajorityVote, ConfidenceWeighted)}
+
+class PredictionFusion:
+    """
+    Fuses the predictions of several classifiers into one decision per prediction window.
+    Receiving threads (one per classifier inlet) add predictions and poll; the decision is handed to
+    the publish callback (which writes it to the shared state, called under the lock so decisions are
+    published in order), so fusing never runs on the control thread.
+    Every decision is logged together with the predictions it was made from.
+    """
+
+    def __init__(self, classifiers: list, policy: str = "first", window: float = 0.0, publish=None):
+        """
+        Initialize the PredictionFusion class.
+
+        :param classifiers: Names of the classifiers.
+        :param policy: Name of the fusion policy (see FUSION_POLICIES).
+        :param window: Time (s) after the first prediction of a window to wait for the other classifiers.
+        :param publish: Function called with (decision, arrival_time, timestamp, epoch) for every decision.
+        """
+        assert policy in FUSION_POLICIES, f"Fusion policy has to be one of {list(FUSION_POLICIES)}!"
+        self.policy = FUSION_POLICIES[policy](window)
+        self.buffers = {classifier: PredictionBuffer(classifier) for classifier in classifiers}
+        self.publish = publish
+        self.lock = threading.Lock()
+        self.decided_epoch = None
+        self.first_arrival = {}         # epoch -> arrival time of its first prediction
+        self.decisions = []             # log of decisions with their inputs
+        self.logger = logging.getLogger("Predictions")
+
+    def add_classifier(self, classifier: str):
+        """
+        Add a classifier whose stream was connected after the fusion was created (no-op if it is known).
+        """
+        with self.lock:
+            if classifier not in self.buffers:
+                self.buffers[classifier] = PredictionBuffer(classifier)
+
+    def add(self, prediction: Prediction):
+        """
+        Add a prediction to its classifier's buffer and decide if the policy is ready.
+        """
+        with self.lock:
+            self.buffers[prediction.classifier].append(prediction)
+            self.first_arrival[prediction.epoch] = min(prediction.arrival_time, self.first_arrival.get(prediction.epoch, prediction.arrival_time))
+        self.poll(prediction.epoch, prediction.arrival_time)
+
+    def poll(self, epoch: int, now: float):
+        """
+        Decide for a prediction window if it is not decided yet and the policy is ready
+        (called on every prediction and periodically by the receiving threads).
+
+        :param epoch: Prediction window.
+        :param now: Current time (same clock as the arrival times).
+        """
+        with self.lock:
+            if self.decided_epoch == epoch or epoch not in self.first_arrival:
+                return
+            # Latest prediction of every classifier within the window
+            start = self.first_arrival[epoch]
+            end = min(now, start + self.policy.window)
+            inputs = []
+            for buffer in self.buffers.values():
+                predictions = buffer.between(start, end, epoch)
+                if predictions:
+                    inputs.append(predictions[-1])
+            if not self.policy.ready(inputs, len(self.buffers), now - start):
+                return
+            decision = self.policy.decide(inputs)
+            self.decided_epoch = epoch
+            # Time base of the decision: the latest input it was made from
+            last_input = max(inputs, key=lambda prediction: prediction.arrival_time)
+            self.decisions.append({
+                "epoch": epoch,
+                "policy": self.policy.name,
+                "decision": decision,
+                "decided_at": now,
+                "inputs": [prediction._asdict() for prediction in inputs],
+            })
+            self.first_arrival = {window: time for window, time in self.first_arrival.items() if window >= epoch}
+            # Published under the lock, so decisions reach the shared state in the order they were made
+            if self.publish is not None:
+                self.publish(decision, last_input.arrival_time, last_input.timestamp, epoch)
+        if len(self.buffers) > 1:
+            self.logger.info(f"Fused prediction '{decision}' ({self.policy.name}) from {[(prediction.classifier, prediction.name, prediction.confidence) for prediction in inputs]}.")
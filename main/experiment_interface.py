@@ -1,8 +1,61 @@
 import pygame
+import threading
+from collections import OrderedDict
 from pylsl import StreamInlet, resolve_streams, resolve_byprop
 from experiment_LSL import LSLHandler
+from experiment_tracing import LatencyHistogram
 from time import perf_counter
 
+class TextCache:
+    """
+    Bounded LRU cache of rendered text surfaces, keyed by (text, font, color, background color),
+    so text that is drawn again (counters, timers, instructions) is not rasterized again.
+    """
+
+    def __init__(self, max_size: int = 256):
+        """
+        :param max_size: Maximum number of cached surfaces (least recently used ones are dropped first).
+        """
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, fonts: dict, text: str, font: int, color, background_color=None):
+        """
+        Returns the rendered text, from the cache if possible.
+
+        :param fonts: font selector -> pygame.font.Font
+        :param text: string to render
+        :param font: font selector (1, 2, 3, or 4)
+        :param color: text color
+        :param background_color: background color for text
+        """
+        key = (text, font, color, background_color)
+        t = self.surfaces.get(key)
+        if t is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return t
+        self.misses += 1
+        t = fonts[font].render(text, True, color, background_color)
+        self.surfaces[key] = t
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return t
+
+    def clear(self):
+        """
+        Drops all cached surfaces (e.g. after the window was resized).
+        """
+        self.surfaces.clear()
+
+    def stats(self):
+        """
+        :return: dict with the number of cache hits, misses and cached surfaces.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.surfaces)}
+
 class Interface:
     """
     Class for handling GUI for EDUEXO-EEG experiment.
@@ -42,15 +95,37 @@ class Interface:
         else:
             self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
         self.edge_margin = 2
+        self.geometry_lock = threading.Lock()   # guards screen geometry used by detect_bands()
         self.clock = pygame.time.Clock()
         self.continue_experiment = True
         self.prev_time = perf_counter()
+        self.tracer = None              # LatencyTracer, its summary is drawn as an overlay if enabled
+        self.overlay_lines = []
+        self.overlay_updated = 0
+
+        # Retained-mode rendering: draw() builds a display list, present() repaints only what changed
+        self.dirty_rendering = state_dict.get("dirty_rect_rendering", False)
+        self.scene = []                 # items of the frame being built: (key, rect, surface)
+        self.scene_background = "black"
+        self.shown_scene = {}           # key -> rect of the items currently on screen
+        self.shown_background = None
+        self.full_redraw = True         # repaint and update the whole window on the next frame
+        self.sprites = {}               # shapes drawn for the previous frame, reused while unchanged
+        self.frame_sprites = {}
+
+        self.frame_monitor = None       # FrameMonitor, records the flip time of every frame if set
+
+        # Frame-time meter (update + draw + present)
+        self.frame_times = LatencyHistogram()
+        self.render_stats = {"frames": 0, "full_frames": 0, "updated_area": 0.0}
 
         # Create different fonts for various UI elements
         self.font = pygame.font.SysFont('Arial', 48)    # Main font
         self.font2 = pygame.font.SysFont('Arial', 100, bold=True)  # Large font for instructions
         self.font3 = pygame.font.SysFont('Arial', 24)   # Small font
         self.font4 = pygame.font.SysFont('Arial', 24, bold=True)   # Small bold font
+        self.fonts = {1: self.font, 2: self.font2, 3: self.font3, 4: self.font4}
+        self.text_cache = TextCache()
 
         # Pre-render static texts for performance
         self.update_static_texts()
@@ -64,38 +139,51 @@ class Interface:
         :return: pygame.Vector2 with the dot position on the screen
         """
         self.state_dict = state_dict
+        self.loc = self.detect_bands(state_dict)
 
-        if self.state_dict["current_position"] is None:
-            loc = (self.maxP - self.minP)/2 + self.minP
-        else:
-            loc = self.state_dict["current_position"]
+        return pygame.Vector2(self.width/2,  self.loc)
 
-        # Map exoskeleton angle to vertical screen position
-        self.loc = (loc / (self.maxP - self.minP) - self.minP / (self.maxP - self.minP)) * (self.height - 2 * self.band_offset) + self.band_offset
+    def detect_bands(self, state_dict):
+        """
+        Maps the current position of the exoskeleton to the screen and updates the
+        band flags (in_the_middle, is_UP, is_DOWN, on_the_move) in state_dict.
+        Safe to call from the control thread while the GUI is rendering.
 
-        # Determine if the dot is in the middle, upper, or lower band
-        if self.loc < self.height/2 + self.dot_size/2 + 1 and self.loc > self.height/2 - self.dot_size/2 - 1:
-            self.state_dict["in_the_middle"] = True
-        else:
-            self.state_dict["in_the_middle"] = False
+        :param state_dict: state dictionary of main program
+        :return: vertical screen position of the dot
+        """
+        with self.geometry_lock:
+            if state_dict["current_position"] is None:
+                loc = (self.maxP - self.minP)/2 + self.minP
+            else:
+                loc = state_dict["current_position"]
 
-        if self.loc < 0.9 * self.pas + self.band_offset:
-            self.state_dict["is_UP"] = True
-        else:
-            self.state_dict["is_UP"] = False
+            # Map exoskeleton angle to vertical screen position
+            loc = (loc / (self.maxP - self.minP) - self.minP / (self.maxP - self.minP)) * (self.height - 2 * self.band_offset) + self.band_offset
 
-        if self.loc > self.height - 0.9 * self.pas - self.band_offset:
-            self.state_dict["is_DOWN"] = True
-        else:
-            self.state_dict["is_DOWN"] = False
+            # Determine if the dot is in the middle, upper, or lower band
+            if loc < self.height/2 + self.dot_size/2 + 1 and loc > self.height/2 - self.dot_size/2 - 1:
+                state_dict["in_the_middle"] = True
+            else:
+                state_dict["in_the_middle"] = False
+
+            if loc < 0.9 * self.pas + self.band_offset:
+                state_dict["is_UP"] = True
+            else:
+                state_dict["is_UP"] = False
+
+            if loc > self.height - 0.9 * self.pas - self.band_offset:
+                state_dict["is_DOWN"] = True
+            else:
+                state_dict["is_DOWN"] = False
 
         # Determine if the dot is moving (not in any band or middle)
-        if self.state_dict["is_UP"] or self.state_dict["is_DOWN"] or self.state_dict["in_the_middle"]:
-            self.state_dict["on_the_move"] = False
+        if state_dict["is_UP"] or state_dict["is_DOWN"] or state_dict["in_the_middle"]:
+            state_dict["on_the_move"] = False
         else:
-            self.state_dict["on_the_move"] = True
+            state_dict["on_the_move"] = True
 
-        return pygame.Vector2(self.width/2,  self.loc)
+        return loc
     
     def draw(self, dot_pos):
         """
@@ -105,9 +193,9 @@ class Interface:
         """
         # Set background color
         if "background_color" in self.state_dict:
-            self.screen.fill(self.state_dict["background_color"])
+            self.scene_background = self.state_dict["background_color"]
         else:
-            self.screen.fill("black")
+            self.scene_background = "black"
 
         # Ensure current_state is set
         if "current_state" not in self.state_dict:
@@ -128,7 +216,7 @@ class Interface:
         #### PAUSE STATE
         elif self.state_dict["current_state"] == "PAUSE":
             # Show pause screen
-            self.screen.fill("darkorange3")
+            self.scene_background = "darkorange3"
             self._draw_dynamic_text(text="Paused. Press SPACE to continue.", font=1)
 
         #### EXIT, TERMINATION OR STREAM DISCONNECTION STATES
@@ -167,7 +255,7 @@ class Interface:
                     color = self.state_dict["color"]
                 else:
                     color = "black"
-                pygame.draw.line(self.screen, color, p11, p12, width = self.pas)
+                self._draw_line(color, p11, p12, width = self.pas)
 
             # Draw lower band
             p21 = pygame.Vector2(0, self.height - self.band_offset - self.pas/2)
@@ -181,21 +269,21 @@ class Interface:
                     color = self.state_dict["color"]         
                 else:
                     color = "black"                    
-                pygame.draw.line(self.screen, color, p21, p22, width = self.pas)
+                self._draw_line(color, p21, p22, width = self.pas)
 
             # Draw failure indication
             if self.state_dict["current_state"] == "FAILURE":
                 if self.state_dict["is_UP"]:
-                    pygame.draw.line(self.screen, "red", p11, p12, width = self.pas)
+                    self._draw_line("red", p11, p12, width = self.pas)
                 elif self.state_dict["is_DOWN"]:
-                    pygame.draw.line(self.screen, "red", p21, p22, width = self.pas)
+                    self._draw_line("red", p21, p22, width = self.pas)
 
             #### DRAW BANDS 
             # Draw white lines for band boundaries
-            pygame.draw.line(self.screen, "white", (0, self.band_offset), (self.width, self.band_offset))                                                         # Top line of UPPER BAND
-            pygame.draw.line(self.screen, "white", (0, self.band_offset + self.pas), (self.width, self.band_offset + self.pas))                                   # Bottom line of UPPER BAND
-            pygame.draw.line(self.screen, "white", (0, self.height-self.band_offset), (self.width, self.height-self.band_offset))                                 # Bottom line of LOWER BAND
-            pygame.draw.line(self.screen, "white", (0, self.height - self.band_offset - self.pas), (self.width, self.height - self.band_offset - self.pas))       # Top line of LOWER BAND 
+            self._draw_line("white", (0, self.band_offset), (self.width, self.band_offset))                                                         # Top line of UPPER BAND
+            self._draw_line("white", (0, self.band_offset + self.pas), (self.width, self.band_offset + self.pas))                                   # Bottom line of UPPER BAND
+            self._draw_line("white", (0, self.height-self.band_offset), (self.width, self.height-self.band_offset))                                 # Bottom line of LOWER BAND
+            self._draw_line("white", (0, self.height - self.band_offset - self.pas), (self.width, self.height - self.band_offset - self.pas))       # Top line of LOWER BAND 
 
             #### DRAW REMAINING TIME
             self._draw_dynamic_text(text=str(self.state_dict["remaining_time"]), x_position=0.88*self.width, y_position=0.55*self.height)
@@ -205,26 +293,26 @@ class Interface:
 
             #### DRAW ALL CONSTANT TEXTs
             # Draw static labels for bands and counters
-            self.screen.blit(*self.UP_text)
-            self.screen.blit(*self.DOWN_text)  
-            self.screen.blit(*self.current_trial_text)
-            self.screen.blit(*self.remaining_time_text)
+            self._blit(self.UP_text, key="UP_text")
+            self._blit(self.DOWN_text, key="DOWN_text")
+            self._blit(self.current_trial_text, key="current_trial_text")
+            self._blit(self.remaining_time_text, key="remaining_time_text")
 
             #### DRAW INSTRUCTIONS WHILE TRAIL IS IN PROGRESS
             # Show "UP" or "DOWN" instruction if trial is in progress and not in band
-            UP_sign = self._create_static_text(text="UP", color=self.state_dict["color"], font=2, y_position=0.4*self.height)                                                           # UP instruction text
-            DOWN_sign = self._create_static_text(text="DOWN", color=self.state_dict["color"], font=2, y_position=0.6*self.height)                                                       # DOWN instruction text    
             if not self.in_band:
                 if self.state_dict["trial"] == "UP" and self.state_dict["trial_in_progress"]:
-                    self.screen.blit(*UP_sign)
+                    UP_sign = self._create_static_text(text="UP", color=self.state_dict["color"], font=2, y_position=0.4*self.height)           # UP instruction text
+                    self._blit(UP_sign, key=("UP_sign", self.state_dict["color"]))
                 elif self.state_dict["trial"] == "DOWN" and self.state_dict["trial_in_progress"]:
-                    self.screen.blit(*DOWN_sign)
+                    DOWN_sign = self._create_static_text(text="DOWN", color=self.state_dict["color"], font=2, y_position=0.6*self.height)       # DOWN instruction text
+                    self._blit(DOWN_sign, key=("DOWN_sign", self.state_dict["color"]))
             
             #### RETURN TO CENTER TEXT AND TARGET CIRCLE
             # Show main instruction and target circle in relevant states
             if self.state_dict["current_state"] in {"RETURN_TO_CENTER", "IN_MIDDLE_CIRCLE", "WAITING", "IMAGINATION", "INTENTION", "TRIAL_UP", "TRIAL_DOWN"}:
                 self._draw_dynamic_text(text=self.state_dict["main_text"], color="white", y_position=0.4*self.height, font=1)        
-                pygame.draw.circle(self.screen, "white", (self.width/2, self.height/2), 1.3*self.dot_size + 3, width=2)              
+                self._draw_circle("white", (self.width/2, self.height/2), 1.3*self.dot_size + 3, width=2)
 
             #### SUCCESSFUL TRIAL SIGN
             elif self.state_dict["current_state"] in {"IN_UPPER_BAND", "IN_LOWER_BAND"}:
@@ -240,7 +328,7 @@ class Interface:
                     self._draw_dynamic_text(text="X", x_position=self.width/2, y_position=self.height/2, font=3)
 
             #### DRAW THE MAIN DOT AT THE END
-            pygame.draw.circle(self.screen, "white", dot_pos, self.dot_size)
+            self._draw_circle("white", dot_pos, self.dot_size)
 
     def run(self, state_dict):
         """
@@ -251,10 +339,15 @@ class Interface:
         :param state_dict: state dictionary of main program
         :return: bool, whether to continue the experiment
         """
+        frame_start = perf_counter()
+        if self.frame_monitor is not None:
+            self.frame_monitor.begin_frame()
         dot_pos = self.update(state_dict)
         self.draw(dot_pos)
-
-        pygame.display.update()
+        if self.tracer is not None and self.tracer.overlay:
+            self.draw_latency_overlay()
+        self.present()
+        self.frame_times.record(perf_counter() - frame_start)
         self.clock.tick(60)
 
         # Handle window and quit events
@@ -263,18 +356,36 @@ class Interface:
                 self.continue_experiment = False
             # Handle window resize
             elif event.type == pygame.VIDEORESIZE:
-                self.width, self.height = event.w, event.h
-                self.band_offset = int(round(60/820 * self.height))
-                self.pas = int(round(60/820 * self.height))
-                self.dot_size = int(round(6/820 * self.height + 4))
+                with self.geometry_lock:
+                    self.width, self.height = event.w, event.h
+                    self.band_offset = int(round(60/820 * self.height))
+                    self.pas = int(round(60/820 * self.height))
+                    self.dot_size = int(round(6/820 * self.height + 4))
                 self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
+                self.text_cache.clear()
                 self.update_static_texts()
+                self.full_redraw = True
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                self.full_redraw = True
 
         return self.continue_experiment                        
     
+    def draw_latency_overlay(self):
+        """
+        Draws the per-stage latency summary of the tracer in the top left corner (refreshed twice per second).
+        """
+        now = perf_counter()
+        if now - self.overlay_updated >= 0.5:
+            self.overlay_lines = self.tracer.overlay_lines()
+            self.overlay_updated = now
+        for idx, line in enumerate(self.overlay_lines):
+            t = self.text_cache.render(self.fonts, line, 3, "gray")
+            self._blit((t, t.get_rect(topleft=(10, 10 + idx * self.font3.get_linesize()))), key=("overlay", line, idx))
+
     def _draw_dynamic_text(self, text="[SYSTEM]: No input given", color="white", background_color=None, x_position=None, y_position=None, font=3):
         """
         Draws dynamic (potentially changing) text on the screen at the given position and font.
+        Rendered text is taken from the text cache.
         :param text: string to display
         :param color: text color
         :param background_color: background color for text
@@ -282,24 +393,132 @@ class Interface:
         :param y_position: y coordinate for text center
         :param font: font selector (1, 2, 3, or 4)
         """
-        if font == 1:
-            t = self.font.render(text, True, color, background_color)
-        elif font == 2:
-            t = self.font2.render(text, True, color, background_color)
-        elif font == 4:
-            t = self.font4.render(text, True, color, background_color)
-        else:
-            t = self.font3.render(text, True, color, background_color)
+        t = self.text_cache.render(self.fonts, text, font, color, background_color)
         if x_position == None:
             x_position = self.width/2
         if y_position == None:
             y_position = self.height/2
         tR = t.get_rect(center = (x_position, y_position))
-        self.screen.blit(t, tR)
-        
+        self._blit((t, tR), key=("text", text, font, color, background_color))
+
+    #### RETAINED-MODE RENDERING
+    def _blit(self, surface_rect, key):
+        """
+        Adds a pre-rendered surface to the frame. Key identifies its content (position is added).
+        """
+        t, tR = surface_rect
+        self.scene.append((("blit", key, tR.topleft, tR.size), tR, t))
+
+    def _draw_line(self, color, start, end, width=1):
+        """
+        Adds a line to the frame (same arguments as pygame.draw.line).
+        """
+        start, end = tuple(start), tuple(end)
+        rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]), abs(end[0] - start[0]), abs(end[1] - start[1])).inflate(width + 4, width + 4)
+        key = ("line", color, start, end, width)
+        self._add_shape(key, rect, lambda surface, dx, dy: pygame.draw.line(surface, color, (start[0] - dx, start[1] - dy), (end[0] - dx, end[1] - dy), width))
+
+    def _draw_circle(self, color, center, radius, width=0):
+        """
+        Adds a circle to the frame (same arguments as pygame.draw.circle).
+        """
+        center = tuple(center)
+        rect = pygame.Rect(center[0] - radius - 2, center[1] - radius - 2, 2 * radius + 5, 2 * radius + 5)
+        key = ("circle", color, center, radius, width)
+        self._add_shape(key, rect, lambda surface, dx, dy: pygame.draw.circle(surface, color, (center[0] - dx, center[1] - dy), radius, width))
+
+    def _add_shape(self, key, rect, paint):
+        """
+        Adds a shape to the frame as a sprite: the shape is drawn once onto a transparent surface
+        (shifted by the integer position of its bounding rect, so the pixels are identical to drawing
+        it on the screen directly) and kept while it stays on screen. Blitting, unlike pygame.draw,
+        gives the same pixels when only a part of the screen is repainted.
+        """
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = pygame.Surface(rect.size, pygame.SRCALPHA)
+            paint(sprite, rect.x, rect.y)
+        self.frame_sprites[key] = sprite
+        self.scene.append((key, rect, sprite))
+
+    def present(self):
+        """
+        Puts the frame built by draw() on the screen. Items that are on screen unchanged are kept:
+        only regions of removed, added or changed items are repainted (background and every item
+        overlapping them, in drawing order) and passed to pygame.display.update().
+        The whole window is repainted when the background changes, after a resize, or if
+        dirty-rect rendering is disabled.
+        """
+        scene, background = self.scene, self.scene_background
+        self.scene = []
+        self.sprites, self.frame_sprites = self.frame_sprites, {}
+        items = {key: rect for key, rect, _ in scene}
+        screen_rect = self.screen.get_rect()
+
+        if not self.dirty_rendering or self.full_redraw or background != self.shown_background:
+            self.screen.fill(background)
+            for _, rect, surface in scene:
+                self.screen.blit(surface, rect)
+            self._flip(None)
+            self.full_redraw = False
+            self.render_stats["full_frames"] += 1
+            updated_area = 1.0
+        else:
+            shown = self.shown_scene
+            dirty = [rect.clip(screen_rect) for key, rect in shown.items() if key not in items]
+            dirty += [rect.clip(screen_rect) for key, rect in items.items() if key not in shown]
+            dirty = [rect for rect in dirty if rect.width and rect.height]
+            for rect in dirty:
+                self.screen.set_clip(rect)
+                self.screen.fill(background)
+                for _, item_rect, surface in scene:
+                    if item_rect.colliderect(rect):
+                        self.screen.blit(surface, item_rect)
+            self.screen.set_clip(None)
+            self._flip(dirty)
+            updated_area = min(1.0, sum(rect.width * rect.height for rect in dirty) / (screen_rect.width * screen_rect.height))
+
+        self.shown_scene = items
+        self.shown_background = background
+        self.render_stats["frames"] += 1
+        self.render_stats["updated_area"] += updated_area
+
+    def _flip(self, rects):
+        """
+        Update the window (rects None = whole window, empty list = nothing changed) and report
+        the end of drawing and the flip to the frame monitor. If nothing changed there is no flip,
+        the frame monitor counts the frame as unchanged.
+        """
+        if rects is not None and not rects:
+            if self.frame_monitor is not None:
+                self.frame_monitor.unchanged()
+            return
+        if self.frame_monitor is not None:
+            self.frame_monitor.drawn()
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        if self.frame_monitor is not None:
+            self.frame_monitor.flipped(self.state_dict)
+
+    def frame_time_summary(self):
+        """
+        :return: dict with the frame time histogram summary (update + draw + present, in ms), the number
+                 of frames, the share of fully repainted frames, the mean updated share of the window
+                 and the text cache statistics.
+        """
+        frames = self.render_stats["frames"]
+        summary = self.frame_times.summary()
+        if frames:
+            summary["full_frames"] = round(self.render_stats["full_frames"] / frames, 4)
+            summary["mean_updated_area"] = round(self.render_stats["updated_area"] / frames, 4)
+        summary["text_cache"] = self.text_cache.stats()
+        return summary
+
     def _create_static_text(self, text="[SYSTEM]: No input given", color="white", background_color=None, x_position=None, y_position=None, font=3):
         """
-        Pre-renders static text for performance, returns the rendered surface and its rect.
+        Pre-renders static text for performance (from the text cache), returns the rendered surface and its rect.
         :param text: string to display
         :param color: text color
         :param background_color: background color for text
@@ -308,14 +527,7 @@ class Interface:
         :param font: font selector (1, 2, 3, or 4)
         :return: tuple (surface, rect)
         """
-        if font == 1:
-            t = self.font.render(text, True, color, background_color)
-        elif font == 2:
-            t = self.font2.render(text, True, color, background_color)
-        elif font == 4:
-            t = self.font4.render(text, True, color, background_color)
-        else:
-            t = self.font3.render(text, True, color, background_color)
+        t = self.text_cache.render(self.fonts, text, font, color, background_color)
         if x_position == None:
             x_position = self.width/2
         if y_position == None:
@@ -347,8 +559,7 @@ class Interface:
             try:
                 dot_pos = self.update()
                 self.draw(dot_pos)
-
-                pygame.display.update()
+                self.present()
                 self.clock.tick(60)
 
                 for event in pygame.event.get():
@@ -2,13 +2,211 @@ import os
 import numpy as np
 import json
 import random
+import argparse
+import threading
+import queue
+import logging
+from operator import itemgetter
+
+class BinaryRecorder:
+    """
+    Appends fixed-dtype records (NumPy structured array layout) into a preallocated chunk
+    and flushes full chunks in bulk to a .npy file, which can be opened later with
+    np.load(path, mmap_mode="r") or exported to TSV with export_tsv().
+    """
+
+    # Widest record count the header has room for, so the count can be rewritten in place without moving the data
+    max_records = np.iinfo(np.int64).max
+
+    def __init__(self, path: str, dtype: np.dtype, chunk_size: int = 4096, mode: str = "wb"):
+        """
+        Initialize the BinaryRecorder class.
+
+        :param path: Path to the .npy file.
+        :param dtype: Structured dtype of a single record.
+        :param chunk_size: Number of records kept in memory before they are written to disk.
+        :param mode: "wb" to create a new file, "r+b" to append to an existing one.
+        """
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk = np.zeros(chunk_size, dtype=self.dtype)
+        self.n_buffered = 0
+        self.n_written = 0
+
+        self.file = open(path, mode)
+        if mode == "r+b":
+            # Header size of the existing file (written by an earlier BinaryRecorder with the same dtype)
+            self.version = np.lib.format.read_magic(self.file)[0]
+            length_size = 2 if self.version == 1 else 4
+            self.header_size = 8 + length_size + int.from_bytes(self.file.read(length_size), "little")
+            self.n_written = (os.path.getsize(path) - self.header_size) // self.dtype.itemsize
+            self.file.seek(self.header_size + self.n_written * self.dtype.itemsize)
+        else:
+            self.version, self.header_size = self._header_layout()
+            self._write_header()
+
+    def _header_dict(self, n_records: int):
+        return repr({"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (n_records,)})
+
+    def _header_layout(self):
+        """
+        Size the header for the dtype: room for the descr and the widest record count, rounded up to 64 bytes
+        (.npy alignment). Format version 2.0 (4-byte header length) is used for headers beyond 64 KiB.
+
+        :return: tuple (format major version, header size in bytes including magic string and length field).
+        """
+        header_length = len(self._header_dict(self.max_records)) + 1   # + newline
+        version, prefix = (1, 10) if header_length + 10 <= 65535 else (2, 12)
+        return version, -(-(prefix + header_length) // 64) * 64
+
+    def _write_header(self):
+        """
+        Write the .npy header with the current number of records, padded to header_size bytes.
+        """
+        prefix = 10 if self.version == 1 else 12
+        header = self._header_dict(self.n_written)
+        if len(header) + 1 > self.header_size - prefix:
+            raise ValueError(f"Record count {self.n_written} does not fit into the {self.header_size} byte header of {self.path}.")
+        header = header.ljust(self.header_size - prefix - 1) + "\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY" + bytes([self.version, 0]) + len(header).to_bytes(prefix - 8, "little") + header.encode("latin1"))
+
+    def append(self, record: tuple):
+        """
+        Append a single record.
+
+        :param record: Tuple of values in dtype field order.
+        """
+        self.chunk[self.n_buffered] = record
+        self.n_buffered += 1
+        if self.n_buffered == len(self.chunk):
+            self.flush()
+
+    def append_block(self, columns: dict, n: int):
+        """
+        Append n records at once, given column-wise.
+
+        :param columns: Dictionary of field name -> array of length n (or a scalar repeated n times).
+        :param n: Number of records.
+        """
+        start = 0
+        while start < n:
+            count = min(n - start, len(self.chunk) - self.n_buffered)
+            block = self.chunk[self.n_buffered:self.n_buffered + count]
+            for name, values in columns.items():
+                block[name] = values[start:start + count] if np.ndim(values) else values
+            self.n_buffered += count
+            start += count
+            if self.n_buffered == len(self.chunk):
+                self.flush()
+
+    def flush(self):
+        """
+        Write all buffered records to disk and update the record count in the header.
+        """
+        if self.n_buffered == 0:
+            return
+        self.file.write(self.chunk[:self.n_buffered].tobytes())
+        self.n_written += self.n_buffered
+        self.n_buffered = 0
+        end = self.file.tell()
+        self._write_header()
+        self.file.seek(end)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def export_tsv(npy_path: str, tsv_path: str=None):
+    """
+    Export a binary experiment data file to TSV (same layout as Logger's TSV files).
+
+    :param npy_path: Path to the .npy file written by BinaryRecorder.
+    :param tsv_path: Path to the TSV file, defaults to npy_path with a .tsv extension.
+    """
+    if tsv_path is None:
+        tsv_path = os.path.splitext(npy_path)[0] + ".tsv"
+    data = np.load(npy_path, mmap_mode="r")
+    with open(tsv_path, "w") as tsv_file:
+        tsv_file.write("\t".join(data.dtype.names) + "\n")
+        for record in data:
+            tsv_file.write("\t".join(str(value) for value in record.tolist()) + "\n")
+
+def compile_schema(data_dict: dict):
+    """
+    Compile the data dictionary layout into column names, a row getter and a row template,
+    so that saving a row does not have to parse column names or check types again.
+    Scalar values become one column each, list/tuple/ndarray values one column per element.
+
+    :param data_dict: Data dictionary with the values of the first row.
+    :return: tuple (column_names, row_getter, row_template), where row_getter(data_dict) returns
+             the row values in column order and row_template.format(*values) gives a TSV line.
+    """
+    column_names = []
+    fields = []     # (key, kind) with kind "scalar", "sequence" (list/tuple) or "array" (ndarray)
+    for key, value in data_dict.items():
+        if isinstance(value, (int, float, str)) or value is None:
+            column_names.append(key)
+            fields.append((key, "scalar"))
+        elif isinstance(value, (list, tuple, np.ndarray)):
+            column_names += [key + "." + str(idx) for idx in range(len(value))]
+            fields.append((key, "array" if isinstance(value, np.ndarray) else "sequence"))
+        else:
+            print("Unrecognized data type:", type(value), value, key)
+
+    keys = [key for key, _ in fields]
+    if all(kind == "scalar" for _, kind in fields):
+        # Flat schema: a single itemgetter call returns the whole row
+        getter = itemgetter(*keys)
+        row_getter = getter if len(keys) > 1 else (lambda d: (getter(d),))
+    else:
+        getters = tuple((itemgetter(key), kind) for key, kind in fields)
+        def row_getter(d):
+            row = []
+            for get, kind in getters:
+                if kind == "scalar":
+                    row.append(get(d))
+                elif kind == "array":
+                    row.extend(get(d).tolist())     # plain Python floats format much faster than NumPy scalars
+                else:
+                    row.extend(get(d))
+            return row
+
+    row_template = "\t".join(["{}"] * len(column_names)) + "\n"
+    return column_names, row_getter, row_template
 
 class Logger:
     """
     Class for logging experiment data.
     """
 
-    def __init__(self, results_path: str, participant_name: str, participant_id: int, no_log: bool, save_data: bool=False):
+    # Column types used by the binary format (all other columns are stored as float64)
+    binary_dtypes = {"event_id": np.int32, "event_type": "U32", "prediction": "U32"}
+    # Event IDs that end a trial (success, failure, timeout); data is synced to disk when they occur
+    trial_end_events = {50, 60, 70}
+    # Columns (and binary types) of the continuous stream log with every EXO sample and event marker,
+    # sorted by timestamp_corrected (local clock); timestamp is the raw timestamp of the sample's source
+    stream_columns = (
+        ("timestamp", np.float64),
+        ("timestamp_corrected", np.float64),
+        ("sample_type", "U8"),
+        ("current_position", np.float64),
+        ("current_velocity", np.float64),
+        ("current_torque", np.float64),
+        ("exo_execution", np.float64),
+        ("desired_torque", np.float64),
+        ("demanded_torque", np.float64),
+        ("measured_torque", np.float64),
+        ("event_id", np.int32),
+        ("event_type", "U32"),
+        ("torque_profile", "U24"),
+        ("torque_magnitude", np.float64),
+    )
+    # Rows of the stream log are held back this long (s) so that late rows can still be sorted in
+    stream_holdback = 0.5
+
+    def __init__(self, results_path: str, participant_name: str, participant_id: int, no_log: bool, save_data: bool=False, log_format: str="tsv", async_write: bool=False, queue_size: int=10000):
         """
         Initialize the Logger class.
         
@@ -16,7 +214,20 @@ class Logger:
         :param participant_id: Participant ID.
         :param no_log: If True, logging is disabled.
         :param save_data: If True, the data is saved to the disk.
+        :param log_format: "tsv" to write text rows, "binary" to write fixed-dtype records to a .npy file.
+        :param async_write: If True, records are queued and written to disk by a background thread.
+        :param queue_size: Maximum number of queued writes before new records are dropped (async_write only).
         """
+        assert log_format in {"tsv", "binary"}, "Log format has to be 'tsv' or 'binary'!"
+        self.log_format = log_format
+        self.async_write = async_write
+        self.dropped_records = 0
+        self.queue_high_water = 0
+        self.last_event_id = None
+        self.stream_pending = []
+        self.stream_exists = False
+        self.frames_exists = False
+        self.logger = logging.getLogger("Logger")
         self.save_data = save_data
         self.results_path = results_path
         self.first_loop = True
@@ -45,29 +256,53 @@ class Logger:
         self.data_dict["event_id"] = 0
         self.data_dict["event_type"] = 0
         self.data_dict["timestamp"] = 0
+        self.data_dict["timestamp_corrected"] = 0
         self.data_dict["prediction"] = 0
 
-    def create_file(self):
+        if self.async_write and not self.no_log and self.save_data:
+            self.write_queue = queue.Queue(maxsize=queue_size)
+            self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+            self.writer_thread.start()
+
+    def create_file(self, resume_idx: int=None):
         """
         Create a file for saving the data.
+
+        :param resume_idx: Index of an existing experiment data file to continue writing to (when resuming a session).
         """
-        self.column_names = []
         self.original_state_dict_keys = set(self.data_dict.keys())
-        for key in self.data_dict.keys():
-            if isinstance(self.data_dict[key], int) or isinstance(self.data_dict[key], float) or isinstance(self.data_dict[key], str) or self.data_dict[key] is None:
-                self.column_names.append(key)
-            elif isinstance(self.data_dict[key], list) or isinstance(self.data_dict[key], np.ndarray) or isinstance(self.data_dict[key], tuple):
-                self.column_names += [key + "."+str(idx) for idx in range(len(self.data_dict[key]))]
-            else:
-                print("Unrecognized data type:", type(self.data_dict[key]), self.data_dict[key], key)
+        self.column_names, self.row_getter, self.row_template = compile_schema(self.data_dict)
 
-        file_idx = len([filename for filename in os.listdir(os.path.join(self.results_path, self.participant_folder)) if filename.startswith("experiment_data")])
-        file_idx = f'{file_idx:02d}'
+        if resume_idx is None:
+            self.file_idx = len([filename for filename in os.listdir(os.path.join(self.results_path, self.participant_folder)) if filename.startswith("experiment_data")])
+        else:
+            self.file_idx = resume_idx
+        self.resumed = resume_idx is not None
+        file_idx = f'{self.file_idx:02d}'
 
-        self.data_file = open(os.path.join(self.results_path, self.participant_folder, f'experiment_data_{file_idx}.tsv'),"w")
-        self.data_file.write("\t".join(self.column_names) + "\n")
+        if self.log_format == "binary":
+            dtype = [(name, self.binary_dtypes.get(name, np.float64)) for name in self.column_names]
+            self.recorder = BinaryRecorder(os.path.join(self.results_path, self.participant_folder, f'experiment_data_{file_idx}.npy'), dtype, mode="r+b" if self.resumed else "wb")
+            self.string_columns = {name for name, kind in dtype if np.dtype(kind).kind == "U"}
+        elif self.resumed:
+            self.data_file = self._open_tsv_for_append(os.path.join(self.results_path, self.participant_folder, f'experiment_data_{file_idx}.tsv'))
+        else:
+            self.data_file = open(os.path.join(self.results_path, self.participant_folder, f'experiment_data_{file_idx}.tsv'),"w")
+            self.data_file.write("\t".join(self.column_names) + "\n")
         self.data_exists = True
 
+    @staticmethod
+    def _open_tsv_for_append(path: str):
+        """
+        Open an existing TSV file for appending, dropping a partially written last row (e.g. after a crash).
+
+        :param path: Path to the TSV file.
+        """
+        with open(path, "r+b") as tsv_file:
+            content = tsv_file.read()
+            tsv_file.truncate(content.rfind(b"\n") + 1)
+        return open(path, "a")
+
     def save_datapoint(self):
         """
         Save a datapoint to the file.
@@ -80,19 +315,125 @@ class Logger:
 
         assert len(self.original_state_dict_keys) == len(self.data_dict), f"Mismatch in the number of original keys and the number of keys in the current self.data_dict.\n{set(self.data_dict.keys()) - self.original_state_dict_keys}"
 
-        datapoint_to_write = []
-        for column_name in self.column_names:
-            column_split = column_name.split(".")
+        datapoint_to_write = self.row_getter(self.data_dict)
+        if self.log_format == "binary" and None in datapoint_to_write:
+            datapoint_to_write = tuple(self._binary_value(name, value) for name, value in zip(self.column_names, datapoint_to_write))
 
-            current = self.data_dict
-            for column_substring in column_split:
-                if column_substring.isdigit():
-                    column_substring = int(column_substring)
-                current = current[column_substring]
-            
-            datapoint_to_write.append(str(current))
+        self._submit(("row", datapoint_to_write))
 
-        self.data_file.write("\t".join(datapoint_to_write) + "\n")
+    def _submit(self, item: tuple):
+        """
+        Write an item to disk, or queue it for the writer thread when writing asynchronously.
+        Items are ("row", values), ("block", columns, n), ("stream", records), ("frames", frames) or ("sync",).
+
+        :param item: Item to write.
+        """
+        if not self.async_write:
+            self._write(item)
+            return
+        try:
+            self.write_queue.put_nowait(item)
+            self.queue_high_water = max(self.queue_high_water, self.write_queue.qsize())
+        except queue.Full:
+            if item[0] == "sync":
+                self.write_queue.put(item)     # never drop a sync request
+            elif item[0] == "block":
+                self.dropped_records += item[2]
+            elif item[0] in {"stream", "frames"}:
+                self.dropped_records += len(item[1])
+            else:
+                self.dropped_records += 1
+
+    def _write(self, item: tuple):
+        """
+        Write a single item to the data file.
+
+        :param item: Item as passed to _submit().
+        """
+        if item[0] == "row":
+            if self.log_format == "binary":
+                self.recorder.append(tuple(item[1]))
+            else:
+                self.data_file.write(self.row_template.format(*item[1]))
+        elif item[0] == "block":
+            self.recorder.append_block(item[1], item[2])
+        elif item[0] == "stream":
+            for record in item[1]:
+                if self.log_format == "binary":
+                    self.stream_recorder.append(record)
+                else:
+                    self.stream_file.write(self.stream_template.format(*record))
+        elif item[0] == "frames":
+            frames = item[1]
+            if self.log_format == "binary":
+                self.frames_recorder.append_block({name: frames[name] for name in frames.dtype.names}, len(frames))
+            else:
+                for record in frames.tolist():
+                    self.frames_file.write(self.frames_template.format(*record))
+        elif item[0] == "sync":
+            if self.log_format == "binary":
+                self.recorder.flush()
+                os.fsync(self.recorder.file.fileno())
+            else:
+                self.data_file.flush()
+                os.fsync(self.data_file.fileno())
+            if self.stream_exists:
+                if self.log_format == "binary":
+                    self.stream_recorder.flush()
+                    os.fsync(self.stream_recorder.file.fileno())
+                else:
+                    self.stream_file.flush()
+                    os.fsync(self.stream_file.fileno())
+            if self.frames_exists:
+                if self.log_format == "binary":
+                    self.frames_recorder.flush()
+                    os.fsync(self.frames_recorder.file.fileno())
+                else:
+                    self.frames_file.flush()
+                    os.fsync(self.frames_file.fileno())
+
+    def _writer_loop(self):
+        """
+        Write queued items to disk in batches until the stop sentinel (None) is received.
+        """
+        while True:
+            batch = [self.write_queue.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    return
+                try:
+                    self._write(item)
+                except Exception as e:
+                    self.logger.error(f"Error while writing experiment data: {e}")
+
+    def end_trial(self):
+        """
+        Make sure all data recorded so far is on disk (called at the end of every trial).
+        """
+        if self.no_log or not self.save_data or not self.data_exists:
+            return
+        self._submit(("sync",))
+
+    def _check_trial_end(self, event_id):
+        """
+        Call end_trial() when a trial-ending event is logged for the first time.
+        """
+        if event_id != self.last_event_id and event_id in self.trial_end_events:
+            self.end_trial()
+        self.last_event_id = event_id
+
+    def _binary_value(self, column_name, value):
+        """
+        Convert a value to something that fits the binary column (None becomes NaN or "").
+        """
+        if value is None:
+            return "" if column_name in self.string_columns else np.nan
+        return value
 
     def save_experiment_config(self, experiment_config: dict, filename: str=None):
         """
@@ -109,6 +450,38 @@ class Logger:
                 assert filename.endswith(".json")
             json.dump(experiment_config, open(os.path.join(self.results_path, self.participant_folder, filename),"w"), indent=4, sort_keys=True)
 
+    def save_latency_trace(self, tracer):
+        """
+        Save the latency histograms of a LatencyTracer next to the experiment data (latency_trace_NN.json).
+
+        :param tracer: LatencyTracer instance.
+        """
+        if not self.no_log and self.save_data and self.data_exists:
+            tracer.save(os.path.join(self.results_path, self.participant_folder, f"latency_trace_{self.file_idx:02d}.json"))
+
+    def save_prediction_metrics(self, prediction_metrics: list, summary: dict, fusion_decisions: list=None):
+        """
+        Save the latencies of every used prediction and their summary next to the experiment data (prediction_metrics_NN.json).
+
+        :param prediction_metrics: Per-trial records of LSLHandler.prediction_metrics.
+        :param summary: Summary returned by LSLHandler.prediction_summary().
+        :param fusion_decisions: Fused decisions with the predictions of every classifier they were made from (PredictionFusion.decisions).
+        """
+        if not self.no_log and self.save_data and self.data_exists:
+            with open(os.path.join(self.results_path, self.participant_folder, f"prediction_metrics_{self.file_idx:02d}.json"), "w") as metrics_file:
+                json.dump({"summary": summary, "trials": prediction_metrics, "fusion": fusion_decisions or []}, metrics_file, indent=4)
+
+    def save_clock_offsets(self, summary: dict, estimates: dict):
+        """
+        Save the clock offset estimates of every LSL inlet and their summary next to the experiment data (clock_offsets_NN.json).
+
+        :param summary: Summary returned by LSLHandler.clock_summary().
+        :param estimates: Inlet name -> list of (local time, offset, residual to the fit) in s (ClockSync.estimates()).
+        """
+        if not self.no_log and self.save_data and self.data_exists:
+            with open(os.path.join(self.results_path, self.participant_folder, f"clock_offsets_{self.file_idx:02d}.json"), "w") as offsets_file:
+                json.dump({"summary": summary, "estimates": estimates}, offsets_file, indent=4)
+
     def save_data_dict(self, state_dict, reset=False):
         """
         Save the state dictionary values to the data dictionary.
@@ -129,13 +502,192 @@ class Logger:
         self.data_dict["event_id"] = state_dict["event_id"]
         self.data_dict["event_type"] = state_dict["event_type"]
         self.data_dict["timestamp"] = state_dict["timestamp"]
+        self.data_dict["timestamp_corrected"] = state_dict["timestamp"]    # taken with the local clock
         self.data_dict["prediction"] = state_dict["event_type"]
 
         self.save_datapoint()
+        self._check_trial_end(state_dict["event_id"])
 
         # print(self.data_dict)
 
+    def save_EXO_samples(self, state_dict, samples, timestamps, corrected_timestamps=None):
+        """
+        Save one row per EXO sample (as read from the EXORingBuffer), combining the sample's
+        kinematics and LSL timestamp with the current event information from the state dictionary.
+
+        :param state_dict: State dictionary.
+        :param samples: 2D array of EXO samples, columns ordered as EXORingBuffer.channels.
+        :param timestamps: LSL timestamps of the samples (EXO clock).
+        :param corrected_timestamps: Timestamps corrected to the local clock (LSLHandler.correct_exo_timestamps()), default timestamps.
+        """
+        if corrected_timestamps is None:
+            corrected_timestamps = timestamps
+        self.data_dict["event_id"] = state_dict["event_id"]
+        self.data_dict["event_type"] = state_dict["event_type"]
+        self.data_dict["prediction"] = state_dict["event_type"]
+
+        if self.log_format == "binary" and not self.no_log and self.save_data:
+            # Copy the whole block column-wise instead of writing row by row
+            if not self.data_exists:
+                self.create_file()
+            self._submit(("block", {
+                "current_position": samples[:, 0],
+                "current_velocity": samples[:, 1],
+                "current_torque": samples[:, 2],
+                "desired_torque": samples[:, 4],
+                "demanded_torque": samples[:, 5],
+                "measured_torque": samples[:, 6],
+                "timestamp": timestamps,
+                "timestamp_corrected": corrected_timestamps,
+                "event_id": self.data_dict["event_id"],
+                "event_type": self._binary_value("event_type", self.data_dict["event_type"]),
+                "prediction": self._binary_value("prediction", self.data_dict["prediction"]),
+            }, len(timestamps)))
+            self._check_trial_end(state_dict["event_id"])
+            return
+
+        for sample, timestamp, corrected_timestamp in zip(samples.tolist(), timestamps.tolist(), corrected_timestamps.tolist()):
+            self.data_dict["current_position"] = round(sample[0], 5)
+            self.data_dict["current_velocity"] = round(sample[1], 5)
+            self.data_dict["current_torque"] = round(sample[2], 5)
+            self.data_dict["desired_torque"] = round(sample[4], 5)
+            self.data_dict["demanded_torque"] = round(sample[5], 5)
+            self.data_dict["measured_torque"] = round(sample[6], 5)
+            self.data_dict["timestamp"] = timestamp
+            self.data_dict["timestamp_corrected"] = corrected_timestamp
+
+            self.save_datapoint()
+        self._check_trial_end(state_dict["event_id"])
+
+    def create_stream_file(self):
+        """
+        Create the continuous stream log file, with the same index as the experiment data file.
+        """
+        if not self.data_exists:
+            self.create_file()
+        file_idx = f'{self.file_idx:02d}'
+        column_names = [name for name, _ in self.stream_columns]
+        stream_path = os.path.join(self.results_path, self.participant_folder, f'experiment_stream_{file_idx}.' + ("npy" if self.log_format == "binary" else "tsv"))
+        resume = self.resumed and os.path.exists(stream_path)
+        if self.log_format == "binary":
+            self.stream_recorder = BinaryRecorder(stream_path, list(self.stream_columns), mode="r+b" if resume else "wb")
+        else:
+            if resume:
+                self.stream_file = self._open_tsv_for_append(stream_path)
+            else:
+                self.stream_file = open(stream_path, "w")
+                self.stream_file.write("\t".join(column_names) + "\n")
+            self.stream_template = "\t".join(["{}"] * len(column_names)) + "\n"
+        self.stream_exists = True
+
+    def save_stream(self, samples, timestamps, events, corrected_timestamps=None):
+        """
+        Add EXO samples and pushed event markers to the continuous stream log, which records every
+        sample and event with its own LSL timestamp in a single file, sorted by the timestamps corrected
+        to the local clock (events are stamped with the local clock already).
+        Rows are sorted and written once they are older than stream_holdback seconds.
+
+        :param samples: 2D array of EXO samples, columns ordered as EXORingBuffer.channels.
+        :param timestamps: LSL timestamps of the samples (EXO clock).
+        :param events: List of event dictionaries as pushed to the ExperimentEvents stream.
+        :param corrected_timestamps: Sample timestamps corrected to the local clock, default timestamps.
+        """
+        if self.no_log or not self.save_data:
+            return
+        if not self.stream_exists:
+            self.create_stream_file()
+        if corrected_timestamps is None:
+            corrected_timestamps = timestamps
+
+        for sample, timestamp, corrected_timestamp in zip(samples.tolist(), timestamps.tolist(), corrected_timestamps.tolist()):
+            self.stream_pending.append((timestamp, corrected_timestamp, "sample", *sample[:7], 99, "", "", np.nan))
+        for event in events:
+            torque_magnitude = event["TorqueMagnitude"] if isinstance(event["TorqueMagnitude"], (int, float)) else np.nan
+            self.stream_pending.append((event["Event_Timestamp"], event["Event_Timestamp"], "event", *[np.nan] * 7, event["Event_ID"], event["Event_Type"], str(event["TorqueProfile"]), torque_magnitude))
+
+        if self.stream_pending:
+            self._flush_stream(max(record[1] for record in self.stream_pending) - self.stream_holdback)
+
+    def _flush_stream(self, cutoff=np.inf):
+        """
+        Sort pending stream rows and write those with a corrected timestamp up to cutoff.
+
+        :param cutoff: Latest corrected timestamp to write.
+        """
+        self.stream_pending.sort(key=itemgetter(1))
+        n_ready = 0
+        while n_ready < len(self.stream_pending) and self.stream_pending[n_ready][1] <= cutoff:
+            n_ready += 1
+        if n_ready:
+            self._submit(("stream", self.stream_pending[:n_ready]))
+            del self.stream_pending[:n_ready]
+
+    def create_frames_file(self, columns):
+        """
+        Create the frame timing log file (frame_timing_NN), with the same index as the experiment data file.
+
+        :param columns: Column names and binary types of a frame record (FrameMonitor.columns).
+        """
+        if not self.data_exists:
+            self.create_file()
+        frames_path = os.path.join(self.results_path, self.participant_folder, f'frame_timing_{self.file_idx:02d}.' + ("npy" if self.log_format == "binary" else "tsv"))
+        resume = self.resumed and os.path.exists(frames_path)
+        if self.log_format == "binary":
+            self.frames_recorder = BinaryRecorder(frames_path, list(columns), mode="r+b" if resume else "wb")
+        else:
+            if resume:
+                self.frames_file = self._open_tsv_for_append(frames_path)
+            else:
+                self.frames_file = open(frames_path, "w")
+                self.frames_file.write("\t".join(name for name, _ in columns) + "\n")
+            self.frames_template = "\t".join(["{}"] * len(columns)) + "\n"
+        self.frames_exists = True
+
+    def save_frames(self, frames):
+        """
+        Add frames recorded by the FrameMonitor (flip times, frame intervals, dropped frames and cue onsets)
+        to the frame timing log.
+
+        :param frames: Structured array of frame records, as returned by FrameMonitor.read_since().
+        """
+        if self.no_log or not self.save_data or not len(frames):
+            return
+        if not self.frames_exists:
+            self.create_frames_file([(name, frames.dtype[name]) for name in frames.dtype.names])
+        self._submit(("frames", frames))
+
     def close(self):
         if self.no_log or not self.save_data:
             return
+        if self.stream_exists:
+            self._flush_stream()
+        if self.async_write:
+            # Drain everything still queued before closing the file
+            self.write_queue.put(None)
+            self.writer_thread.join()
+            self.logger.info(f"Data writer stopped. Max queue size {self.queue_high_water}, {self.dropped_records} records dropped.")
+        if self.stream_exists:
+            if self.log_format == "binary":
+                self.stream_recorder.close()
+            else:
+                self.stream_file.close()
+        if self.frames_exists:
+            if self.log_format == "binary":
+                self.frames_recorder.close()
+            else:
+                self.frames_file.close()
+        if self.log_format == "binary":
+            if self.data_exists:
+                self.recorder.close()
+            return
         self.data_file.close()
+
+if __name__ == "__main__":
+    # Offline export of binary experiment data to TSV
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export_tsv", nargs="+", required=True, help="Binary experiment data file(s) (.npy) to export to TSV")
+    args = parser.parse_args()
+
+    for npy_path in args.export_tsv:
+        export_tsv(npy_path)
+        print(f"Exported {npy_path}")
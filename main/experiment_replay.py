@@ -0,0 +1,284 @@
+import os
+import re
+import csv
+import json
+import logging
+import argparse
+from bisect import bisect_right
+from time import perf_counter, sleep
+import numpy as np
+import pygame
+
+from experiment_do import initialize_state_dict
+from experiment_state_machine import StateMachine
+from experiment_simulation import VirtualClock, ScriptedInput, SimulatedLSL, BandDetector
+
+# Columns read from a recorded experiment data file
+LOG_COLUMNS = ("current_position", "current_velocity", "current_torque", "desired_torque", "demanded_torque", "measured_torque", "event_id", "timestamp")
+
+# Events that start a trial phase (cue shown), used to place the randomly drawn waits and to read the trial plan
+CUE_EVENTS = {
+    StateMachine.imagine_UP, StateMachine.intend_UP, StateMachine.execute_UP,
+    StateMachine.imagine_DOWN, StateMachine.intend_DOWN, StateMachine.execute_DOWN,
+}
+UP_CUE_EVENTS = {StateMachine.imagine_UP, StateMachine.intend_UP, StateMachine.execute_UP}
+TRIAL_END_EVENTS = {StateMachine.success, StateMachine.failure, StateMachine.timeout}
+
+def load_session_log(path: str):
+    """
+    Read a recorded experiment data file (.tsv or binary .npy).
+
+    :param path: Path to experiment_data_NN.tsv / .npy.
+    :return: dict of numpy arrays, one per column in LOG_COLUMNS.
+    """
+    if path.endswith(".npy"):
+        records = np.load(path)
+        return {name: np.asarray(records[name], dtype=np.int64 if name == "event_id" else np.float64) for name in LOG_COLUMNS}
+
+    columns = {name: [] for name in LOG_COLUMNS}
+    with open(path, "r", newline="") as tsv_file:
+        for row in csv.DictReader(tsv_file, delimiter="\t"):
+            for name in LOG_COLUMNS:
+                value = row.get(name)
+                columns[name].append(float(value) if value not in (None, "", "None") else np.nan)
+    log = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+    log["event_id"] = np.nan_to_num(log["event_id"], nan=StateMachine.no_event).astype(np.int64)
+    return log
+
+def find_config(log_path: str):
+    """
+    Return the experiment_config snapshot saved next to a data file with the same index, or None.
+    """
+    match = re.search(r"experiment_data_(\d+)", os.path.basename(log_path))
+    if match is None:
+        return None
+    config_path = os.path.join(os.path.dirname(log_path), f"experiment_config{match.group(1)}.json")
+    return config_path if os.path.exists(config_path) else None
+
+def collapse(event_ids):
+    """
+    Return the rows at which the event ID changes and the event IDs from those rows.
+    """
+    event_ids = np.asarray(event_ids)
+    onset_rows = np.flatnonzero(np.diff(event_ids, prepend=event_ids[0] - 1))
+    return onset_rows, event_ids[onset_rows]
+
+def trial_plan_from_log(event_ids):
+    """
+    Reconstruct the trial plan (as recorded by SessionJournal.write_plan) from the event sequence.
+    Directions come from the cue events, correctness from exo_execution_correct/incorrect events;
+    torque profiles and magnitudes are not part of the data file and are left at 0.
+    """
+    _, events = collapse(event_ids)
+    directions, correctness = [], []
+    in_trial = False
+    for event_id in events:
+        if event_id in CUE_EVENTS and not in_trial:
+            directions.append(1 if event_id in UP_CUE_EVENTS else 0)
+            correctness.append(1)
+            in_trial = True
+        elif event_id == StateMachine.exo_execution_incorrect and in_trial:
+            correctness[-1] = 0
+        elif event_id in TRIAL_END_EVENTS:
+            in_trial = False
+    return {
+        "events": directions,
+        "correctness": correctness,
+        "torque_profiles": [0] * len(directions),
+        "torque_magnitudes": [0] * len(directions),
+    }
+
+class ReplaySource:
+    """
+    Stand-in for the EXO inlet (returns the recorded sample of the current row) and for the
+    EXO instructions outlet (records the instructions sent by the state machine).
+    """
+
+    def __init__(self, log: dict):
+        self.log = log
+        self.row = 0
+        self.instructions = []      # (row, instructions)
+        # exo_execution is not logged, it is reconstructed from the exo_execution_correct/incorrect events
+        self.exo_execution = np.isin(log["event_id"], [StateMachine.exo_execution_correct, StateMachine.exo_execution_incorrect]).astype(np.float64)
+
+    def push_sample(self, instructions):
+        self.instructions.append((self.row, list(instructions)))
+
+    def flush(self):
+        pass
+
+    def pull_sample(self, timeout: float = 0.0):
+        log, row = self.log, self.row
+        sample = [
+            log["current_position"][row],
+            log["current_velocity"][row],
+            log["current_torque"][row],
+            self.exo_execution[row],
+            log["desired_torque"][row],
+            log["demanded_torque"][row],
+            log["measured_torque"][row],
+        ]
+        return sample, log["timestamp"][row]
+
+class RecordedWaitTimes:
+    """
+    Replaces the random wait times of the state machine: every drawn wait ends at the next
+    recorded cue onset, so replayed trial phases start on the same rows as in the recording.
+    """
+
+    def __init__(self, clock: VirtualClock, cue_onset_times):
+        self.clock = clock
+        self.cue_onset_times = list(cue_onset_times)
+
+    def __call__(self, time_range):
+        now = self.clock()
+        idx = bisect_right(self.cue_onset_times, now)
+        if idx == len(self.cue_onset_times):
+            return time_range[1]
+        return self.cue_onset_times[idx] - now
+
+class Replay:
+    """
+    Re-drives the StateMachine (and the LSLHandler logic, with local stand-in streams) from a recorded
+    session: recorded kinematics are fed in row by row on the recorded timestamps, ENTER is pressed on
+    the second row and ESC on the last, and the regenerated event IDs are compared with the recorded ones.
+    Key presses that are not part of the data file (e.g. pauses) cannot be reproduced.
+    """
+
+    def __init__(self, log: dict, experiment_config: dict, speed: float = 0.0):
+        """
+        Initialize the Replay class.
+
+        :param log: Recorded session, as returned by load_session_log().
+        :param experiment_config: Configuration snapshot of the recorded session.
+        :param speed: Replay speed relative to the recording (1 = real time), 0 = as fast as possible.
+        """
+        self.log = log
+        self.speed = speed
+        self.clock = VirtualClock(log["timestamp"][0])
+        self.keys = ScriptedInput(self.clock)
+        self.state_dict, _ = initialize_state_dict(None, experiment_config)
+        self.state_dict["exo_execution"] = 0
+        self.state_dict["trial_in_progress"] = False
+        for key in ("previous_enter_state", "previous_escape_state", "previous_space_state"):
+            self.state_dict[key] = False
+
+        # The serial loop detected bands after the state update (one frame late), the control thread before it
+        self.bands_before_update = self.state_dict["control_rate"] > 0
+
+        onset_rows, onset_events = collapse(log["event_id"])
+        cue_onset_times = log["timestamp"][onset_rows[np.isin(onset_events, list(CUE_EVENTS))]]
+
+        self.source = ReplaySource(log)
+        self.LSL = SimulatedLSL(self.source, self.clock, self.state_dict)
+        self.bands = BandDetector(
+            self.state_dict["exo_parameters"]["maximum_arm_position_deg"],
+            self.state_dict["exo_parameters"]["minimum_arm_position_deg"]
+        )
+        self.state_machine = StateMachine(self.LSL, clock=self.clock, get_pressed=self.keys, draw_wait_time=RecordedWaitTimes(self.clock, cue_onset_times))
+
+        plan = trial_plan_from_log(log["event_id"])
+        plan["familiarization_trial_No"] = experiment_config["experiment"]["number_of_familiarization_trials"]
+        plan["trials_No"] = len(plan["events"])
+        self.state_machine.resume_session = {"plan": plan, "trials": []}
+
+        self.logger = logging.getLogger("Replay")
+
+    def run(self):
+        """
+        Replay all recorded rows.
+
+        :return: Report dictionary (see compare()).
+        """
+        log, state_dict = self.log, self.state_dict
+        timestamps = log["timestamp"]
+        n_rows = len(timestamps)
+        replayed = np.empty(n_rows, dtype=np.int64)
+
+        self.keys.press(pygame.K_RETURN, at=timestamps[1], duration=1e-9)     # row 0 only shows the initial screen
+        self.keys.press(pygame.K_ESCAPE, at=timestamps[-1], duration=1e-9)
+        self.bands.detect_bands(dict(state_dict, current_position=None) if np.isnan(log["current_position"][0]) else state_dict)
+
+        wall_start = perf_counter()
+        update_time = 0.0
+        for row in range(n_rows):
+            self.clock.now = timestamps[row]
+            self.source.row = row
+            if self.speed > 0:
+                delay = (timestamps[row] - timestamps[0]) / self.speed - (perf_counter() - wall_start)
+                if delay > 0:
+                    sleep(delay)
+
+            update_start = perf_counter()
+            state_dict["timestamp"] = timestamps[row]
+            self.LSL.EXO_stream_in(state_dict)
+            if self.bands_before_update:
+                self.bands.detect_bands(state_dict)
+            _, state_dict = self.state_machine.maybe_update_state(state_dict)
+            if not self.bands_before_update:
+                self.bands.detect_bands(state_dict)
+            update_time += perf_counter() - update_start
+            replayed[row] = state_dict["event_id"]
+
+        wall_time = perf_counter() - wall_start
+        report = self.compare(log["event_id"], replayed, timestamps)
+        report.update({
+            "rows": n_rows,
+            "wall_time": round(wall_time, 3),
+            "rows_per_s": round(n_rows / wall_time, 1) if wall_time > 0 else None,
+            "mean_update_us": round(1e6 * update_time / n_rows, 2),
+            "exo_instructions": len(self.source.instructions),
+        })
+        self.replayed = replayed
+        return report
+
+    @staticmethod
+    def compare(recorded, replayed, timestamps):
+        """
+        Compare the recorded and replayed event ID columns.
+
+        :return: dict with "match" (same event sequence), "row_agreement" (fraction of rows with the same ID),
+                 "first_mismatch" (row of the first differing event onset, or None) and onset timing offsets.
+        """
+        recorded_rows, recorded_events = collapse(recorded)
+        replayed_rows, replayed_events = collapse(replayed)
+        n = min(len(recorded_events), len(replayed_events))
+        differs = np.flatnonzero(recorded_events[:n] != replayed_events[:n])
+        if len(differs):
+            first = int(differs[0])
+        elif len(recorded_events) != len(replayed_events):
+            first = n
+        else:
+            first = None
+
+        matched = n if first is None else first
+        offsets = np.abs(timestamps[recorded_rows[:matched]] - timestamps[replayed_rows[:matched]])
+        return {
+            "match": first is None,
+            "recorded_events": len(recorded_events),
+            "replayed_events": len(replayed_events),
+            "first_mismatch": None if first is None else {
+                "recorded": {"row": int(recorded_rows[first]), "event_id": int(recorded_events[first])} if first < len(recorded_events) else None,
+                "replayed": {"row": int(replayed_rows[first]), "event_id": int(replayed_events[first])} if first < len(replayed_events) else None,
+            },
+            "row_agreement": round(float(np.mean(np.asarray(recorded) == np.asarray(replayed))), 4),
+            "onset_offset_mean_ms": round(1000 * float(offsets.mean()), 2) if len(offsets) else None,
+            "onset_offset_max_ms": round(1000 * float(offsets.max()), 2) if len(offsets) else None,
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through the state machine and compare the event sequences.")
+    parser.add_argument("logs", nargs="+", help="experiment_data_NN.tsv/.npy files")
+    parser.add_argument("--config", default=None, help="Configuration file (default: experiment_configNN.json next to each data file)")
+    parser.add_argument("--speed", type=float, default=0.0, help="Replay speed (1 = real time, 10 = 10x, 0 = as fast as possible)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    for log_path in args.logs:
+        config_path = args.config or find_config(log_path)
+        if config_path is None:
+            print(f"{log_path}: no configuration found, use --config.")
+            continue
+        replay = Replay(load_session_log(log_path), json.load(open(config_path, "r")), speed=args.speed)
+        print(f"{log_path}:")
+        print(json.dumps(replay.run(), indent=4))
@@ -0,0 +1,310 @@
+import logging
+import numpy as np
+
+# Record layout of a trial plan (one record per trial)
+SCHEDULE_DTYPE = np.dtype([
+    ("event", np.int64),                # 1 = UP, 0 = DOWN
+    ("correctness", np.int64),          # 1 = correct execution (assist), 0 = incorrect (resist)
+    ("torque_profile", np.int64),       # torque profile ID
+    ("torque_magnitude", np.float64),   # Nm
+    ("condition", np.int64),            # index of the trial condition, -1 for familiarization / end control trials
+])
+# Execution, torque profile and torque magnitude of familiarization and end control trials (not used)
+PLACEHOLDER = 99
+
+def balanced_latin_square_row(n: int, row: int):
+    """
+    Return one row of a balanced Latin square (Williams design) of n conditions: across n consecutive
+    rows (2n for odd n) every condition appears once in every position and follows every other condition
+    equally often.
+
+    :param n: Number of conditions.
+    :param row: Row index (e.g. participant ID).
+    :return: List of condition indices.
+    """
+    order = []
+    j = h = 0
+    for i in range(n):
+        if i < 2 or i % 2 != 0:
+            value = j
+            j += 1
+        else:
+            value = n - h - 1
+            h += 1
+        order.append((value + row) % n)
+    if n % 2 != 0 and (row // n) % 2 != 0:
+        order.reverse()
+    return order
+
+def max_run_lengths(directions: np.ndarray):
+    """
+    Return the length of the longest run of equal values in every row of a 2D array.
+
+    :param directions: Array of shape (candidates, trials).
+    """
+    n = directions.shape[1]
+    positions = np.arange(n)
+    run_start = np.ones(directions.shape, dtype=bool)
+    run_start[:, 1:] = directions[:, 1:] != directions[:, :-1]
+    last_start = np.maximum.accumulate(np.where(run_start, positions, 0), axis=1)
+    return (positions - last_start + 1).max(axis=1)
+
+def block_sums(values: np.ndarray, block_size: int):
+    """
+    Sum the values of every row over consecutive blocks of block_size columns (the last block may be shorter).
+
+    :param values: Array of shape (candidates, trials).
+    :return: Array of shape (candidates, blocks).
+    """
+    cumulative = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(values, axis=1, out=cumulative[:, 1:])
+    edges = np.append(np.arange(0, values.shape[1], block_size), values.shape[1])
+    return cumulative[:, edges[1:]] - cumulative[:, edges[:-1]]
+
+def direction_patterns(rng: np.random.Generator, n_candidates: int, ups: int, downs: int, max_run_length: int, last=None, run: int = 0):
+    """
+    Draw direction sequences (1 = UP, 0 = DOWN) with the given number of UPs and DOWNs and no more than
+    max_run_length equal directions in a row, position by position for all candidates at once. A direction
+    is drawn with probability proportional to the remaining trials in it unless it is ruled out by the run
+    length or would leave the remaining trials impossible to arrange.
+
+    :param rng: Random generator.
+    :param n_candidates: Number of sequences.
+    :param ups: Number of UP trials.
+    :param downs: Number of DOWN trials.
+    :param max_run_length: Maximum run length (0 = no limit).
+    :param last: Direction preceding the sequences (None = none), for runs continuing from a previous part
+                 (scalar or one per candidate).
+    :param run: Length of the run of the preceding direction (scalar or one per candidate).
+    :return: Array of shape (candidates, ups + downs).
+    """
+    n = ups + downs
+    limit = max_run_length if max_run_length > 0 else n + 1
+    u = np.full(n_candidates, ups)
+    d = np.full(n_candidates, downs)
+    last = np.full(n_candidates, -1 if last is None else last)
+    run = np.full(n_candidates, run)
+
+    def feasible(u, d, last, run):
+        # Remaining UPs fit into the DOWN gaps (the first one continues the current run), and vice versa
+        return (u <= np.where(last == 1, limit - run, limit) + limit * d) & (d <= np.where(last == 0, limit - run, limit) + limit * u)
+
+    patterns = np.empty((n_candidates, n), dtype=np.int64)
+    draws = rng.random((n_candidates, n))
+    for i in range(n):
+        up_run = np.where(last == 1, run + 1, 1)
+        down_run = np.where(last == 0, run + 1, 1)
+        can_up = (u > 0) & (up_run <= limit) & feasible(u - 1, d, 1, up_run)
+        can_down = (d > 0) & (down_run <= limit) & feasible(u, d - 1, 0, down_run)
+        proportional = draws[:, i] * (u + d) < u
+        up = np.where(can_up == can_down, proportional & (u > 0) | (d == 0), can_up)
+        patterns[:, i] = up
+        run = np.where(up == (last == 1), run + 1, 1)
+        last = up.astype(np.int64)
+        u = u - up
+        d = d - ~up
+    return patterns
+
+def familiarization_trials(n: int, rng: np.random.Generator):
+    """
+    Generate n familiarization (or end control) trials: events split evenly between UP and DOWN
+    (the extra trial of an odd n is UP) in random order, all other fields set to PLACEHOLDER.
+
+    :param n: Number of trials.
+    :param rng: Random generator.
+    """
+    trials = np.zeros(n, dtype=SCHEDULE_DTYPE)
+    trials["event"] = rng.permutation(np.arange(n) % 2 == 0).astype(np.int64)
+    trials["correctness"] = PLACEHOLDER
+    trials["torque_profile"] = PLACEHOLDER
+    trials["torque_magnitude"] = PLACEHOLDER
+    trials["condition"] = -1
+    return trials
+
+class ScheduleGenerator:
+    """
+    Generates the full trial plan (familiarization, main and end control trials) as a single structured
+    array from a seed. Many candidate orders of the main trials are drawn at once and the best-balanced
+    one that satisfies the constraints is used:
+        - at most max_run_length consecutive trials in the same direction,
+        - "random" torque profiles balanced within their condition,
+        - directions, conditions and torque profiles spread evenly over blocks of block_size trials,
+        - with counterbalancing, the order of the conditions (when trials are not randomized across
+          conditions) follows a balanced Latin square row chosen by the participant ID.
+    The same seed and configuration always give the same plan.
+    """
+
+    def __init__(self, trial_conditions: dict, profiles: dict, torque_limit: float, familiarization_No: int = 0, end_control_No: int = 0,
+                 randomize: bool = True, max_run_length: int = 0, block_size: int = 0, candidates: int = 1000, balance_profiles: bool = True,
+                 counterbalance: bool = False, participant_id: int = 0):
+        """
+        Initialize the ScheduleGenerator class.
+
+        :param trial_conditions: Trial conditions from the configuration, condition ID -> [assistance, trials, torque profile, torque magnitude].
+        :param profiles: Torque profile name -> ID.
+        :param torque_limit: Torque magnitudes above the limit are clamped to it.
+        :param familiarization_No: Number of familiarization trials (before the main trials).
+        :param end_control_No: Number of end control trials (after the main trials).
+        :param randomize: If True, main trials of all conditions are mixed, otherwise conditions follow each other.
+        :param max_run_length: Maximum number of consecutive main trials in the same direction (0 = no limit).
+        :param block_size: Number of main trials per block for balancing (0 = all main trials are one block).
+        :param candidates: Number of candidate schedules to choose the best-balanced one from.
+        :param balance_profiles: If True, "random" torque profiles are used equally often within a condition,
+                                 otherwise they are drawn independently for every trial.
+        :param counterbalance: If True, the condition order is counterbalanced across participants.
+        :param participant_id: Participant ID, selects the Latin square row with counterbalancing.
+        """
+        self.logger = logging.getLogger("Schedule")
+        self.profiles = profiles
+        self.familiarization_No = familiarization_No
+        self.end_control_No = end_control_No
+        self.randomize = randomize
+        self.max_run_length = max_run_length
+        self.candidates = max(1, candidates)
+        self.balance_profiles = balance_profiles
+
+        condition_ids = list(trial_conditions)
+        self.condition_order = list(range(len(condition_ids)))
+        if counterbalance and len(condition_ids) > 1:
+            self.condition_order = balanced_latin_square_row(len(condition_ids), participant_id)
+
+        # Main trials before shuffling, condition by condition (UP and DOWN alternating within a condition)
+        events, correctness, torque_profiles, magnitudes, conditions, random_profile = [], [], [], [], [], []
+        for position, condition_idx in enumerate(self.condition_order):
+            condition_id = condition_ids[condition_idx]
+            assistance, trials_No, torque_profile, torque_magnitude = trial_conditions[condition_id]
+            if assistance not in {"assist", "resist"}:
+                self.logger.error(f"Invalid assistance type: {assistance} in condition {condition_id}.")
+                raise ValueError(f"Invalid assistance type: {assistance} in condition {condition_id}.")
+            if torque_profile != "random" and torque_profile not in profiles:
+                self.logger.error(f"Invalid torque profile: {torque_profile} in condition {condition_id}.")
+                raise ValueError(f"Invalid torque profile: {torque_profile} in condition {condition_id}.")
+            if torque_magnitude > torque_limit:
+                self.logger.warning(f"Torque magnitude ({torque_magnitude} Nm) exceeds limit, setting to {torque_limit} Nm.")
+                torque_magnitude = torque_limit
+
+            events.append(np.arange(trials_No) % 2 == 0)        # odd number of trials -> extra UP
+            correctness.append(np.full(trials_No, 1 if assistance == "assist" else 0))
+            torque_profiles.append(np.full(trials_No, profiles.get(torque_profile, PLACEHOLDER)))
+            magnitudes.append(np.full(trials_No, torque_magnitude, dtype=np.float64))
+            conditions.append(np.full(trials_No, condition_idx))
+            random_profile.append(np.full(trials_No, torque_profile == "random"))
+
+        def concatenate(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+        self.events = concatenate(events, np.int64)
+        self.correctness = concatenate(correctness, np.int64)
+        self.torque_profiles = concatenate(torque_profiles, np.int64)
+        self.magnitudes = concatenate(magnitudes, np.float64)
+        self.conditions = concatenate(conditions, np.int64)
+        self.random_profile = concatenate(random_profile, bool)
+        # Position of every trial within its condition, used to deal out "random" profiles evenly
+        self.rank_in_condition = concatenate([np.arange(len(condition)) for condition in conditions], np.int64)
+        # Main trials are ordered in one segment, or one segment per condition when not randomizing across conditions
+        lengths = [len(condition) for condition in conditions]
+        self.segments = [(0, len(self.events))] if randomize else [(start, start + length) for start, length in zip(np.cumsum([0] + lengths[:-1]), lengths)]
+        self.block_size = block_size if block_size > 0 else max(1, len(self.events))
+
+    def _candidate_profiles(self, rng: np.random.Generator, n_candidates: int):
+        """
+        Return the torque profile of every main trial for every candidate, shape (candidates, trials).
+        """
+        torque_profiles = np.repeat(self.torque_profiles[None, :], n_candidates, axis=0)
+        if not self.random_profile.any():
+            return torque_profiles
+        profile_ids = np.array(list(self.profiles.values()))
+        n_random = int(self.random_profile.sum())
+        if self.balance_profiles:
+            # Deal the profiles out in a random order per candidate, so each one is used equally often (+-1)
+            label_order = rng.random((n_candidates, len(profile_ids))).argsort(axis=1)
+            labels = np.take_along_axis(label_order, np.broadcast_to(self.rank_in_condition[self.random_profile] % len(profile_ids), (n_candidates, n_random)), axis=1)
+        else:
+            labels = rng.integers(0, len(profile_ids), size=(n_candidates, n_random))
+        torque_profiles[:, self.random_profile] = profile_ids[labels]
+        return torque_profiles
+
+    def _candidate_orders(self, rng: np.random.Generator, n_candidates: int):
+        """
+        Return random orders of the main trials (indices into the unshuffled trials), shape (candidates, trials):
+        a direction pattern is drawn for every segment, and its UP and DOWN trials are dealt out in random order.
+        """
+        order = np.empty((n_candidates, len(self.events)), dtype=np.int64)
+        last, run = None, 0
+        for start, end in self.segments:
+            segment = self.events[start:end]
+            patterns = direction_patterns(rng, n_candidates, int(segment.sum()), int(len(segment) - segment.sum()), self.max_run_length, last, run)
+            # Positions of the UPs, then of the DOWNs, in every pattern
+            positions = np.argsort(1 - patterns, axis=1, kind="stable")
+            n_up = int(segment.sum())
+            for direction, columns in ((1, slice(None, n_up)), (0, slice(n_up, None))):
+                trials = start + np.flatnonzero(segment == direction)
+                shuffled = trials[rng.random((n_candidates, len(trials))).argsort(axis=1)]
+                np.put_along_axis(order[:, start:end], positions[:, columns], shuffled, axis=1)
+            # Runs continue across condition segments
+            if len(segment):
+                same = patterns[:, ::-1] == patterns[:, -1:]
+                run = np.where(same.all(axis=1), np.where(patterns[:, -1] == last, run, 0) + len(segment), same.argmin(axis=1))
+                last = patterns[:, -1]
+        return order
+
+    def _imbalance(self, events: np.ndarray, torque_profiles: np.ndarray, conditions: np.ndarray):
+        """
+        Return the imbalance of every candidate: the sum over blocks of |UP - DOWN| and of the deviations
+        of torque profile and condition counts from their share of the block.
+        """
+        n = events.shape[1]
+        block_lengths = block_sums(np.ones((1, n)), self.block_size)
+        imbalance = np.abs(2 * block_sums(events, self.block_size) - block_lengths).sum(axis=1)
+        for labels in (torque_profiles, conditions):
+            for label in np.unique(labels):
+                is_label = labels == label
+                expected = block_lengths * is_label.sum(axis=1, keepdims=True) / n
+                imbalance += np.abs(block_sums(is_label, self.block_size) - expected).sum(axis=1)
+        return imbalance
+
+    def generate(self, seed: int):
+        """
+        Generate the trial plan.
+
+        :param seed: Seed of the random generator.
+        :return: Tuple (plan, info) where plan is a structured array with SCHEDULE_DTYPE (familiarization,
+                 main and end control trials) and info a dict describing the chosen candidate.
+        """
+        rng = np.random.default_rng(seed)
+        familiarization = familiarization_trials(self.familiarization_No, rng)
+        n = len(self.events)
+        info = {"seed": seed, "candidates": 0, "valid_candidates": 0, "max_run_length": 0, "imbalance": 0.0}
+
+        main = np.zeros(n, dtype=SCHEDULE_DTYPE)
+        if n:
+            n_candidates = self.candidates
+            torque_profiles = self._candidate_profiles(rng, n_candidates)
+            order = self._candidate_orders(rng, n_candidates)
+            events = self.events[order]
+            torque_profiles = np.take_along_axis(torque_profiles, order, axis=1)
+            conditions = self.conditions[order]
+
+            run_lengths = max_run_lengths(events)
+            imbalance = self._imbalance(events, torque_profiles, conditions)
+            valid = run_lengths <= self.max_run_length if self.max_run_length > 0 else np.ones(n_candidates, dtype=bool)
+            if valid.any():
+                best = int(np.flatnonzero(valid)[np.argmin(imbalance[valid])])
+            else:
+                best = int(np.lexsort((imbalance, run_lengths))[0])
+                self.logger.warning(f"No schedule out of {n_candidates} with at most {self.max_run_length} trials in the same direction, "
+                                    f"using one with {run_lengths[best]}.")
+
+            main["event"] = events[best]
+            main["correctness"] = self.correctness[order[best]]
+            main["torque_profile"] = torque_profiles[best]
+            main["torque_magnitude"] = self.magnitudes[order[best]]
+            main["condition"] = conditions[best]
+            info.update({
+                "candidates": n_candidates,
+                "valid_candidates": int(valid.sum()),
+                "max_run_length": int(run_lengths[best]),
+                "imbalance": round(float(imbalance[best]), 3),
+            })
+
+        end_control = familiarization_trials(self.end_control_No, rng)
+        return np.concatenate((familiarization, main, end_control)), info
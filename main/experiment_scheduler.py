@@ -0,0 +1,131 @@
+import threading
+import logging
+from time import perf_counter, sleep
+from pylsl import local_clock
+
+class ControlScheduler:
+    """
+    Runs the control part of the experiment loop (EXO ingest, band detection, state machine
+    and data logging) on its own thread at a fixed rate, independent of the display rate.
+    The render loop only reads consistent snapshots of the state dictionary.
+    """
+
+    def __init__(self, state_dict: dict, LSL, state_machine, interface, data_log, rate: float = 500, tracer=None):
+        """
+        Initialize the ControlScheduler class.
+
+        :param state_dict: Dictionary containing the current state information (owned by the control thread).
+        :param LSL: LSLHandler instance (must ingest EXO data in chunks).
+        :param state_machine: StateMachine instance.
+        :param interface: Interface instance, used for band detection and to log the frames of its frame monitor.
+        :param data_log: Logger instance.
+        :param rate: Control loop rate in Hz.
+        :param tracer: LatencyTracer for per-stage latencies of every tick (optional).
+        """
+        self.state_dict = state_dict
+        self.LSL = LSL
+        self.state_machine = state_machine
+        self.interface = interface
+        self.data_log = data_log
+        self.period = 1 / rate
+        self.tracer = tracer
+
+        self.snapshot_lock = threading.Lock()
+        self.snapshot = dict(state_dict)
+        self.experiment_over = False
+        self.log_cursor = 0
+        self.frames_cursor = 0
+
+        # Timing statistics
+        self.ticks = 0
+        self.overruns = 0
+        self.max_tick_duration = 0
+
+        logging.basicConfig(level=logging.INFO)
+        self.logger = logging.getLogger("Scheduler")
+
+    def tick(self):
+        """
+        Run a single control step and publish a snapshot for the render loop.
+        """
+        state_dict = self.state_dict
+        tracer = self.tracer
+        if tracer is not None:
+            tracer.begin_frame()
+        state_dict["timestamp"] = local_clock()
+
+        # Stream data, detect bands and update state
+        self.LSL.EXO_stream_in(state_dict)
+        if tracer is not None:
+            tracer.mark("ingest")
+        self.interface.detect_bands(state_dict)
+        if tracer is not None:
+            tracer.mark("bands")
+        self.experiment_over, state_dict = self.state_machine.maybe_update_state(state_dict)
+        if tracer is not None:
+            tracer.mark("state_update")
+
+        if "previous_state" not in state_dict:
+            state_dict["previous_state"] = None
+        if "event_type" not in state_dict:
+            state_dict["event_type"] = None
+
+        # Save every EXO sample received since the last tick
+        samples, timestamps, self.log_cursor, lost = self.LSL.exo_buffer.read_since(self.log_cursor)
+        if lost:
+            self.logger.warning(f"{lost} EXO samples were overwritten before they could be logged.")
+        corrected_timestamps = self.LSL.correct_exo_timestamps(timestamps)
+        self.data_log.save_EXO_samples(state_dict, samples, timestamps, corrected_timestamps)
+        if state_dict["save_stream_log"]:
+            self.data_log.save_stream(samples, timestamps, self.LSL.drain_pushed_events(), corrected_timestamps)
+        # Frames shown by the render loop since the last tick (the logger is only written from this thread)
+        if state_dict["frame_timing_log"]:
+            frames, self.frames_cursor, lost = self.interface.frame_monitor.read_since(self.frames_cursor)
+            if lost:
+                self.logger.warning(f"{lost} frames were overwritten before they could be logged.")
+            self.data_log.save_frames(frames)
+        if tracer is not None:
+            tracer.mark("logging")
+
+        with self.snapshot_lock:
+            self.snapshot = dict(state_dict)
+        if tracer is not None:
+            tracer.end_frame()
+
+    def get_snapshot(self):
+        """
+        Return the latest consistent copy of the state dictionary.
+        """
+        with self.snapshot_lock:
+            return self.snapshot
+
+    def run(self, stop_event: threading.Event):
+        """
+        Run tick() at a fixed rate until stop_event is set or the experiment is over.
+        Deadlines are absolute, so a late tick does not shift the following ones; if the
+        loop falls more than a period behind, it resynchronizes and counts an overrun.
+
+        :param stop_event: Event to signal stopping the control loop.
+        """
+        next_deadline = perf_counter()
+        while not stop_event.is_set() and not self.experiment_over:
+            tick_start = perf_counter()
+            try:
+                self.tick()
+            except Exception as e:
+                self.logger.error(f"Error in control loop: {e}", exc_info=True)
+                stop_event.set()
+                break
+
+            now = perf_counter()
+            self.ticks += 1
+            self.max_tick_duration = max(self.max_tick_duration, now - tick_start)
+
+            next_deadline += self.period
+            if now - next_deadline > self.period:
+                self.overruns += 1
+                next_deadline = now
+            elif next_deadline > now:
+                sleep(next_deadline - now)
+
+        self.logger.info(f"Control loop stopped after {self.ticks} ticks ({self.overruns} overruns, max tick {1000 * self.max_tick_duration:.2f} ms).")
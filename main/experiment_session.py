@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+from time import time
+import numpy as np
+
+def config_hash(experiment_config: dict):
+    """
+    Return a SHA-256 hash of the experiment configuration (independent of key order).
+
+    :param experiment_config: Experiment configuration.
+    """
+    return hashlib.sha256(json.dumps(experiment_config, sort_keys=True).encode("utf-8")).hexdigest()
+
+class SessionJournal:
+    """
+    Append-only journal of an experiment session (JSON lines), checkpointed at every trial boundary,
+    so that a crashed session can be resumed at the next unfinished trial.
+    Entries are:
+        header - config hash and index of the experiment data file
+        plan   - full trial plan (written every time trials are generated)
+        trial  - outcome of a completed trial
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the SessionJournal class. New entries are appended to an existing journal,
+        after dropping a partially written last line (crash while writing).
+
+        :param path: Path to the journal file.
+        """
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "r+b") as journal_file:
+                content = journal_file.read()
+                journal_file.truncate(content.rfind(b"\n") + 1)
+        self.file = open(path, "a")
+
+    def _append(self, entry: dict):
+        """
+        Append an entry and force it to disk.
+        """
+        entry["time"] = time()
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_header(self, experiment_config: dict, file_idx: int):
+        """
+        :param experiment_config: Experiment configuration.
+        :param file_idx: Index of the experiment data file belonging to this session.
+        """
+        self._append({"type": "header", "config_hash": config_hash(experiment_config), "file_idx": file_idx})
+
+    def write_plan(self, events, correctness_list, torque_profile_list, torque_magnitude_list, familiarization_trial_No: int, trials_No: int, schedule_seed: int=None):
+        """
+        Record the trial plan produced by StateMachine.generate_trials() and the seed it was generated from.
+        """
+        self._append({
+            "type": "plan",
+            "events": np.asarray(events).tolist(),
+            "correctness": np.asarray(correctness_list).tolist(),
+            "torque_profiles": np.asarray(torque_profile_list).tolist(),
+            "torque_magnitudes": np.asarray(torque_magnitude_list).tolist(),
+            "familiarization_trial_No": familiarization_trial_No,
+            "trials_No": trials_No,
+            "schedule_seed": schedule_seed,
+        })
+
+    def write_trial(self, trial_No: int, outcome: str, completion_time: float=None):
+        """
+        Record the outcome of a finished trial.
+
+        :param trial_No: Number of the trial (1-based, as shown on screen).
+        :param outcome: "SUCCESS", "FAIL" or "TIMEOUT".
+        :param completion_time: Trial completion time in seconds (successful trials only).
+        """
+        self._append({"type": "trial", "trial_No": trial_No, "outcome": outcome, "completion_time": completion_time})
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def load(path: str):
+        """
+        Read a journal. Lines that cannot be parsed (e.g. truncated by a crash while writing) are skipped.
+
+        :param path: Path to the journal file.
+        :return: dict with "header", "plan" (latest plan or None) and "trials" (outcomes recorded after that plan).
+        """
+        session = {"header": None, "plan": None, "trials": []}
+        with open(path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["type"] == "header":
+                    session["header"] = entry
+                elif entry["type"] == "plan":
+                    session["plan"] = entry
+                    session["trials"] = []
+                elif entry["type"] == "trial":
+                    session["trials"].append(entry)
+        return session
+
+    @staticmethod
+    def find_latest(folder: str):
+        """
+        Return the path of the most recent journal in a participant folder, or None.
+
+        :param folder: Participant results folder.
+        """
+        journals = sorted(filename for filename in os.listdir(folder) if filename.startswith("session_journal"))
+        if not journals:
+            return None
+        return os.path.join(folder, journals[-1])
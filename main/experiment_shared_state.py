@@ -0,0 +1,195 @@
+import threading
+from time import sleep
+
+class SharedState:
+    """
+    Typed state shared between the control loop, the LSL streamer thread and the prediction thread.
+    Hot fields are stored in slots (no string-keyed dict lookups) and grouped into kinematics,
+    event and prediction. Each group is protected by its own sequence counter (seqlock): a writer
+    makes the counter odd while it updates the group, readers retry until they read the whole group
+    with the same even counter value, so they get a consistent snapshot without ever blocking a writer.
+    Writers of a group are serialized by the group's lock (the prediction group is written by the
+    receiving thread of every classifier), reads do not take it.
+    """
+
+    __slots__ = (
+        # Kinematics (written by EXO ingest)
+        "_kinematics_seq",
+        "_kinematics_lock",
+        "current_position",
+        "current_velocity",
+        "current_torque",
+        "exo_execution",
+        "desired_torque",
+        "demanded_torque",
+        "measured_torque",
+        "exo_timestamp",
+        "stream_online",
+        # Event (written by the state machine)
+        "_event_seq",
+        "_event_lock",
+        "event_id",
+        "event_type",
+        "torque_profile",
+        "torque_magnitude",
+        "event_timestamp",
+        # Prediction (written by the prediction thread)
+        "_prediction_seq",
+        "_prediction_lock",
+        "prediction",
+        "prediction_arrival_time",
+        "prediction_timestamp",
+        "prediction_epoch",
+    )
+
+    def __init__(self):
+        """
+        Initialize the SharedState class with the same defaults as initialize_state_dict().
+        """
+        self._kinematics_seq = 0
+        self._kinematics_lock = threading.Lock()
+        self.current_position = 0.0
+        self.current_velocity = 0.0
+        self.current_torque = 0.0
+        self.exo_execution = 0.0
+        self.desired_torque = 0.0
+        self.demanded_torque = 0.0
+        self.measured_torque = 0.0
+        self.exo_timestamp = None
+        self.stream_online = True
+
+        self._event_seq = 0
+        self._event_lock = threading.Lock()
+        self.event_id = 99
+        self.event_type = ""
+        self.torque_profile = "None"
+        self.torque_magnitude = "None"
+        self.event_timestamp = None
+
+        self._prediction_seq = 0
+        self._prediction_lock = threading.Lock()
+        self.prediction = None
+        self.prediction_arrival_time = None
+        self.prediction_timestamp = None
+        self.prediction_epoch = 0
+
+    @staticmethod
+    def _wait_for_writer():
+        """
+        Yield the GIL so that a writer interrupted in the middle of an update can finish it.
+        """
+        sleep(0)
+
+    #### KINEMATICS
+    def write_kinematics(self, sample, timestamp: float = None, stream_online: bool = True):
+        """
+        Publish a new EXO sample.
+
+        :param sample: EXO sample, channels ordered as EXORingBuffer.channels.
+        :param timestamp: LSL timestamp of the sample.
+        :param stream_online: False if the EXO stream was lost.
+        """
+        with self._kinematics_lock:
+            self._kinematics_seq += 1
+            self.current_position = sample[0]
+            self.current_velocity = sample[1]
+            self.current_torque = sample[2]
+            self.exo_execution = sample[3]
+            self.desired_torque = sample[4]
+            self.demanded_torque = sample[5]
+            self.measured_torque = sample[6]
+            self.exo_timestamp = timestamp
+            self.stream_online = stream_online
+            self._kinematics_seq += 1
+
+    def set_stream_online(self, stream_online: bool):
+        """
+        Mark the EXO stream as online or offline without changing the last sample.
+        """
+        with self._kinematics_lock:
+            self._kinematics_seq += 1
+            self.stream_online = stream_online
+            self._kinematics_seq += 1
+
+    def read_kinematics(self):
+        """
+        :return: tuple (position, velocity, current_torque, exo_execution, desired_torque,
+                 demanded_torque, measured_torque, exo_timestamp, stream_online) from a single sample.
+        """
+        while True:
+            seq = self._kinematics_seq
+            if seq & 1:
+                self._wait_for_writer()
+                continue
+            snapshot = (
+                self.current_position,
+                self.current_velocity,
+                self.current_torque,
+                self.exo_execution,
+                self.desired_torque,
+                self.demanded_torque,
+                self.measured_torque,
+                self.exo_timestamp,
+                self.stream_online,
+            )
+            if seq == self._kinematics_seq:
+                return snapshot
+
+    #### EVENT
+    def write_event(self, event_id: int, event_type: str, torque_profile, torque_magnitude, timestamp: float):
+        """
+        Publish the current event of the state machine.
+        """
+        with self._event_lock:
+            self._event_seq += 1
+            self.event_id = event_id
+            self.event_type = event_type
+            self.torque_profile = torque_profile
+            self.torque_magnitude = torque_magnitude
+            self.event_timestamp = timestamp
+            self._event_seq += 1
+
+    def read_event(self):
+        """
+        :return: tuple (event_id, event_type, torque_profile, torque_magnitude, event_timestamp).
+        """
+        while True:
+            seq = self._event_seq
+            if seq & 1:
+                self._wait_for_writer()
+                continue
+            snapshot = (self.event_id, self.event_type, self.torque_profile, self.torque_magnitude, self.event_timestamp)
+            if seq == self._event_seq:
+                return snapshot
+
+    #### PREDICTION
+    def write_prediction(self, prediction: str, arrival_time: float, timestamp: float = None, epoch: int = 0):
+        """
+        Publish a new prediction received from the classifier.
+
+        :param prediction: Predicted event name ("UP" / "DOWN").
+        :param arrival_time: local_clock() time at which the prediction was received.
+        :param timestamp: Timestamp of the prediction sample set by the decoder (in local clock), None if unknown.
+        :param epoch: Prediction window the prediction was received in (see LSLHandler.update_prediction_window()).
+        """
+        with self._prediction_lock:
+            self._prediction_seq += 1
+            self.prediction = prediction
+            self.prediction_arrival_time = arrival_time
+            self.prediction_timestamp = timestamp
+            self.prediction_epoch = epoch
+            self._prediction_seq += 1
+
+    def read_prediction(self):
+        """
+        :return: tuple (prediction, arrival_time, timestamp, epoch, version), where version changes with
+                 every new prediction, so a consumer can tell whether it has already used it.
+        """
+        while True:
+            seq = self._prediction_seq
+            if seq & 1:
+                self._wait_for_writer()
+                continue
+            snapshot = (self.prediction, self.prediction_arrival_time, self.prediction_timestamp, self.prediction_epoch, seq)
+            if seq == self._prediction_seq:
+                return snapshot
@@ -0,0 +1,419 @@
+import os
+import json
+import random
+import logging
+import argparse
+import threading
+from time import perf_counter
+import numpy as np
+import pygame
+
+from experiment_do import initialize_state_dict
+from experiment_interface import Interface
+from experiment_state_machine import StateMachine
+from experiment_logging import Logger
+from experiment_LSL import LSLHandler
+
+class VirtualClock:
+    """
+    Simulated time in seconds, advanced explicitly by the simulation loop.
+    Can be passed anywhere a time() function is expected.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, dt: float):
+        self.now += dt
+        return self.now
+
+class ScriptedInput:
+    """
+    Replacement for pygame.key.get_pressed(), driven by key presses scheduled on the virtual clock.
+    """
+
+    keys = (pygame.K_RETURN, pygame.K_ESCAPE, pygame.K_SPACE)
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.presses = []   # (start, end, key)
+
+    def press(self, key: int, at: float = None, duration: float = 0.05):
+        """
+        Schedule a key press.
+
+        :param key: pygame key code (K_RETURN, K_ESCAPE or K_SPACE).
+        :param at: Time of the press (default: now).
+        :param duration: How long the key is held down.
+        """
+        start = self.clock() if at is None else at
+        self.presses.append((start, start + duration, key))
+
+    def __call__(self):
+        now = self.clock()
+        self.presses = [press for press in self.presses if press[1] > now]
+        pressed = dict.fromkeys(self.keys, False)
+        for start, end, key in self.presses:
+            if start <= now:
+                pressed[key] = True
+        return pressed
+
+class SyntheticEXO:
+    """
+    Model of the EXO arm and of the subject moving it, following the cues of the state machine.
+    Acts as both ends of the EXO connection: it receives the 4-channel instructions
+    [torque_profile, correctness, direction, torque_magnitude] sent by LSLHandler.EXO_stream_out()
+    (push_sample) and is read like the EXO inlet (flush/pull_sample).
+    Positions are in deg, UP is towards the minimum arm position.
+    """
+
+    # Torque profile shapes over the normalized execution time (see t_profile_dict in experiment_LSL.py)
+    profiles = {
+        0: lambda t: np.clip(min(t, 1 - t) / 0.2, 0, 1),                          # trapezoid
+        1: lambda t: 1 - abs(2 * t - 1),                                          # triangular
+        2: lambda t: np.sin(np.pi * t),                                           # sinusoide
+        3: lambda t: 1.0,                                                         # rectangular
+        4: lambda t: np.sin(np.pi / 2 * np.clip(min(t, 1 - t) / 0.2, 0, 1)) ** 2, # smoothed_trapezoid
+    }
+
+    def __init__(self, clock: VirtualClock, exo_parameters: dict, rng: np.random.Generator, subject_speed: float = 60,
+                 reaction_time_range=(0.2, 0.6), error_rate: float = 0.05, hesitation_rate: float = 0.02,
+                 execution_time: float = 1.0, torque_gain: float = 10):
+        """
+        Initialize the SyntheticEXO class.
+
+        :param clock: Simulation clock.
+        :param exo_parameters: "exo_parameters" section of experiment_config.json.
+        :param rng: Random generator for the subject behaviour.
+        :param subject_speed: Speed of voluntary arm movements in deg/s.
+        :param reaction_time_range: Range of the delay between the execute cue and movement onset in s.
+        :param error_rate: Probability that the subject moves in the wrong direction.
+        :param hesitation_rate: Probability that the subject stops between the middle and the band (trial timeout).
+        :param execution_time: Duration of an EXO torque profile in s.
+        :param torque_gain: Arm velocity added per Nm of EXO torque in deg/s.
+        """
+        self.clock = clock
+        self.rng = rng
+        self.maxP = exo_parameters["maximum_arm_position_deg"]
+        self.minP = exo_parameters["minimum_arm_position_deg"]
+        self.middle = (self.maxP - self.minP) / 2 + self.minP
+        self.subject_speed = subject_speed
+        self.reaction_time_range = reaction_time_range
+        self.error_rate = error_rate
+        self.hesitation_rate = hesitation_rate
+        self.execution_time = execution_time
+        self.torque_gain = torque_gain
+
+        self.position = self.middle
+        self.velocity = 0.0
+        self.torque = 0.0
+        self.desired_torque = 0.0
+        self.execution_start = None
+        self.execution = None       # (profile, signed magnitude) of the running torque profile
+        self.cued_trial = None      # trial the subject is currently responding to
+        self.movement_start = None
+        self.movement_target = self.middle
+
+    #### EXO OUTLET SIDE
+    def push_sample(self, instructions):
+        """
+        Receive instructions from LSLHandler.EXO_stream_out().
+        """
+        torque_profile, correctness, direction, torque_magnitude = instructions
+        if direction in (10, 20):
+            # Correct execution pushes towards the instructed direction, incorrect away from it
+            sign = -1 if direction == 10 else 1
+            if correctness == 0:
+                sign = -sign
+            self.execution = (int(torque_profile), sign * float(torque_magnitude))
+            self.execution_start = self.clock()
+        else:
+            # Trial over (0) or experiment over (99)
+            self.execution = None
+
+    #### EXO INLET SIDE
+    def flush(self):
+        pass
+
+    def pull_sample(self, timeout: float = 0.0):
+        """
+        :return: tuple (sample, timestamp), sample ordered as EXORingBuffer.channels.
+        """
+        exo_execution = 0 if self.execution is None else 1
+        sample = [self.position, self.velocity, self.torque, exo_execution, self.desired_torque, self.torque, self.torque]
+        return sample, self.clock()
+
+    #### MODEL
+    def step(self, dt: float, state_dict: dict):
+        """
+        Advance the arm model by dt, with the simulated subject reacting to the current state.
+
+        :param dt: Time step in s.
+        :param state_dict: State dictionary of the state machine (cues seen by the subject).
+        """
+        now = self.clock()
+        current_state = state_dict["current_state"]
+
+        # Subject: respond to a new execute cue after a reaction time, otherwise hold/return to the middle
+        if current_state in ("TRIAL_UP", "TRIAL_DOWN", "MOVING_UP", "MOVING_DOWN"):
+            if self.cued_trial != state_dict["current_trial_No"]:
+                self.cued_trial = state_dict["current_trial_No"]
+                self.movement_start = now + self.rng.uniform(*self.reaction_time_range)
+                up = state_dict["trial"] == "UP"
+                if self.rng.random() < self.error_rate:
+                    up = not up
+                self.movement_target = self.minP if up else self.maxP
+                if self.rng.random() < self.hesitation_rate:
+                    self.movement_target = (self.movement_target + self.middle) / 2
+            target = self.movement_target if now >= self.movement_start else self.position
+        elif current_state in ("IN_UPPER_BAND", "IN_LOWER_BAND", "FAILURE", "TIMEOUT", "PAUSE"):
+            target = self.position
+        else:
+            target = self.middle
+
+        velocity = np.sign(target - self.position) * self.subject_speed
+
+        # EXO: run the current torque profile
+        if self.execution is not None and now - self.execution_start <= self.execution_time:
+            profile, magnitude = self.execution
+            self.desired_torque = magnitude * self.profiles.get(profile, self.profiles[3])((now - self.execution_start) / self.execution_time)
+        else:
+            self.execution = None
+            self.desired_torque = 0.0
+        self.torque = self.desired_torque
+        velocity += self.torque_gain * self.torque
+
+        # Integrate, without overshooting the subject's target when the EXO is passive
+        step = velocity * dt
+        if self.torque == 0 and abs(target - self.position) < abs(step):
+            step = target - self.position
+        self.position = float(np.clip(self.position + step, self.minP, self.maxP))
+        self.velocity = step / dt
+
+class SyntheticDecoder:
+    """
+    Simulated classifier: publishes one prediction per prediction window (like LSLHandler.get_predictions()),
+    correct with the given accuracy and after a random latency.
+    """
+
+    def __init__(self, LSL, clock: VirtualClock, rng: np.random.Generator, accuracy: float = 0.8, latency_range=(0.1, 0.4)):
+        """
+        Initialize the SyntheticDecoder class.
+
+        :param LSL: SimulatedLSL instance.
+        :param clock: Simulation clock.
+        :param rng: Random generator.
+        :param accuracy: Probability of predicting the cued direction.
+        :param latency_range: Range of the delay between the window opening and the prediction in s.
+        """
+        self.LSL = LSL
+        self.clock = clock
+        self.rng = rng
+        self.accuracy = accuracy
+        self.latency_range = latency_range
+        self.window_open = False
+        self.due_time = None
+
+    def step(self, state_dict: dict):
+        if not self.LSL.prediction_window.is_set():
+            self.window_open = False
+            return
+        if not self.window_open:
+            self.window_open = True
+            self.due_time = self.clock() + self.rng.uniform(*self.latency_range)
+        if self.due_time is not None and self.clock() >= self.due_time:
+            self.due_time = None
+            if state_dict["activate_EXO"]:
+                correct = self.rng.random() < self.accuracy
+                prediction = state_dict["trial"] if correct else ("DOWN" if state_dict["trial"] == "UP" else "UP")
+                self.LSL.shared.write_prediction(prediction, self.clock(), self.clock(), self.LSL.prediction_epoch)
+
+class SimulatedLSL(LSLHandler):
+    """
+    LSLHandler without any LSL streams: EXO instructions go to and samples come from a SyntheticEXO,
+    events are recorded in memory with simulation timestamps.
+    """
+
+    def __init__(self, exo: SyntheticEXO, clock: VirtualClock, state_dict: dict):
+        """
+        Initialize the SimulatedLSL class: the LSLHandler without any streams or discovery,
+        with the SyntheticEXO as EXO inlet and instructions outlet.
+
+        :param exo: SyntheticEXO used as the EXO inlet and instructions outlet.
+        :param clock: Simulation clock.
+        :param state_dict: Dictionary containing the current state information.
+        """
+        super().__init__(state_dict, receive=False, send=False, predict=False, chunked_ingest=False)
+        self.clock = clock
+        self.inlet = exo
+        self.outlet_EXO = exo
+        self.events = []    # (timestamp, event_id, event_type)
+
+    def send_setup_data(self, exo_config: dict):
+        pass
+
+    def notify_event(self, state_dict: dict):
+        event_id = state_dict["event_id"]
+        if event_id == self.last_notified_event or event_id == 99:
+            return
+        self.last_notified_event = event_id
+        state_dict["event_timestamp"] = self.clock()
+        self.events.append((state_dict["event_timestamp"], event_id, state_dict["event_type"]))
+
+class BandDetector:
+    """
+    Band detection of the Interface (same mapping and default window geometry) without a display.
+    """
+
+    detect_bands = Interface.detect_bands
+
+    def __init__(self, maxP: float, minP: float, height: int = 820, band_offset: int = 60, pas: int = 60, dot_size: int = 10):
+        self.maxP = maxP
+        self.minP = minP
+        self.height = height
+        self.band_offset = band_offset
+        self.pas = pas
+        self.dot_size = dot_size
+        self.geometry_lock = threading.Lock()
+
+class Simulation:
+    """
+    Headless, deterministic run of a full experiment session: the real StateMachine driven by a
+    virtual clock, scripted key presses, a SyntheticEXO and (with real-time prediction) a SyntheticDecoder.
+    Runs as fast as the CPU allows; results only depend on the configuration and the seed.
+    """
+
+    def __init__(self, experiment_config: dict, seed: int = 0, dt: float = 0.002, data_log: Logger = None, **subject_parameters):
+        """
+        Initialize the Simulation class.
+
+        :param experiment_config: Experiment configuration.
+        :param seed: Seed for the trial plan, wait times and the simulated subject/decoder.
+        :param dt: Simulation step (control period) in s.
+        :param data_log: Optional Logger receiving one datapoint per step.
+        :param subject_parameters: Keyword arguments for SyntheticEXO (subject model), plus decoder_accuracy.
+        """
+        random.seed(seed)
+        np.random.seed(seed)
+        rng = np.random.default_rng(seed)
+        decoder_accuracy = subject_parameters.pop("decoder_accuracy", 0.8)
+
+        self.dt = dt
+        self.data_log = data_log
+        self.clock = VirtualClock()
+        self.keys = ScriptedInput(self.clock)
+        self.state_dict, predict = initialize_state_dict(None, experiment_config)
+        self.state_dict["exo_execution"] = 0
+        self.exo = SyntheticEXO(self.clock, self.state_dict["exo_parameters"], rng, **subject_parameters)
+        self.LSL = SimulatedLSL(self.exo, self.clock, self.state_dict)
+        self.decoder = SyntheticDecoder(self.LSL, self.clock, rng, decoder_accuracy) if predict else None
+        self.bands = BandDetector(self.exo.maxP, self.exo.minP)
+        self.state_machine = StateMachine(self.LSL, clock=self.clock, get_pressed=self.keys)
+
+        self.logger = logging.getLogger("Simulation")
+
+    def step(self):
+        """
+        Advance the simulation by one control period.
+
+        :return: True if the experiment is over.
+        """
+        state_dict = self.state_dict
+        self.clock.advance(self.dt)
+        state_dict["timestamp"] = self.clock()
+
+        self.exo.step(self.dt, state_dict)
+        if self.decoder is not None:
+            self.decoder.step(state_dict)
+        self.LSL.EXO_stream_in(state_dict)
+        self.bands.detect_bands(state_dict)
+        experiment_over, state_dict = self.state_machine.maybe_update_state(state_dict)
+
+        if self.data_log is not None:
+            self.data_log.save_data_dict(state_dict)
+        return experiment_over
+
+    def run(self, max_time: float = 24 * 3600):
+        """
+        Run a whole session: press ENTER to start, run all trials and press ESC on the final screen.
+
+        :param max_time: Simulated time limit in s.
+        :return: Summary dictionary.
+        """
+        wall_start = perf_counter()
+        steps = 0
+        self.keys.press(pygame.K_RETURN, at=0.5)
+        exit_pressed = False
+        experiment_over = False
+        while not experiment_over and self.clock() < max_time:
+            experiment_over = self.step()
+            steps += 1
+            if self.state_dict["current_state"] == "EXIT" and not exit_pressed:
+                self.keys.press(pygame.K_ESCAPE, at=self.clock() + 0.5)
+                exit_pressed = True
+        wall_time = perf_counter() - wall_start
+
+        outcomes = [event_id for _, event_id, _ in self.LSL.events if event_id in (StateMachine.success, StateMachine.failure, StateMachine.timeout)]
+        summary = {
+            "finished": experiment_over,
+            "trials": len(outcomes),
+            "successes": outcomes.count(StateMachine.success),
+            "failures": outcomes.count(StateMachine.failure),
+            "timeouts": outcomes.count(StateMachine.timeout),
+            "events": len(self.LSL.events),
+            "steps": steps,
+            "simulated_time": round(self.clock(), 3),
+            "wall_time": round(wall_time, 3),
+            "speedup": round(self.clock() / wall_time, 1) if wall_time > 0 else None,
+            "avg_time": self.state_dict["avg_time"],
+        }
+        if self.decoder is not None:
+            summary["predictions"] = self.LSL.prediction_summary()
+        return summary
+
+def set_trial_count(experiment_config: dict, trials: int):
+    """
+    Distribute the given total number of trials over the trial conditions (after familiarization
+    and end control trials), keeping the conditions' other parameters.
+    """
+    experiment = experiment_config["experiment"]
+    conditions = experiment["trial_conditions"]
+    main_trials = trials - experiment["number_of_familiarization_trials"] - experiment["number_of_end_control_trials"]
+    for idx, condition_id in enumerate(conditions):
+        conditions[condition_id][1] = main_trials // len(conditions) + (1 if idx < main_trials % len(conditions) else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a headless, deterministic simulation of an experiment session.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "experiment_config.json"), help="Experiment configuration file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--trials", type=int, default=None, help="Total number of trials (overrides the trial condition counts)")
+    parser.add_argument("--dt", type=float, default=0.002, help="Control period in s")
+    parser.add_argument("--error_rate", type=float, default=0.05, help="Probability that the simulated subject moves the wrong way")
+    parser.add_argument("--decoder_accuracy", type=float, default=0.8, help="Accuracy of the synthetic decoder")
+    parser.add_argument("--log", action="store_true", help="Save the simulated data to the results folder")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    experiment_config = json.load(open(args.config, "r"))
+    if args.trials is not None:
+        set_trial_count(experiment_config, args.trials)
+
+    data_log = None
+    if args.log:
+        data_log = Logger(
+            experiment_config["interface_data"]["results_path"],
+            experiment_config["participant"]["name"] + "_simulation",
+            experiment_config["participant"]["id"],
+            no_log=False,
+            save_data=True,
+            log_format=experiment_config["interface_data"].get("log_format", "tsv"),
+        )
+
+    simulation = Simulation(experiment_config, seed=args.seed, dt=args.dt, data_log=data_log, error_rate=args.error_rate, decoder_accuracy=args.decoder_accuracy)
+    summary = simulation.run()
+    if data_log is not None:
+        data_log.close()
+    print(json.dumps(summary, indent=4))
@@ -1,9 +1,16 @@
-from time import time
+from time import time, perf_counter
 import numpy as np
-import random
 import pygame
 import logging
 
+from experiment_schedule import ScheduleGenerator
+
+def _state_flags(states: set, size: int):
+    """
+    Return a tuple of booleans indexed by state ID, True for the given states.
+    """
+    return tuple(state in states for state in range(size))
+
 class StateMachine:
     """ 
     EVENT IDS vs EVENT TYPES:
@@ -62,9 +69,74 @@ class StateMachine:
     TIMEOUT = 15
     PAUSE = 16
     EXIT = 17
-
-    def __init__(self, LSL):
+    NO_STATE = 18       # dispatch slot used while current_state is None (before start / after restart)
+
+    # State names indexed by state ID
+    STATE_NAMES = (
+        "INITIAL_SCREEN", "RETURN_TO_CENTER", "IN_MIDDLE_CIRCLE", "WAITING", "IMAGINATION", "INTENTION",
+        "TRIAL_UP", "MOVING_UP", "IN_UPPER_BAND", "GO_OUT_OF_UPPER_BAND",
+        "TRIAL_DOWN", "MOVING_DOWN", "IN_LOWER_BAND", "GO_OUT_OF_LOWER_BAND",
+        "FAILURE", "TIMEOUT", "PAUSE", "EXIT", "None",
+    )
+
+    # Per-state flags indexed by state ID
+    IN_TRIAL = _state_flags({WAITING, IMAGINATION, INTENTION, TRIAL_UP, TRIAL_DOWN, MOVING_UP, MOVING_DOWN}, NO_STATE + 1)
+    IS_MOVING = _state_flags({MOVING_UP, MOVING_DOWN}, NO_STATE + 1)
+    IN_BAND = _state_flags({IN_UPPER_BAND, IN_LOWER_BAND}, NO_STATE + 1)
+
+    # Transition table: state -> [(guard, action, target), ...]
+    # Guards are checked in order and only the first passing transition runs (guard None = always).
+    # Guard and action are method names; target is the next state, or a tuple of the possible
+    # next states when the action itself chooses between them.
+    # Pause, exit, forced termination, stream loss and trial timeout apply to every state and
+    # are handled after the table in maybe_update_state() (listed in GLOBAL_TRANSITIONS for export).
+    TRANSITIONS = {
+        NO_STATE:           [(None, "set_initial_screen", INITIAL_SCREEN)],
+        INITIAL_SCREEN:     [("when_enter_pressed", "start_experiment", RETURN_TO_CENTER)],
+        RETURN_TO_CENTER:   [("when_in_the_middle", "set_in_middle_circle", IN_MIDDLE_CIRCLE)],
+        IN_MIDDLE_CIRCLE:   [("when_left_the_middle", "set_return_to_center", RETURN_TO_CENTER),
+                             ("when_wait_over", "start_next_trial", (WAITING, IMAGINATION, INTENTION, TRIAL_UP, TRIAL_DOWN))],
+        WAITING:            [("when_wait_over", "start_cue", (IMAGINATION, INTENTION, TRIAL_UP, TRIAL_DOWN))],
+        IMAGINATION:        [("when_wait_over", "end_imagination", (INTENTION, TRIAL_UP, TRIAL_DOWN))],
+        INTENTION:          [("when_wait_over", "set_go_to_band", (TRIAL_UP, TRIAL_DOWN))],
+        TRIAL_UP:           [("when_left_the_middle", "start_movement", MOVING_UP)],
+        MOVING_UP:          [("when_is_UP", "succeed_in_upper_band", IN_UPPER_BAND),
+                             ("when_is_DOWN", "set_failure", FAILURE)],
+        IN_UPPER_BAND:      [("when_wait_over", "end_successful_trial", (RETURN_TO_CENTER, EXIT))],
+        TRIAL_DOWN:         [("when_left_the_middle", "start_movement", MOVING_DOWN)],
+        MOVING_DOWN:        [("when_is_DOWN", "succeed_in_lower_band", IN_LOWER_BAND),
+                             ("when_is_UP", "set_failure", FAILURE)],
+        IN_LOWER_BAND:      [("when_wait_over", "end_successful_trial", (RETURN_TO_CENTER, EXIT))],
+        FAILURE:            [("when_wait_over", "end_failed_trial", (RETURN_TO_CENTER, EXIT))],
+        TIMEOUT:            [("when_wait_over", "end_failed_trial", (RETURN_TO_CENTER, EXIT))],
+    }
+
+    # Transitions handled outside the table (source None = any state), for graph export only
+    GLOBAL_TRANSITIONS = [
+        (MOVING_UP, "remaining_time <= 0", TIMEOUT),
+        (MOVING_DOWN, "remaining_time <= 0", TIMEOUT),
+        (None, "space_pressed", PAUSE),
+        (PAUSE, "space released", None),
+        (None, "escape_pressed", EXIT),
+        (None, "stream offline", EXIT),
+        (EXIT, "enter_pressed", NO_STATE),
+    ]
+
+    def __init__(self, LSL, journal=None, clock=time, get_pressed=None, draw_wait_time=None):
+        """
+        :param LSL: LSLHandler instance (or a simulated one).
+        :param journal: SessionJournal for checkpointing the trial plan and outcomes.
+        :param clock: Function returning the current time in seconds (time.time, or a virtual clock in simulation).
+        :param get_pressed: Function returning the pressed keys, indexable by pygame key codes (default pygame.key.get_pressed).
+        :param draw_wait_time: Function returning a state wait time for a [min, max] range (default uniform random).
+        """
         self.current_state = None
+        self.clock = clock
+        self.get_pressed = pygame.key.get_pressed if get_pressed is None else get_pressed
+        self.draw_wait_time = (lambda time_range: np.random.uniform(*time_range)) if draw_wait_time is None else draw_wait_time
+        self.journal = journal          # SessionJournal for checkpointing the trial plan and outcomes
+        self.schedule_seed = None       # seed of the current trial plan
+        self.resume_session = None      # loaded journal to continue from on the next experiment start
         self.torque = None
         self.torque_profile = None
         self.correctness = None
@@ -73,9 +145,7 @@ class StateMachine:
         self.times = []
         self.send_once = True      
         self.stream_break = False  
-        # Construct reverse state lookup
-        all_variables = vars(StateMachine)
-        self.reverse_state_lookup = {all_variables[name]: name for name in all_variables if isinstance(all_variables[name], int) and name.isupper()}
+        self.compile_transitions()
         self.profiles_dict = {"trapezoid" : 0, "triangular" : 1, "sinusoidal" : 2, "rectangular" : 3, "smooth_trapezoid" : 4}
 
         logging.basicConfig(level=logging.INFO)
@@ -90,6 +160,8 @@ class StateMachine:
             state_dict (dict): A dictionary containing the current state information and various flags.
         Returns:
             tuple: A tuple containing a boolean indicating if the experiment is over and the updated state dictionary.
+        State-specific transitions are looked up in the compiled TRANSITIONS table (one dispatch per update),
+        global transitions (pause, exit, stream loss, timeout) are checked afterwards.
         The state machine transitions through the following states:
             - INITIAL_SCREEN: Initial screen state.
             - RETURN_TO_CENTER: Waiting for the initial position.
@@ -116,6 +188,7 @@ class StateMachine:
             - Timeout handling.
         """
 
+        update_start = perf_counter()
         experiment_over = False  
 
         # --- Handle keyboard input for state transitions ---
@@ -123,182 +196,23 @@ class StateMachine:
         self.one_time_ESCAPE(state_dict)  # One time ESC trigger
         self.latch_SPACE(state_dict)  # SPACE latch
 
-        #### WHEN NONE
-        # If no state is set, initialize to the initial screen
-        if self.current_state is None:  
-            self.current_state = StateMachine.INITIAL_SCREEN
-            self.set_initial_screen(state_dict)
-
-        #### AT THE BEGINNING
-        # Transition from initial screen to experiment start when ENTER is pressed
-        elif self.current_state == StateMachine.INITIAL_SCREEN:
-            if state_dict["enter_pressed"]:
-                self.current_state = StateMachine.RETURN_TO_CENTER
-                self.set_start_experiment(state_dict)
-                self.set_return_to_center(state_dict)
-
-        #### WHEN WAITING FOR INITIAL POSITION
-        # Wait for subject to move to the middle position before starting trials
-        elif self.current_state == StateMachine.RETURN_TO_CENTER:
-            if state_dict["in_the_middle"]:
-                self.current_state = StateMachine.IN_MIDDLE_CIRCLE
-                self.set_in_middle_circle(state_dict)
-
-        #### WHEN WAITING IN THE MIDDLE FOR TRIAL TO START
-        # Wait for random time, then start a new trial if ready
-        elif self.current_state == StateMachine.IN_MIDDLE_CIRCLE:
-            if state_dict["in_the_middle"] == False:
-                self.current_state = StateMachine.RETURN_TO_CENTER
-                self.set_return_to_center(state_dict)
-            elif time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                self.send_once = True
-                if self.i < len(self.events):
-                    # Set up next trial parameters
-                    self.correctness = self.correctness_list[self.i]
-                    self.torque_profile = self.torque_profile_list[self.i]
-                    self.torque = self.torque_magnitude_list[self.i]
-                    if self.events[self.i] == 1:
-                        self.i += 1
-                        state_dict["trial"] = "UP"
-                        state_dict["current_trial_No"] = self.i
-                    else:
-                        self.i += 1
-                        state_dict["trial"] = "DOWN"
-                        state_dict["current_trial_No"] = self.i
-                    # Determine which state to enter next based on trial_states
-                    if "wait" in state_dict["trial_states"]:
-                        self.current_state = StateMachine.WAITING
-                        self.set_waiting(state_dict)
-                    else:
-                        if "imagine" in state_dict["trial_states"]:
-                            self.set_imagine(state_dict)
-                        else:
-                            if "intend" in state_dict["trial_states"]:
-                                self.set_intend(state_dict)
-                            else:
-                                self.set_go_to_band(state_dict)
-
-        #### WHEN WAITING FOR START
-        # Wait for a random time, then move to imagination/intention/execution
-        elif self.current_state == StateMachine.WAITING:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                if "imagine" in state_dict["trial_states"]:
-                    self.set_imagine(state_dict)
-                else:
-                    if "intend" in state_dict["trial_states"]:
-                        self.set_intend(state_dict)
-                    else:
-                        self.set_go_to_band(state_dict)
-
-        #### WHEN IMAGINING MOVEMENT
-        # After imagination, move to intention or execution
-        elif self.current_state == StateMachine.IMAGINATION:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                if "intend" in state_dict["trial_states"]:
-                    self.set_intend(state_dict)
-                else:
-                    self.set_go_to_band(state_dict)
-
-        #### WHEN INTENDING MOVEMENT
-        # After intention, move to execution
-        elif self.current_state == StateMachine.INTENTION:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                self.set_go_to_band(state_dict)
-
-        #### WHEN "UP" TRIAL IS HAPPENING
-        # Handle execution of "UP" trial, check for success/failure
-        elif self.current_state == StateMachine.TRIAL_UP:
-            if state_dict["in_the_middle"] == False:
-                self.set_trial_start(state_dict)
-                self.current_state = StateMachine.MOVING_UP
-                if state_dict["activate_EXO"]:
-                    if not state_dict["real_time_prediction"]:
-                        if self.send_once:
-                            self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque, self.correctness)
-                            self.send_once = False
-                    else: 
-                        if state_dict["prediction"] is not None:
-                            self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque)
-                            state_dict["prediction"] = None
-
-        elif self.current_state == StateMachine.MOVING_UP:
-            if state_dict["is_UP"]:
-                self.current_state = StateMachine.IN_UPPER_BAND
-                self.set_in_upper_band(state_dict)
-                self.set_success(state_dict)
-                self.times.append(state_dict["TO"] - state_dict["remaining_time"])
-            elif state_dict["is_DOWN"]:
-                self.current_state = StateMachine.FAILURE
-                self.set_failure(state_dict)  
-
-        #### IF "UP" TRIAL IS SUCCESSFUL
-        # After success, return to center or finish experiment
-        elif self.current_state == StateMachine.IN_UPPER_BAND:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                self.current_state = StateMachine.RETURN_TO_CENTER
-                self.set_return_to_center(state_dict)
-                if self.i == len(self.events):
-                    self.current_state = StateMachine.EXIT
-                    self.set_exit_or_error(state_dict)
-                    state_dict["avg_time"] = round(sum(self.times) / len(self.times), 2)
-                    state_dict["succ_trials"] = len(self.times)
-
-        #### WHEN "DOWN" TRIAL IS HAPPENING
-        # Handle execution of "DOWN" trial, check for success/failure
-        elif self.current_state == StateMachine.TRIAL_DOWN:
-            if state_dict["in_the_middle"] == False:
-                self.set_trial_start(state_dict)
-                self.current_state = StateMachine.MOVING_DOWN
-                if state_dict["activate_EXO"]:
-                    if not state_dict["real_time_prediction"]:
-                        if self.send_once:
-                            self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque, self.correctness)
-                            self.send_once = False
-                    else: 
-                        if state_dict["prediction"] is not None:
-                            self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque)
-                            state_dict["prediction"] = None
-            
-        elif self.current_state == StateMachine.MOVING_DOWN:    
-            if state_dict["is_DOWN"]:
-                self.current_state = StateMachine.IN_LOWER_BAND
-                self.set_in_lower_band(state_dict)
-                self.set_success(state_dict)
-                self.times.append(state_dict["TO"] - state_dict["remaining_time"])
-            elif state_dict["is_UP"]:
-                self.current_state = StateMachine.FAILURE
-                self.set_failure(state_dict)                              
-        
-        #### IF "DOWN" TRIAL IS SUCCESSFUL
-        # After success, return to center or finish experiment
-        elif self.current_state == StateMachine.IN_LOWER_BAND:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                self.current_state = StateMachine.RETURN_TO_CENTER
-                self.set_return_to_center(state_dict)  
-                if self.i == len(self.events):
-                    self.current_state = StateMachine.EXIT
-                    self.set_exit_or_error(state_dict)              
-                    state_dict["avg_time"] = round(sum(self.times) / len(self.times), 2)
-                    state_dict["succ_trials"] = len(self.times)
-
-        #### WHEN TIMEOUT OR FAILURE OCCUR
-        # Handle timeout or failure, return to center or finish experiment
-        elif self.current_state in {StateMachine.TIMEOUT, StateMachine.FAILURE}:
-            if time() - state_dict["state_start_time"] >= state_dict["state_wait_time"]:
-                if self.i == len(self.events):
-                    self.current_state = StateMachine.EXIT
-                    self.set_exit_or_error(state_dict)
-                    if self.times == []:
-                        state_dict["avg_time"] = 0
-                else:
-                    self.current_state = StateMachine.RETURN_TO_CENTER
-                    self.set_return_to_center(state_dict)
+        # Run the first transition of the current state whose guard passes (see TRANSITIONS)
+        state = self.current_state
+        for idx, guard, action, target in self.dispatch[StateMachine.NO_STATE if state is None else state]:
+            if guard is None or guard(state_dict):
+                transition_start = perf_counter()
+                action(state_dict)
+                if target is not None:
+                    self.current_state = target
+                self.transition_time[idx] += perf_counter() - transition_start
+                self.transition_hits[idx] += 1
+                break
 
         #### PAUSE
         # Handle pause logic (SPACE key)
         if state_dict["space_pressed"] and not self.current_state == StateMachine.EXIT:
             if self.current_state != StateMachine.PAUSE:
-                if state_dict["trial_in_progress"] and self.current_state in {StateMachine.MOVING_UP, StateMachine.MOVING_DOWN}:
+                if state_dict["trial_in_progress"] and StateMachine.IS_MOVING[self.current_state]:
                     state_dict["timeout"] = state_dict["remaining_time"]
                 self.previous_trial = state_dict["trial"]
                 self.previous_event_id = state_dict["event_id"]
@@ -317,8 +231,8 @@ class StateMachine:
                     self.set_return_to_center(state_dict)
                 else:    
                     self.current_state = self.previous_state
-                state_dict["trial_time"] = time()
-                state_dict["state_start_time"] = time()
+                state_dict["trial_time"] = self.clock()
+                state_dict["state_start_time"] = self.clock()
                 state_dict["trial"] = self.previous_trial
                 state_dict["event_id"] = self.previous_event_id
                 state_dict["event_type"] = self.previous_event_type
@@ -356,9 +270,10 @@ class StateMachine:
 
         #### WHILE TRIAL IS IN PROGRESS
         # Update trial timing and check for timeout
-        if self.current_state in {StateMachine.WAITING, StateMachine.IMAGINATION, StateMachine.INTENTION, StateMachine.TRIAL_UP, StateMachine.TRIAL_DOWN, StateMachine.MOVING_UP, StateMachine.MOVING_DOWN}:
+        state = StateMachine.NO_STATE if self.current_state is None else self.current_state
+        if StateMachine.IN_TRIAL[state]:
             state_dict["trial_in_progress"] = True
-            if self.current_state in {StateMachine.MOVING_DOWN, StateMachine.MOVING_UP}:
+            if StateMachine.IS_MOVING[state]:
                 if state_dict["exo_execution"] == 1:
                     if not state_dict["real_time_prediction"]:
                         if self.correctness == 1:
@@ -368,25 +283,22 @@ class StateMachine:
                             state_dict["event_id"] = StateMachine.exo_execution_incorrect
                             state_dict["event_type"] = "exo_execution_incorrect"
 
-                state_dict["remaining_time"] = round(state_dict["timeout"] - (time() - state_dict["trial_time"]), 1)
+                state_dict["remaining_time"] = round(state_dict["timeout"] - (self.clock() - state_dict["trial_time"]), 1)
 
                 if state_dict["remaining_time"] <= 0:
                     self.current_state = StateMachine.TIMEOUT
                     self.set_trial_timeout(state_dict)
         else:
             # Reset trial-related fields when not in a trial
-            if self.current_state not in {StateMachine.IN_UPPER_BAND, StateMachine.IN_LOWER_BAND}:
+            if not StateMachine.IN_BAND[state]:
                 state_dict["trial"] = ""
             state_dict["trial_in_progress"] = False
             state_dict["remaining_time"] = ""
             state_dict["torque_profile"] = "None"
             state_dict["torque_magnitude"] = "None"
 
-        # Set current state name for display/logging
-        if self.current_state is not None:
-            state_dict["current_state"] = self.reverse_state_lookup[self.current_state]             
-        else:
-            state_dict["current_state"] = "None"
+        # Set current state name for display/logging (a timeout above may have changed the state)
+        state_dict["current_state"] = StateMachine.STATE_NAMES[StateMachine.NO_STATE if self.current_state is None else self.current_state]
 
         # Enable exoskeleton only for main trials (not familiarization or end control)
         if state_dict["familiarization_trial_No"] < self.i <= state_dict["trials_No"] - state_dict["end_control_trials"]:
@@ -399,8 +311,199 @@ class StateMachine:
             state_dict["event_id"] = StateMachine.no_event
             state_dict["event_type"] = ""
 
+        # Hand new events to the LSL streamer thread and wake up the prediction thread
+        self.LSL.notify_event(state_dict)
+        self.LSL.update_prediction_window(state_dict["current_state"])
+
+        self.update_count += 1
+        self.update_time += perf_counter() - update_start
         return experiment_over, state_dict
 
+    #### TRANSITION TABLE
+    def compile_transitions(self):
+        """
+        Compile TRANSITIONS into a dispatch list indexed by state ID, holding bound guard and action
+        methods, and reset the per-transition hit counters and timing.
+        """
+        self.transition_list = []
+        self.dispatch = [()] * (StateMachine.NO_STATE + 1)
+        for state, transitions in StateMachine.TRANSITIONS.items():
+            compiled = []
+            for guard, action, target in transitions:
+                compiled.append((
+                    len(self.transition_list),
+                    None if guard is None else getattr(self, guard),
+                    getattr(self, action),
+                    target if isinstance(target, int) else None,
+                ))
+                self.transition_list.append((state, guard, action, target))
+            self.dispatch[state] = tuple(compiled)
+        self.transition_hits = [0] * len(self.transition_list)
+        self.transition_time = [0.0] * len(self.transition_list)
+        self.update_count = 0
+        self.update_time = 0.0
+
+    def transition_stats(self):
+        """
+        :return: List of dicts (source, guard, action, hits, total_time) for every table transition.
+        """
+        return [
+            {"source": StateMachine.STATE_NAMES[state], "guard": guard, "action": action, "hits": hits, "total_time": total_time}
+            for (state, guard, action, _), hits, total_time in zip(self.transition_list, self.transition_hits, self.transition_time)
+        ]
+
+    def log_transition_stats(self):
+        """
+        Log how often every transition fired and how long its action took.
+        """
+        if self.update_count:
+            self.logger.info(f"{self.update_count} state updates, mean {1e6 * self.update_time / self.update_count:.1f} us per update.")
+        for stats in self.transition_stats():
+            if stats["hits"]:
+                self.logger.info(
+                    f"{stats['source']} -> {stats['action']}: {stats['hits']} hits, "
+                    f"mean {1e6 * stats['total_time'] / stats['hits']:.1f} us."
+                )
+
+    @staticmethod
+    def transition_edges():
+        """
+        Return the state graph as a sorted list of (source, target, condition) edges between state names,
+        including the transitions handled outside the table ("*" = any state).
+        """
+        names = StateMachine.STATE_NAMES
+        edges = set()
+        for state, transitions in StateMachine.TRANSITIONS.items():
+            for guard, action, target in transitions:
+                condition = "always" if guard is None else guard[len("when_"):]
+                for next_state in (target if isinstance(target, tuple) else (target,)):
+                    edges.add((names[state], names[next_state], condition))
+        for state, condition, target in StateMachine.GLOBAL_TRANSITIONS:
+            edges.add(("*" if state is None else names[state], "<previous>" if target is None else names[target], condition))
+        return sorted(edges)
+
+    @staticmethod
+    def export_transition_graph(path: str):
+        """
+        Write the state graph to a Graphviz DOT file.
+
+        :param path: Path to the .dot file.
+        """
+        with open(path, "w") as dot_file:
+            dot_file.write("digraph StateMachine {\n")
+            for source, target, condition in StateMachine.transition_edges():
+                dot_file.write(f'    "{source}" -> "{target}" [label="{condition}"];\n')
+            dot_file.write("}\n")
+
+    #### GUARDS
+    def when_enter_pressed(self, state_dict):
+        return state_dict["enter_pressed"]
+
+    def when_in_the_middle(self, state_dict):
+        return state_dict["in_the_middle"]
+
+    def when_left_the_middle(self, state_dict):
+        return state_dict["in_the_middle"] == False
+
+    def when_wait_over(self, state_dict):
+        return self.clock() - state_dict["state_start_time"] >= state_dict["state_wait_time"]
+
+    def when_is_UP(self, state_dict):
+        return state_dict["is_UP"]
+
+    def when_is_DOWN(self, state_dict):
+        return state_dict["is_DOWN"]
+
+    #### TRANSITION ACTIONS
+    def start_experiment(self, state_dict):
+        self.set_start_experiment(state_dict)
+        self.set_return_to_center(state_dict)
+
+    def start_next_trial(self, state_dict):
+        """
+        Set up the next trial parameters and enter the first trial state enabled in trial_states.
+        """
+        self.send_once = True
+        if self.i < len(self.events):
+            self.correctness = self.correctness_list[self.i]
+            self.torque_profile = self.torque_profile_list[self.i]
+            self.torque = self.torque_magnitude_list[self.i]
+            if self.events[self.i] == 1:
+                state_dict["trial"] = "UP"
+            else:
+                state_dict["trial"] = "DOWN"
+            self.i += 1
+            state_dict["current_trial_No"] = self.i
+            # Determine which state to enter next based on trial_states
+            if "wait" in state_dict["trial_states"]:
+                self.current_state = StateMachine.WAITING
+                self.set_waiting(state_dict)
+            else:
+                self.start_cue(state_dict)
+
+    def start_cue(self, state_dict):
+        if "imagine" in state_dict["trial_states"]:
+            self.set_imagine(state_dict)
+        else:
+            self.end_imagination(state_dict)
+
+    def end_imagination(self, state_dict):
+        if "intend" in state_dict["trial_states"]:
+            self.set_intend(state_dict)
+        else:
+            self.set_go_to_band(state_dict)
+
+    def start_movement(self, state_dict):
+        """
+        Start the trial timer and, for main trials, send the instructions to the EXO
+        (once per trial, or when a prediction is available with real-time decoding).
+        """
+        self.set_trial_start(state_dict)
+        if state_dict["activate_EXO"]:
+            if not state_dict["real_time_prediction"]:
+                if self.send_once:
+                    self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque, self.correctness)
+                    self.send_once = False
+            else: 
+                self.LSL.take_prediction(state_dict)
+                if state_dict["prediction"] is not None:
+                    self.LSL.EXO_stream_out(state_dict, self.torque_profile, self.torque)
+                    self.LSL.record_prediction_consumed(state_dict)
+                    state_dict["prediction"] = None
+
+    def succeed_in_upper_band(self, state_dict):
+        self.set_in_upper_band(state_dict)
+        self.set_success(state_dict)
+
+    def succeed_in_lower_band(self, state_dict):
+        self.set_in_lower_band(state_dict)
+        self.set_success(state_dict)
+
+    def end_successful_trial(self, state_dict):
+        """
+        Return to center, or finish the experiment after the last trial.
+        """
+        self.current_state = StateMachine.RETURN_TO_CENTER
+        self.set_return_to_center(state_dict)
+        if self.i == len(self.events):
+            self.current_state = StateMachine.EXIT
+            self.set_exit_or_error(state_dict)
+            state_dict["avg_time"] = round(sum(self.times) / len(self.times), 2)
+            state_dict["succ_trials"] = len(self.times)
+
+    def end_failed_trial(self, state_dict):
+        """
+        Return to center after a failure or timeout, or finish the experiment after the last trial.
+        """
+        if self.i == len(self.events):
+            self.current_state = StateMachine.EXIT
+            self.set_exit_or_error(state_dict)
+            if self.times == []:
+                state_dict["avg_time"] = 0
+        else:
+            self.current_state = StateMachine.RETURN_TO_CENTER
+            self.set_return_to_center(state_dict)
+
     #### STATE SETTERS
     def set_initial_screen(self, state_dict): 
         state_dict["state_start_time"] = None
@@ -408,8 +511,13 @@ class StateMachine:
         state_dict["current_trial_No"] = 0
 
     def set_start_experiment(self, state_dict):
-        self.generate_trials(state_dict)
-        state_dict["experiment_start"] = time()
+        if self.resume_session is not None and self.resume_session["plan"] is not None:
+            self.restore_session(state_dict)
+        else:
+            self.generate_trials(state_dict)
+            if self.journal is not None:
+                self.journal.write_plan(self.events, self.correctness_list, self.torque_profile_list, self.torque_magnitude_list, state_dict["familiarization_trial_No"], state_dict["trials_No"], self.schedule_seed)
+        state_dict["experiment_start"] = self.clock()
         state_dict["main_text"] = ""
         state_dict["background_color"] = "black"
 
@@ -419,13 +527,13 @@ class StateMachine:
         state_dict["timeout"] = state_dict["TO"]
 
     def set_in_middle_circle(self, state_dict):
-        state_dict["state_start_time"] = time()
-        state_dict["state_wait_time"] = np.random.uniform(*state_dict["start_time_range"])  # s
+        state_dict["state_start_time"] = self.clock()
+        state_dict["state_wait_time"] = self.draw_wait_time(state_dict["start_time_range"])  # s
         state_dict["main_text"] = ""
     
     def set_waiting(self, state_dict):
-        state_dict["state_start_time"] = time()
-        state_dict["state_wait_time"] = np.random.uniform(*state_dict["state_wait_time_range"])  # s
+        state_dict["state_start_time"] = self.clock()
+        state_dict["state_wait_time"] = self.draw_wait_time(state_dict["state_wait_time_range"])  # s
         state_dict["color"] = "white"
 
     def set_imagine(self, state_dict):
@@ -437,8 +545,8 @@ class StateMachine:
             state_dict["event_type"] = "imagine_DOWN"
             state_dict["event_id"] = StateMachine.imagine_DOWN
 
-        state_dict["state_start_time"] = time()
-        state_dict["state_wait_time"] = np.random.uniform(*state_dict["imagination_time_range"])  # s
+        state_dict["state_start_time"] = self.clock()
+        state_dict["state_wait_time"] = self.draw_wait_time(state_dict["imagination_time_range"])  # s
         state_dict["color"] = "red"
 
     def set_intend(self, state_dict):
@@ -450,17 +558,17 @@ class StateMachine:
             state_dict["event_type"] = "intend_DOWN"
             state_dict["event_id"] = StateMachine.intend_DOWN
 
-        state_dict["state_start_time"] = time()
-        state_dict["state_wait_time"] = np.random.uniform(*state_dict["intention_time_range"])  # s
+        state_dict["state_start_time"] = self.clock()
+        state_dict["state_wait_time"] = self.draw_wait_time(state_dict["intention_time_range"])  # s
         state_dict["color"] = "yellow"
 
     def set_in_upper_band(self, state_dict):
-        state_dict["state_start_time"] = time()
+        state_dict["state_start_time"] = self.clock()
         state_dict["state_wait_time"] = 1
         state_dict["main_text"] = "SUCCESS"
 
     def set_in_lower_band(self, state_dict):
-        state_dict["state_start_time"] = time()
+        state_dict["state_start_time"] = self.clock()
         state_dict["state_wait_time"] = 1
         state_dict["main_text"] = "SUCCESS"
 
@@ -484,29 +592,33 @@ class StateMachine:
             self.current_state = StateMachine.TRIAL_DOWN
             state_dict["event_type"] = "moving_DOWN"
             state_dict["event_id"] = StateMachine.moving_DOWN
-        state_dict["trial_time"] = time()
+        state_dict["trial_time"] = self.clock()
         
     def set_success(self, state_dict):
         state_dict["event_type"] = "SUCCESS"
         state_dict["event_id"] = StateMachine.success    
         self.LSL.EXO_stream_out(state_dict, trial_over = True)
+        self.times.append(state_dict["TO"] - state_dict["remaining_time"])
+        self.checkpoint_trial(state_dict, "SUCCESS", self.times[-1])
 
     def set_failure(self, state_dict):
-        state_dict["state_start_time"] = time()
+        state_dict["state_start_time"] = self.clock()
         state_dict["state_wait_time"] = 1.5
         state_dict["main_text"] = state_dict["event_type"] = "FAIL"
         state_dict["event_id"] = StateMachine.failure  
         self.LSL.EXO_stream_out(state_dict, trial_over = True)
+        self.checkpoint_trial(state_dict, "FAIL")
 
     def set_trial_timeout(self, state_dict):
-        state_dict["state_start_time"] = time()
+        state_dict["state_start_time"] = self.clock()
         state_dict["state_wait_time"] = 1.5
         state_dict["main_text"] = state_dict["event_type"] = "TIMEOUT"
         state_dict["event_id"] = StateMachine.timeout 
         self.LSL.EXO_stream_out(state_dict, trial_over = True)
+        self.checkpoint_trial(state_dict, "TIMEOUT")
 
     def set_trial_termination(self, state_dict):        
-        state_dict["state_start_time"] = time()
+        state_dict["state_start_time"] = self.clock()
         state_dict["state_wait_time"] = 0.5
 
     def set_exit_or_error(self, state_dict, background_color="green4", main_text="EXPERIMENT FINISHED", sub_text="Press ESC to exit or ENTER to restart."):
@@ -514,56 +626,63 @@ class StateMachine:
         state_dict["main_text"] = main_text 
         state_dict["sub_text"] = sub_text
 
+    #### SESSION CHECKPOINTS
+    def checkpoint_trial(self, state_dict, outcome, completion_time=None):
+        """
+        Record the outcome of the current trial in the session journal (if any).
+        """
+        if self.journal is not None:
+            self.journal.write_trial(state_dict["current_trial_No"], outcome, completion_time)
+
+    def restore_session(self, state_dict):
+        """
+        Restore the trial plan and progress from self.resume_session (as returned by SessionJournal.load),
+        so the experiment continues with the next unfinished trial.
+        """
+        plan = self.resume_session["plan"]
+        self.events = np.array(plan["events"])
+        self.correctness_list = np.array(plan["correctness"])
+        self.torque_profile_list = np.array(plan["torque_profiles"])
+        self.torque_magnitude_list = np.array(plan["torque_magnitudes"])
+        state_dict["familiarization_trial_No"] = plan["familiarization_trial_No"]
+        state_dict["trials_No"] = plan["trials_No"]
+        self.schedule_seed = plan.get("schedule_seed")
+
+        completed_trials = self.resume_session["trials"]
+        self.i = max((trial["trial_No"] for trial in completed_trials), default=0)
+        self.times = [trial["completion_time"] for trial in completed_trials if trial["outcome"] == "SUCCESS"]
+        state_dict["current_trial_No"] = self.i
+        self.logger.info(f"Resuming session at trial {self.i + 1}/{len(self.events)}.")
+        self.resume_session = None      # a restart after this session generates a new plan
+
     #### KEYBOARD HANDLERS
-    @staticmethod
-    def one_time_ENTER(state_dict):
-        current_enter_state = pygame.key.get_pressed()[pygame.K_RETURN]
+    def one_time_ENTER(self, state_dict):
+        current_enter_state = self.get_pressed()[pygame.K_RETURN]
         if current_enter_state and not state_dict["previous_enter_state"]:
             state_dict["enter_pressed"] = True
         else:
             state_dict["enter_pressed"] = False
         state_dict["previous_enter_state"] = current_enter_state
 
-    @staticmethod
-    def one_time_ESCAPE(state_dict):
-        current_escape_state = pygame.key.get_pressed()[pygame.K_ESCAPE]
+    def one_time_ESCAPE(self, state_dict):
+        current_escape_state = self.get_pressed()[pygame.K_ESCAPE]
         if current_escape_state and not state_dict["previous_escape_state"]:
             state_dict["escape_pressed"] = True
         else:
             state_dict["escape_pressed"] = False
         state_dict["previous_escape_state"] = current_escape_state
 
-    @staticmethod
-    def latch_SPACE(state_dict):
-        current_space_state = pygame.key.get_pressed()[pygame.K_SPACE]
+    def latch_SPACE(self, state_dict):
+        current_space_state = self.get_pressed()[pygame.K_SPACE]
         if current_space_state and not state_dict["previous_space_state"]:
             state_dict["space_pressed"] = not state_dict.get("space_pressed", False)
         state_dict["previous_space_state"] = current_space_state
 
     #### TRIAL GENERATION
-    @staticmethod
-    def generate_familiarization_trials(n):
-        """
-        Generate familiarization trials with only incorrect executions (0).
-        The familiarization trials are used to let the subject get used to the task.
-        The events are split evenly between "UP" (1) and "DOWN" (0) trials.
-        If n is odd, the extra trial is assigned as "UP".
-        Returns:
-            np.ndarray: Array of shape (n, 4) with columns [event, execution, torque_profile, torque].
-        """
-        ones = np.ones(n // 2, dtype=int)
-        zeros = np.zeros(n // 2, dtype=int)
-        if n % 2 != 0:
-            ones = np.append(ones, 1)  # Ensure UP gets the extra trial
-        events = np.append(ones, zeros)
-        executions = torque_profiles = torques = 99 * np.ones(n, dtype=int) # Placeholder, not used in familiarization
-        trials = np.column_stack((events, executions, torque_profiles, torques))
-        np.random.shuffle(trials)
-        return trials
-
     def generate_trials(self, state_dict: dict) -> np.ndarray:
         """
-        Generates all experiment trials, including familiarization, main, and end control trials.
+        Generates all experiment trials, including familiarization, main, and end control trials, with the
+        ScheduleGenerator (seeded, see experiment_schedule.py).
         Populates self.events, self.correctness_list, self.torque_profile_list, and self.torque_magnitude_list.
         Updates state_dict with total trial count and familiarization trial count.
 
@@ -573,103 +692,41 @@ class StateMachine:
                 - familiarization_trials_No: number of familiarization trials
                 - end_control_trials: number of end control trials
                 - exo_parameters: dict with torque_limit
-                - randomize_trials: bool, whether to shuffle main trials
+                - randomize_trials: bool, whether to shuffle main trials across conditions
+                - schedule_seed: seed of the schedule (None = draw a new one)
+                - schedule constraints: max_same_direction_run, schedule_block_size, schedule_candidates,
+                  counterbalance_conditions, participant_id
 
         Returns:
-            np.ndarray: Array of all trials, where each row represents a trial with columns:
-                [event type, execution correctness, torque profile, torque magnitude].
+            np.ndarray: Structured array with one record per trial (experiment_schedule.SCHEDULE_DTYPE):
+                event type, execution correctness, torque profile, torque magnitude and condition.
         """
-
-        def generate_trials_for_condition(condition_id, assistance, condition_trial_No, torque_profile, torque_magnitude):
-            """
-            Generates a set of trials for a given experimental condition.
-
-            Args:
-                condition_id: Identifier for the condition.
-                assistance: "assist" or "resist" (determines execution correctness).
-                condition_trial_No: Number of trials for this condition.
-                torque_profile: Profile name or "random".
-                torque_magnitude: Torque value for all trials.
-
-            Returns:
-                np.ndarray: Each row is [event type, execution correctness, torque profile, torque magnitude].
-            """
-            # Split events evenly between "UP" (1) and "DOWN" (0)
-            ones = np.ones(condition_trial_No // 2, dtype=int)
-            zeros = np.zeros(condition_trial_No // 2, dtype=int)
-            events = np.append(ones, zeros)
-
-            # If odd number of trials, add an extra "UP"
-            if condition_trial_No % 2 != 0:
-                events = np.append(events, int(1))  # Extra UP
-
-            # Set execution correctness: 1 for assist, 0 for resist
-            if assistance == "assist":
-                executions = np.ones(condition_trial_No)
-            elif assistance == "resist":
-                executions = np.zeros(condition_trial_No)
-            else:
-                self.logger.error(f"Invalid assistance type: {assistance} in condition {condition_id}.")
-                return None  # Invalid assistance type
-
-            # Assign torque profiles
-            if torque_profile == "random":
-                # Randomly assign a profile for each trial
-                torque_profile_labels = []
-                for i in range(condition_trial_No):
-                    torque_profile_labels.append(random.choice(list(self.profiles_dict.values())))
-            elif torque_profile in self.profiles_dict:
-                # Use the specified profile for all trials
-                torque_profile_labels = [self.profiles_dict[torque_profile]] * condition_trial_No
-            else:
-                self.logger.error(f"Invalid torque profile: {torque_profile} in condition {condition_id}.")
-                return None  # Invalid torque profile
-
-            # Clamp torque magnitude to exoskeleton limit if needed
-            if torque_magnitude > state_dict["exo_parameters"]["torque_limit"]:
-                self.logger.warning(
-                    f"Torque magnitude ({torque_magnitude} Nm) exceeds limit, setting to {state_dict['exo_parameters']['torque_limit']} Nm."
-                )
-                torque_magnitude = state_dict["exo_parameters"]["torque_limit"]
-
-            torque_magnitude_labels = [torque_magnitude] * condition_trial_No
-
-            trial_rules_for_condition = np.column_stack((events, executions, torque_profile_labels, torque_magnitude_labels))
-            np.random.shuffle(trial_rules_for_condition)  # Shuffle trials within the condition
-            return trial_rules_for_condition
-
-        # --- Generate familiarization trials (always incorrect execution) ---
-        familiarization_trials_rules = self.generate_familiarization_trials(state_dict["familiarization_trials_No"])
-        state_dict["familiarization_trial_No"] = familiarization_trials_rules.shape[0]
-
-        # --- Generate end control trials if needed (same as familiarization) ---
-        if state_dict["end_control_trials"] != 0:
-            end_control_trial_rules = self.generate_familiarization_trials(state_dict["end_control_trials"])
-
-        # --- MAIN TRIALS (VARYING EXECUTION CORRECTNESS, TORQUE PROFILE AND TORQUE LEVEL) ---
-        # For each condition, generate the corresponding trials
-        all_condition_trials = []
-        for condition_id, (assist, condition_No, torque_profile, torque) in state_dict["trial_conditions"].items():
-            condition_trials = generate_trials_for_condition(condition_id, assist, condition_No, torque_profile, torque)
-            all_condition_trials.append(condition_trials)
-
-        # --- SHUFFLE MAIN TRIALS ---
-        main_trial_rules = np.vstack(all_condition_trials)
-        if state_dict["randomize_trials"]:
-            np.random.shuffle(main_trial_rules)
-
-        # --- COMBINE ALL TRIALS ---
-        # Stack familiarization, main, and end control trials into one array
-        if state_dict["end_control_trials"] != 0:
-            final_trials = np.vstack((familiarization_trials_rules, main_trial_rules, end_control_trial_rules))
-        else:
-            final_trials = np.vstack((familiarization_trials_rules, main_trial_rules))
+        seed = state_dict.get("schedule_seed")
+        if seed is None:
+            seed = int(np.random.randint(2**31 - 1))
+        generator = ScheduleGenerator(
+            state_dict["trial_conditions"],
+            self.profiles_dict,
+            state_dict["exo_parameters"]["torque_limit"],
+            familiarization_No  =   state_dict["familiarization_trials_No"],
+            end_control_No      =   state_dict["end_control_trials"],
+            randomize           =   state_dict["randomize_trials"],
+            max_run_length      =   state_dict.get("max_same_direction_run", 0),
+            block_size          =   state_dict.get("schedule_block_size", 0),
+            candidates          =   state_dict.get("schedule_candidates", 1000),
+            counterbalance      =   state_dict.get("counterbalance_conditions", False),
+            participant_id      =   state_dict.get("participant_id", 0)
+        )
+        final_trials, info = generator.generate(seed)
+        self.schedule_seed = seed
+        self.logger.info(f"Trial schedule generated: {info}")
 
         # Update state_dict and internal lists for use in the state machine
-        state_dict["trials_No"] = final_trials.shape[0]
-        self.events = final_trials[:, 0]
-        self.correctness_list = final_trials[:, 1]
-        self.torque_profile_list = final_trials[:, 2]
-        self.torque_magnitude_list = final_trials[:, 3]
+        state_dict["familiarization_trial_No"] = state_dict["familiarization_trials_No"]
+        state_dict["trials_No"] = len(final_trials)
+        self.events = final_trials["event"]
+        self.correctness_list = final_trials["correctness"]
+        self.torque_profile_list = final_trials["torque_profile"]
+        self.torque_magnitude_list = final_trials["torque_magnitude"]
 
         return final_trials
@@ -0,0 +1,182 @@
+import math
+import json
+import threading
+from pylsl import local_clock
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in logarithmic bins (constant relative resolution from 1 µs to 10 s),
+    so recording a value is O(1) and percentiles can be read at any time without storing samples.
+    """
+
+    def __init__(self, min_latency: float = 1e-6, max_latency: float = 10.0, bins_per_decade: int = 20):
+        """
+        Initialize the LatencyHistogram class.
+
+        :param min_latency: Upper edge of the first bin in s (smaller values are counted in it).
+        :param max_latency: Lower edge of the last bin in s (larger values are counted in it).
+        :param bins_per_decade: Number of bins per factor of 10 (20 -> ~12 % bin width).
+        """
+        self.min_latency = min_latency
+        self.bins_per_decade = bins_per_decade
+        self.log_min = math.log10(min_latency)
+        self.n_bins = int(math.ceil((math.log10(max_latency) - self.log_min) * bins_per_decade)) + 2
+        self.counts = [0] * self.n_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency: float):
+        """
+        Add a latency (in s) to the histogram.
+        """
+        if latency < self.min_latency:
+            idx = 0
+        else:
+            idx = min(int((math.log10(latency) - self.log_min) * self.bins_per_decade) + 1, self.n_bins - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, q: float):
+        """
+        Return the q-th percentile (0-100) in s, as the geometric centre of the bin it falls in
+        (clipped to the maximum recorded value).
+        """
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                break
+        if idx == 0:
+            return min(self.min_latency, self.max)
+        centre = 10 ** (self.log_min + (idx - 0.5) / self.bins_per_decade)
+        return min(centre, self.max)
+
+    def summary(self):
+        """
+        :return: dict with count, mean, p50, p95, p99 and max latency in ms.
+        """
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(1000 * float(self.total) / self.count, 4),
+            "p50_ms": round(1000 * self.percentile(50), 4),
+            "p95_ms": round(1000 * self.percentile(95), 4),
+            "p99_ms": round(1000 * self.percentile(99), 4),
+            "max_ms": round(1000 * float(self.max), 4),
+        }
+
+class LatencyTracer:
+    """
+    Traces the latency of the control path for every frame (control tick or serial loop iteration):
+    each stage (EXO ingest, band detection, state machine update, rendering, logging, ...) is
+    stamped with local_clock() when it ends and its duration is added to the histogram of that stage.
+    The time from the newest EXO sample (its LSL timestamp, mapped to the local clock) to an instruction
+    being pushed by EXO_stream_out is recorded as the "sample_to_instruction" stage, so it includes the
+    transport from the EXO and the time the sample waited for the frame; the whole frame is recorded
+    as "frame". Only the control thread writes, any thread may read the summary.
+    """
+
+    def __init__(self, clock=local_clock, overlay: bool = False):
+        """
+        Initialize the LatencyTracer class.
+
+        :param clock: Function returning the current time in s (default pylsl.local_clock).
+        :param overlay: If True, the Interface draws the latest summary on the screen.
+        """
+        self.clock = clock
+        self.overlay = overlay
+        self.histograms = {}
+        self.frame_start = None
+        self.last_mark = None
+        self.sample_time = None             # timestamp of the newest EXO sample (local clock)
+        self.lock = threading.Lock()        # only guards creation of new histograms against summary()
+
+    def _record(self, stage: str, latency: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(latency)
+
+    def begin_frame(self):
+        """
+        Start a new frame (call right before EXO_stream_in).
+        """
+        self.frame_start = self.last_mark = self.clock()
+
+    def mark(self, stage: str):
+        """
+        End a stage: record the time since the previous mark (or the start of the frame).
+
+        :param stage: Name of the stage that just finished.
+        """
+        now = self.clock()
+        self._record(stage, now - self.last_mark)
+        self.last_mark = now
+
+    def sample_received(self, timestamp: float):
+        """
+        Note the newest EXO sample (call from EXO ingest).
+
+        :param timestamp: LSL timestamp of the sample, mapped to the local clock.
+        """
+        self.sample_time = timestamp
+
+    def instruction_sent(self):
+        """
+        Record the time from the newest EXO sample to an instruction pushed to EXO.
+        """
+        if self.frame_start is not None and self.sample_time is not None:
+            self._record("sample_to_instruction", self.clock() - self.sample_time)
+
+    def end_frame(self):
+        """
+        Record the duration of the whole frame.
+        """
+        if self.frame_start is not None:
+            self._record("frame", self.clock() - self.frame_start)
+            self.frame_start = None         # instructions sent outside a frame are not traced
+
+    def summary(self):
+        """
+        :return: dict stage name -> histogram summary (see LatencyHistogram.summary()).
+        """
+        with self.lock:
+            histograms = list(self.histograms.items())
+        return {stage: histogram.summary() for stage, histogram in histograms}
+
+    def overlay_lines(self):
+        """
+        :return: list of short text lines (one per stage) for the on-screen overlay.
+        """
+        lines = []
+        for stage, stats in self.summary().items():
+            if stats["count"]:
+                lines.append(f"{stage}: p50 {stats['p50_ms']:.3f} / p99 {stats['p99_ms']:.3f} / max {stats['max_ms']:.3f} ms")
+        return lines
+
+    def save(self, path: str):
+        """
+        Write the per-stage summaries and the raw histogram counts to a JSON file.
+
+        :param path: Output file path.
+        """
+        with self.lock:
+            histograms = list(self.histograms.items())
+        trace = {
+            stage: dict(
+                histogram.summary(),
+                bins={"min_latency_s": histogram.min_latency, "bins_per_decade": histogram.bins_per_decade, "counts": list(histogram.counts)}
+            )
+            for stage, histogram in histograms
+        }
+        with open(path, "w") as trace_file:
+            json.dump(trace, trace_file, indent=4)
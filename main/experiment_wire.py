@@ -0,0 +1,171 @@
+import json
+import math
+from pylsl import StreamInfo, cf_string, cf_double64
+
+# Wire formats of the ExperimentEvents and PredictionStream streams
+WIRE_FORMATS = {"json", "numeric"}
+# Version of the numeric layouts, advertised in the stream description
+NUMERIC_ENCODING = "eduexo-numeric-v1"
+
+# Channels of a numeric event sample: (label, type, unit)
+EVENT_CHANNELS = (
+    ("event_id", "trigger", "n/a"),
+    ("torque_profile", "profile_id", "n/a"),         # NaN when no profile is set
+    ("torque_magnitude", "torque", "Nm"),           # NaN when no magnitude is set
+    ("event_timestamp", "timestamp", "s"),          # local_clock() of the event, same as the sample timestamp
+)
+# Channels of a numeric prediction sample: (label, type, unit)
+PREDICTION_CHANNELS = (
+    ("class_id", "class", "n/a"),
+    ("confidence", "probability", "n/a"),           # NaN if the decoder does not report one
+    ("decoder_timestamp", "timestamp", "s"),        # decoder's local_clock() when the prediction was made
+)
+# Class IDs of numeric predictions, unless the stream description lists its own classes
+PREDICTION_CLASSES = {0: "DOWN", 1: "UP"}
+# Torque profile IDs (as sent to the EXO) and their names (as in the state dictionary and JSON events)
+TORQUE_PROFILES = {0: "trapezoid", 1: "triangular", 2: "sinusoide", 3: "rectangular", 4: "smoothed_trapezoid"}
+TORQUE_PROFILE_IDS = {name: profile_id for profile_id, name in TORQUE_PROFILES.items()}
+
+def add_schema(info: StreamInfo, channels: tuple, classes: dict = None, profiles: dict = None):
+    """
+    Describe a numeric stream layout in the stream's desc(): encoding version, one <channel> per channel
+    and optionally the class ID -> name or torque profile ID -> name table.
+
+    :param info: StreamInfo to describe.
+    :param channels: Tuple of (label, type, unit).
+    :param classes: Class ID -> name (predictions only).
+    :param profiles: Torque profile ID -> name (events only).
+    """
+    desc = info.desc()
+    desc.append_child_value("encoding", NUMERIC_ENCODING)
+    channels_desc = desc.append_child("channels")
+    for label, channel_type, unit in channels:
+        channel = channels_desc.append_child("channel")
+        channel.append_child_value("label", label)
+        channel.append_child_value("type", channel_type)
+        channel.append_child_value("unit", unit)
+    if classes is not None:
+        classes_desc = desc.append_child("classes")
+        for class_id, name in classes.items():
+            class_desc = classes_desc.append_child("class")
+            class_desc.append_child_value("id", str(class_id))
+            class_desc.append_child_value("name", name)
+    if profiles is not None:
+        profiles_desc = desc.append_child("torque_profiles")
+        for profile_id, name in profiles.items():
+            profile_desc = profiles_desc.append_child("profile")
+            profile_desc.append_child_value("id", str(profile_id))
+            profile_desc.append_child_value("name", name)
+
+def event_stream_info(wire_format: str):
+    """
+    Return the StreamInfo of the ExperimentEvents stream: one JSON string channel, or the numeric
+    EVENT_CHANNELS layout with its schema.
+
+    :param wire_format: "json" or "numeric".
+    """
+    assert wire_format in WIRE_FORMATS, f"Wire format has to be one of {WIRE_FORMATS}!"
+    if wire_format == "json":
+        info = StreamInfo('ExperimentEvents', 'Events', 1, 0, 'string', 'Eduexo_PC1')
+        channel = info.desc().append_child("channels").append_child("channel")
+        channel.append_child_value("label", "event_marker")
+        channel.append_child_value("type", "trigger")
+        channel.append_child_value("unit", "n/a")
+    else:
+        info = StreamInfo('ExperimentEvents', 'Events', len(EVENT_CHANNELS), 0, cf_double64, 'Eduexo_PC1')
+        add_schema(info, EVENT_CHANNELS, profiles=TORQUE_PROFILES)
+    return info
+
+def _number(value):
+    """
+    Return value as float, NaN for anything that is not a number (e.g. "None").
+    """
+    return float(value) if isinstance(value, (int, float)) else math.nan
+
+def encode_event(event_data: dict, wire_format: str):
+    """
+    Encode an event dictionary (as queued by LSLHandler.notify_event) as an ExperimentEvents sample.
+
+    :param event_data: Event dictionary.
+    :param wire_format: "json" or "numeric".
+    :return: Sample (list with one JSON string, or with the EVENT_CHANNELS values).
+    """
+    if wire_format == "json":
+        return [json.dumps(event_data)]
+    profile_id = TORQUE_PROFILE_IDS.get(event_data['TorqueProfile'], math.nan)
+    return [float(event_data['Event_ID']), float(profile_id), _number(event_data['TorqueMagnitude']), event_data['Event_Timestamp']]
+
+def decode_event(sample: list):
+    """
+    Decode an ExperimentEvents sample (either wire format) into the fields of the event dictionary.
+    Numeric samples carry no event type, it is None.
+
+    :param sample: Sample pulled from the ExperimentEvents stream.
+    :return: dict with Event_ID, Event_Type, TorqueProfile, TorqueMagnitude and Event_Timestamp.
+    """
+    if isinstance(sample[0], str):
+        event_data = json.loads(sample[0])
+        return {key: event_data.get(key) for key in ('Event_ID', 'Event_Type', 'TorqueProfile', 'TorqueMagnitude', 'Event_Timestamp')}
+    event_id, profile_id, torque_magnitude, event_timestamp = sample[:4]
+    return {
+        'Event_ID': int(event_id),
+        'Event_Type': None,
+        'TorqueProfile': "None" if math.isnan(profile_id) else TORQUE_PROFILES.get(int(profile_id), str(int(profile_id))),
+        'TorqueMagnitude': "None" if math.isnan(torque_magnitude) else torque_magnitude,
+        'Event_Timestamp': event_timestamp,
+    }
+
+class PredictionDecoder:
+    """
+    Decodes samples of the PredictionStream. The encoding is read from the stream itself: string streams
+    carry one JSON object per sample (older decoders), numeric streams use PREDICTION_CHANNELS with the
+    class table from their description (PREDICTION_CLASSES if none is given).
+    """
+
+    def __init__(self, info: StreamInfo):
+        """
+        Initialize the PredictionDecoder class.
+
+        :param info: Full StreamInfo of the prediction stream (StreamInlet.info(), including desc()).
+        """
+        self.numeric = info.channel_format() != cf_string
+        self.classes = dict(PREDICTION_CLASSES)
+        if self.numeric:
+            classes_desc = info.desc().child("classes")
+            if not classes_desc.empty():
+                self.classes = {}
+                class_desc = classes_desc.child("class")
+                while not class_desc.empty():
+                    self.classes[int(class_desc.child_value("id"))] = class_desc.child_value("name")
+                    class_desc = class_desc.next_sibling("class")
+
+    def decode(self, sample: list):
+        """
+        :param sample: Sample pulled from the prediction stream.
+        :return: Tuple (predicted event name, confidence or None, decoder timestamp or None).
+        """
+        if not self.numeric:
+            prediction_data = json.loads(sample[0])
+            timestamp = prediction_data.get("timestamp")
+            return prediction_data["predicted_event_name"], prediction_data.get("confidence"), timestamp if isinstance(timestamp, (int, float)) else None
+        class_id, confidence, decoder_timestamp = (list(sample) + [math.nan] * 3)[:3]
+        return (
+            self.classes.get(int(class_id), str(int(class_id))),
+            None if math.isnan(confidence) else confidence,
+            None if math.isnan(decoder_timestamp) else decoder_timestamp,
+        )
+
+def prediction_stream_info(wire_format: str, classes: dict = None, source_id: str = ""):
+    """
+    Return the StreamInfo of a PredictionStream outlet (for decoders and test scripts).
+
+    :param wire_format: "json" or "numeric".
+    :param classes: Class ID -> name (numeric only, default PREDICTION_CLASSES).
+    :param source_id: Unique source ID of the classifier, lets inlets recover the stream when the classifier restarts.
+    """
+    assert wire_format in WIRE_FORMATS, f"Wire format has to be one of {WIRE_FORMATS}!"
+    if wire_format == "json":
+        return StreamInfo("PredictionStream", "", 1, 0, "string", source_id)
+    info = StreamInfo("PredictionStream", "Predictions", len(PREDICTION_CHANNELS), 0, cf_double64, source_id)
+    add_schema(info, PREDICTION_CHANNELS, PREDICTION_CLASSES if classes is None else classes)
+    return info
@@ -1,12 +1,28 @@
-from pylsl import StreamInfo, StreamOutlet, local_clock
+import os
+import sys
+import argparse
+from pylsl import StreamOutlet, local_clock
 import json
 import random
-from time import sleep 
-info = StreamInfo("PredictionStream", "",1, 0,"string")
+from time import sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+from experiment_wire import prediction_stream_info, PREDICTION_CLASSES
+
+parser = argparse.ArgumentParser(description="Send synthetic predictions on the PredictionStream.")
+parser.add_argument("--numeric", action="store_true", help="Send numeric samples [class_id, confidence, decoder_timestamp] instead of JSON strings")
+args = parser.parse_args()
+
+info = prediction_stream_info("numeric" if args.numeric else "json")
 outlet = StreamOutlet(info)
 data_sample = {"classifier_name": "ClassifierName", "timestamp": "2025-03-13 12:23:07", "predicted_event_name": "bbbb", "true_event_name": "bbbb", "event_type": "bbbb"}
 while True:
     input("Press enter to send a prediction sample")
+    if args.numeric:
+        sample = [random.choice(list(PREDICTION_CLASSES)), random.random(), local_clock()]
+        outlet.push_sample(sample, timestamp=local_clock())
+        print(sample)
+        continue
     data_sample["timestamp"] = local_clock()
     data_sample["true_event_name"] = random.choice([0,1])
     data_sample["predicted_event_name"] = random.choice(["UP","DOWN"])
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+from pylsl import StreamOutlet, StreamInlet, resolve_byprop
+from experiment_LSL import LSLHandler
+from experiment_simulation import Simulation, set_trial_count
+from experiment_wire import WIRE_FORMATS, event_stream_info, encode_event, decode_event
+
+def record_events(experiment_config, trials, seed):
+    """
+    Run a simulated session and return the event dictionaries built by LSLHandler.notify_event()
+    (the ones the streamer thread would encode and push).
+    """
+    set_trial_count(experiment_config, trials)
+    simulation = Simulation(experiment_config, seed=seed)
+    LSL = simulation.LSL
+    simulated_notify = LSL.notify_event
+
+    def notify_event(state_dict):
+        last_notified_event = LSL.last_notified_event
+        LSLHandler.notify_event(LSL, state_dict)
+        LSL.last_notified_event = last_notified_event
+        simulated_notify(state_dict)
+
+    LSL.notify_event = notify_event
+    simulation.run()
+    return [LSL.event_queue.get() for _ in range(LSL.event_queue.qsize())]
+
+def round_trip(events, wire_format):
+    """
+    Push the events through an ExperimentEvents outlet, pull them from an inlet and return the mismatches.
+    """
+    outlet = StreamOutlet(event_stream_info(wire_format))
+    inlet = StreamInlet(resolve_byprop('name', 'ExperimentEvents', timeout=5)[0])
+    inlet.open_stream(timeout=5)
+    for event_data in events:
+        outlet.push_sample(encode_event(event_data, wire_format), event_data['Event_Timestamp'])
+
+    mismatches = []
+    for event_data in events:
+        sample, _ = inlet.pull_sample(timeout=5)
+        decoded = decode_event(sample)
+        for key, value in decoded.items():
+            if value is not None and value != event_data[key]:
+                mismatches.append((event_data['Event_ID'], key, event_data[key], value))
+    inlet.close_stream()
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that events of a simulated session decode to what was sent, in every wire format.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "experiment_config.json"), help="Experiment configuration file")
+    parser.add_argument("--trials", type=int, default=6, help="Number of simulated trials")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    events = record_events(json.load(open(args.config, "r")), args.trials, args.seed)
+    profiles = sorted({str(event_data['TorqueProfile']) for event_data in events})
+    print(f"{len(events)} events, torque profiles {profiles}")
+    failed = False
+    for wire_format in sorted(WIRE_FORMATS):
+        mismatches = round_trip(events, wire_format)
+        print(f"{wire_format:>8}: {'OK' if not mismatches else f'{len(mismatches)} mismatches, e.g. {mismatches[:3]}'}")
+        failed = failed or bool(mismatches)
+    sys.exit(1 if failed else 0)
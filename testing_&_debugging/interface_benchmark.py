@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+import pygame
+from experiment_interface import Interface
+from experiment_simulation import Simulation, set_trial_count
+from experiment_tracing import LatencyHistogram
+
+def benchmark(experiment_config, width, height, dirty, trials, seed):
+    """
+    Render a simulated session at 60 frames per (simulated) second and return the frame time summary
+    (update + draw + present, without waiting for the next frame).
+    """
+    set_trial_count(experiment_config, trials)
+    simulation = Simulation(experiment_config, seed=seed, dt=1/60)
+    state_dict = simulation.state_dict
+    state_dict["dirty_rect_rendering"] = dirty
+    interface = Interface(
+        state_dict  =   state_dict,
+        width       =   width,
+        height      =   height,
+        maxP        =   state_dict["exo_parameters"]["maximum_arm_position_deg"],
+        minP        =   state_dict["exo_parameters"]["minimum_arm_position_deg"]
+    )
+    simulation.keys.press(pygame.K_RETURN, at=0.5)
+
+    frame_times = LatencyHistogram()
+    while not simulation.step() and state_dict["current_state"] != "EXIT":
+        frame_start = perf_counter()
+        dot_pos = interface.update(dict(state_dict))
+        interface.draw(dot_pos)
+        interface.present()
+        frame_times.record(perf_counter() - frame_start)
+        pygame.event.pump()
+
+    summary = frame_times.summary()
+    summary.update({name: value for name, value in interface.frame_time_summary().items() if name in {"full_frames", "mean_updated_area"}})
+    pygame.display.quit()
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare frame times of full-window and dirty-rect rendering on a simulated session.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "experiment_config.json"), help="Experiment configuration file")
+    parser.add_argument("--width", type=int, default=1280, help="Window width")
+    parser.add_argument("--height", type=int, default=820, help="Window height")
+    parser.add_argument("--trials", type=int, default=10, help="Number of simulated trials")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    for dirty in (False, True):
+        experiment_config = json.load(open(args.config, "r"))
+        summary = benchmark(experiment_config, args.width, args.height, dirty, args.trials, args.seed)
+        print(f"{'dirty rects' if dirty else 'full window':<12} {summary}")
@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+from experiment_logging import Logger
+
+N_ROWS = 200000
+
+# Typical values of the experiment data columns (columns not listed are 0.0)
+EXAMPLE_VALUES = {
+    "current_position": 101.12345,
+    "current_velocity": -3.5,
+    "desired_torque": 0.5,
+    "demanded_torque": 0.4,
+    "current_torque": 0.45,
+    "measured_torque": 0.47,
+    "event_id": 12,
+    "event_type": "execute_UP",
+    "timestamp": 12345.678901,
+    "timestamp_corrected": 12345.679312,
+    "prediction": "execute_UP",
+}
+
+def legacy_save_datapoint(data_dict, column_names, data_file):
+    """
+    Row writer as it was before the schema compiler (column names parsed for every row).
+    """
+    datapoint_to_write = []
+    for column_name in column_names:
+        column_split = column_name.split(".")
+
+        current = data_dict
+        for column_substring in column_split:
+            if column_substring.isdigit():
+                column_substring = int(column_substring)
+            current = current[column_substring]
+
+        datapoint_to_write.append(str(current))
+
+    data_file.write("\t".join(datapoint_to_write) + "\n")
+
+def make_logger(results_path, data_dict):
+    """
+    Create a synchronous TSV Logger with the given data dictionary layout.
+    """
+    logger = Logger(results_path, "benchmark", 0, no_log=False, save_data=True)
+    logger.data_dict = data_dict
+    logger.create_file()
+    return logger
+
+def current_columns(results_path):
+    """
+    Return the column names of the experiment data file written by the Logger.
+    """
+    logger = Logger(results_path, "benchmark_schema", 0, no_log=False, save_data=True)
+    logger.create_file()
+    logger.close()
+    return logger.column_names
+
+def benchmark(name, data_dict, results_path):
+    """
+    Print rows/sec for the legacy row writer and for Logger.save_datapoint.
+    """
+    logger = make_logger(results_path, data_dict)
+
+    with open(os.devnull, "w") as devnull:
+        start = perf_counter()
+        for _ in range(N_ROWS):
+            legacy_save_datapoint(logger.data_dict, logger.column_names, devnull)
+        legacy_rate = N_ROWS / (perf_counter() - start)
+
+    logger.data_file.close()
+    logger.data_file = open(os.devnull, "w")
+    start = perf_counter()
+    for _ in range(N_ROWS):
+        logger.save_datapoint()
+    compiled_rate = N_ROWS / (perf_counter() - start)
+    logger.close()
+
+    print(f"{name:<40} {len(logger.column_names):>4} columns   before: {legacy_rate:>10.0f} rows/s   after: {compiled_rate:>10.0f} rows/s   ({compiled_rate / legacy_rate:.1f}x)")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as results_path:
+        # Current experiment schema (the columns the Logger writes), filled with typical values
+        current_schema = {name: EXAMPLE_VALUES.get(name, 0.0) for name in current_columns(results_path)}
+        benchmark("current schema", current_schema, results_path)
+
+        # 64 columns: 16 scalars + 3 array fields of 16 elements each
+        wide_schema = {f"scalar_{idx}": float(idx) for idx in range(16)}
+        wide_schema["emg"] = np.linspace(0, 1, 16)
+        wide_schema["force"] = list(range(16))
+        wide_schema["imu"] = tuple(float(idx) for idx in range(16))
+        benchmark("64-column schema with array fields", wide_schema, results_path)
@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+from experiment_state_machine import StateMachine
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def drawio_edges(path):
+    """
+    Read the (uncompressed) draw.io diagram and return the set of (source, target) state-name edges.
+    Boxes are matched to states by their title ("IN MIDDLE CIRCLE" -> IN_MIDDLE_CIRCLE); edges
+    attached to a row inside a box count as edges of that box, and edges passing through
+    unnamed shapes (decisions) are followed to the next state box.
+    """
+    cells = {cell.get("id"): cell for cell in ET.parse(path).getroot().iter("mxCell")}
+    state_names = set(StateMachine.STATE_NAMES)
+
+    def state_of(cell_id):
+        while cell_id in cells:
+            name = re.sub(r"<[^>]*>", "", cells[cell_id].get("value") or "").strip().replace(" ", "_")
+            if name in state_names:
+                return name
+            cell_id = cells[cell_id].get("parent")
+        return None
+
+    # Follow edges through unnamed shapes (decision nodes) until a state box is reached
+    successors = {}
+    for cell in cells.values():
+        if cell.get("edge") == "1" and cell.get("source") and cell.get("target"):
+            source = state_of(cell.get("source")) or cell.get("source")
+            successors.setdefault(source, set()).add(state_of(cell.get("target")) or cell.get("target"))
+
+    edges = set()
+    for source in state_names & set(successors):
+        stack, seen = list(successors[source]), set()
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            if node in state_names:
+                edges.add((source, node))
+            else:
+                stack.extend(successors.get(node, ()))
+    return edges
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the StateMachine transition graph and compare it with the draw.io diagram.")
+    parser.add_argument("--dot", default=None, help="Write the graph to this Graphviz .dot file")
+    parser.add_argument("--drawio", default=os.path.join(REPO_PATH, "state_machine_diagram.drawio"), help="Diagram to compare with")
+    args = parser.parse_args()
+
+    if args.dot:
+        StateMachine.export_transition_graph(args.dot)
+        print(f"Graph written to {args.dot}")
+
+    code_edges = StateMachine.transition_edges()
+    for source, target, condition in code_edges:
+        print(f"{source:<22} -> {target:<22} [{condition}]")
+
+    # Only edges between two named states can be compared with the diagram
+    code_pairs = {(source, target) for source, target, _ in code_edges if source in StateMachine.STATE_NAMES and target in StateMachine.STATE_NAMES}
+    diagram_pairs = drawio_edges(args.drawio)
+    print("\nIn code, not in diagram:")
+    for source, target in sorted(code_pairs - diagram_pairs):
+        print(f"    {source} -> {target}")
+    print("In diagram, not in code:")
+    for source, target in sorted(diagram_pairs - code_pairs):
+        print(f"    {source} -> {target}")